@@ -60,6 +60,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # allauth
     "allauth",
     "allauth.account",
@@ -70,6 +71,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    "syllabooster.middleware.metrics_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -116,6 +118,49 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+#
+# Rendered unit pages are cached per course version. Set DJANGO_CACHE_URL to
+# e.g. filecache:///var/tmp/syllaboost_cache to share the cache between workers.
+# A shared cache also lets edits of delivery states reach the other workers
+# right away, instead of within a minute (see utils/statemachine.py).
+
+CACHES = {"default": env.cache("DJANGO_CACHE_URL", default="locmemcache://syllaboost")}
+
+FRAGMENT_CACHE_TIMEOUT = env.int("DJANGO_FRAGMENT_CACHE_TIMEOUT", default=86400)
+# Units or points per page of the unit list and unit pages.
+LIST_PAGE_SIZE = env.int("LIST_PAGE_SIZE", default=100)
+
+
+# Metrics
+#
+# Per-view metrics are served at /metrics/ in the Prometheus text format, only
+# to these addresses and never to proxied requests.
+
+METRICS_ALLOWED_IPS = env.list("METRICS_ALLOWED_IPS", default=["127.0.0.1", "::1"])
+# Directory where each worker process saves its metrics, so that a scrape of
+# any of them serves the metrics of all. Empty to serve only the metrics of
+# the process answering the scrape.
+METRICS_DIR = env("METRICS_DIR", default="")
+
+
+# Import
+
+# Worker processes used to parse uploaded courses off the request thread.
+IMPORT_PARSE_WORKERS = env.int("IMPORT_PARSE_WORKERS", default=2)
+# Where the org files sent to the import API are kept until a worker
+# imports them. It must be shared by the web server and the workers.
+IMPORT_SPOOL_DIR = env("IMPORT_SPOOL_DIR", default=os.path.join(BASE_DIR, "imports"))
+# Largest org or Markdown file accepted by the import API, in bytes.
+IMPORT_MAX_UPLOAD_SIZE = env.int("IMPORT_MAX_UPLOAD_SIZE", default=256 * 1024 * 1024)
+# Render the HTML of the imported points after each import, in a job of the
+# import worker using PRERENDER_WORKERS processes, instead of on their first
+# visit.
+PRERENDER_AFTER_IMPORT = env.bool("PRERENDER_AFTER_IMPORT", default=True)
+PRERENDER_WORKERS = env.int("PRERENDER_WORKERS", default=2)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -9,17 +9,126 @@ from .models import (
     SyllabusPoint,
     Course,
     CoursePoint,
+    CourseChange,
     Unit,
+    ImportJob,
 )
+from .utils.changelog import record_course_changes
+
+
+class CourseVersionAdmin(admin.ModelAdmin):
+    """Bumps the version of the courses affected by admin edits, so their
+    cached pages are rendered again.
+
+    'course_lookup' is the lookup from Course to the model, or None if
+    every course is affected. If 'change_kind' is set, the edited objects
+    are also logged as changes of their courses (see utils/changelog.py).
+    'coursepoint_lookup' is the lookup from CoursePoint to the model, if
+    deleting objects deletes their course points, which are then logged
+    as deleted too."""
+
+    course_lookup = None
+    change_kind = None
+    coursepoint_lookup = None
+
+    def affected_courses(self, objects):
+        if self.course_lookup is None:
+            return Course.objects.all()
+        return Course.objects.filter(**{f"{self.course_lookup}__in": objects})
+
+    def bump_versions(self, objects, deleted=False, previous_courses=()):
+        """'previous_courses' are the ids of the courses of the objects
+        before an edit: those they have left are bumped too, and the objects
+        logged there as deleted."""
+        if self.change_kind is None:
+            Course.bump_versions(
+                pk__in=set(self.affected_courses(objects).values_list("pk", flat=True))
+                | set(previous_courses)
+            )
+            return
+        changes_by_course = {}
+        for course_id, object_id in self.affected_courses(objects).values_list(
+            "pk", self.course_lookup
+        ):
+            changes_by_course.setdefault(course_id, []).append(
+                (self.change_kind, object_id, deleted)
+            )
+        for course_id in set(previous_courses) - set(changes_by_course):
+            changes_by_course[course_id] = [
+                (self.change_kind, object_id, True) for object_id in objects
+            ]
+        if deleted and self.coursepoint_lookup is not None:
+            for course_id, coursepoint_id in CoursePoint.objects.filter(
+                **{f"{self.coursepoint_lookup}__in": objects}
+            ).values_list("course_id", "pk"):
+                changes_by_course.setdefault(course_id, []).append(
+                    (CourseChange.COURSEPOINT, coursepoint_id, True)
+                )
+        record_course_changes(changes_by_course)
+
+    def save_model(self, request, obj, form, change):
+        if change and self.course_lookup is not None:
+            # The courses of the object before it is saved, in case it is
+            # moved to another one.
+            obj._previous_course_ids = set(
+                self.affected_courses([obj.pk]).values_list("pk", flat=True)
+            )
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        # Bumped once the many-to-many fields and inlines are saved too, so
+        # that no page is cached under the new version without them.
+        super().save_related(request, form, formsets, change)
+        obj = form.instance
+        self.bump_versions(
+            [obj.pk], previous_courses=getattr(obj, "_previous_course_ids", ())
+        )
+
+    def delete_model(self, request, obj):
+        self.bump_versions([obj.pk], deleted=True)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        self.bump_versions(queryset, deleted=True)
+        super().delete_queryset(request, queryset)
+
+
+@admin.register(Course)
+class CourseAdmin(CourseVersionAdmin):
+    course_lookup = "pk"
+
+
+@admin.register(Unit)
+class UnitAdmin(CourseVersionAdmin):
+    course_lookup = "unit"
+    change_kind = CourseChange.UNIT
+    coursepoint_lookup = "unit"
+
+
+@admin.register(CoursePoint)
+class CoursePointAdmin(CourseVersionAdmin):
+    course_lookup = "coursepoint"
+    change_kind = CourseChange.COURSEPOINT
+
+
+@admin.register(Point)
+class PointAdmin(CourseVersionAdmin):
+    course_lookup = "coursepoint__point"
+    change_kind = CourseChange.POINT
+    coursepoint_lookup = "point"
+
+
+@admin.register(PointType)
+class PointTypeAdmin(CourseVersionAdmin):
+    pass
+
+
+@admin.register(DeliveryState)
+class DeliveryStateAdmin(CourseVersionAdmin):
+    pass
 
-# Register your models here.
 
 admin.site.register(Tag)
-admin.site.register(PointType)
-admin.site.register(DeliveryState)
-admin.site.register(Point)
 admin.site.register(Syllabus)
 admin.site.register(SyllabusPoint)
-admin.site.register(Course)
-admin.site.register(CoursePoint)
-admin.site.register(Unit)
+admin.site.register(ImportJob)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class SyllaboosterConfig(AppConfig):
     name = "syllabooster"
+
+    def ready(self):
+        from .signals import connect_signals
+
+        connect_signals()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# Adds a command to manage.py to benchmark the import, export and views of
+# synthetic courses of several sizes.
+#
+# Command arguments:
+# - -u,--user: the user the courses are imported for;
+# - -s,--sizes: numbers of units of the courses (e.g. -s 10 100 10000);
+# - -p,--points: average number of points per unit;
+# - --seed: seed of the generator (the same seed gives the same courses);
+# - -c,--clicks: number of cycle_state requests per run;
+# - -r,--repeat: number of runs of each step (the best one is reported);
+# - --no-memory: don't measure peak memory (it takes one more run per step);
+# - -o,--output: file to write the results to as JSON.
+#
+# For each size, the command imports a course with parse_org, renumbers it,
+# exports it, cycles the state of random points and renders a unit and a
+# course point. It records the wall time, the number of queries and the peak
+# memory (of Python allocations, measured with tracemalloc in a separate run,
+# since tracing slows everything down) of each step. Keep the JSON files of
+# two commits to compare them.
+#
+# The command works on its own "benchmark" courses, which are deleted with
+# their points before each import and at the end: points are shared by
+# headline, so leftover points would turn the imports of later runs into
+# updates.
+
+import io
+import json
+import random
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from syllabooster.models import *
+from syllabooster.utils import importstr
+from syllabooster.utils.exportcourse import export_course_org
+from syllabooster.utils.renumber import renumber_points
+from syllabooster.utils.synthetic import synthetic_org
+
+
+def delete_courses(courses):
+    """Delete 'courses' and the points that no other course or syllabus
+    has."""
+    Point.objects.filter(coursepoint__course__in=courses).exclude(
+        pk__in=CoursePoint.objects.exclude(course__in=courses).values("point")
+    ).exclude(pk__in=SyllabusPoint.objects.values("point")).delete()
+    courses.delete()
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Benchmarks import, export and views on synthetic courses"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-u", "--user", default="manuel")
+        parser.add_argument(
+            "-s", "--sizes", type=int, nargs="+", default=[10, 100], help="Units"
+        )
+        parser.add_argument("-p", "--points", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("-c", "--clicks", type=int, default=100)
+        parser.add_argument("-r", "--repeat", type=int, default=1)
+        parser.add_argument("--no-memory", action="store_true")
+        parser.add_argument("-o", "--output", help="JSON output file")
+
+    def measure(self, name, function, setup=None, calls=1):
+        """Run 'function' 'calls' times per run and return its best time, its
+        queries and its peak memory."""
+        best = None
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for _ in range(calls):
+                    function()
+                elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        result = {"calls": calls, "time": best, "queries": len(queries) / calls}
+        if self.memory:
+            if setup is not None:
+                setup()
+            tracemalloc.start()
+            try:
+                for _ in range(calls):
+                    function()
+                result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        self.stdout.write(
+            f"  {name}: {best / calls * 1000:.1f} ms per call, "
+            f"{result['queries']:.1f} queries"
+            + (
+                f", {result['peak_memory'] / (1024 * 1024):.1f} MB peak"
+                if self.memory
+                else ""
+            )
+        )
+        return result
+
+    def benchmark_size(self, user, units, options):
+        org = synthetic_org(units, options["points"], seed=options["seed"])
+        course_name = f"benchmark-{units}"
+        course = None
+
+        def new_course():
+            nonlocal course
+            delete_courses(Course.objects.filter(user=user, name=course_name))
+            course = Course.objects.create(name=course_name, user=user)
+
+        steps = {}
+        steps["parse_org"] = self.measure(
+            "parse_org",
+            lambda: importstr.parse_org(course, org, user, output=io.StringIO()),
+            setup=new_course,
+        )
+        steps["renumber_points"] = self.measure(
+            "renumber_points", lambda: renumber_points(course)
+        )
+        steps["export_course_org"] = self.measure(
+            "export_course_org",
+            lambda: sum(len(chunk) for chunk in export_course_org(course)),
+        )
+
+        coursepoint_ids = list(
+            CoursePoint.objects.filter(course=course)
+            .order_by("position")
+            .values_list("id", flat=True)
+        )
+        unit_ids = list(
+            Unit.objects.filter(course=course)
+            .order_by("position")
+            .values_list("id", flat=True)
+        )
+        generator = random.Random(options["seed"])
+        client = Client()
+        client.force_login(user)
+
+        def click():
+            response = client.post(
+                reverse("syllabooster:cyclestate"),
+                {"coursepointId": generator.choice(coursepoint_ids)},
+                content_type="application/json",
+            )
+            if response.status_code != 200:
+                raise CommandError(f"cycle_state failed: {response.content!r}")
+
+        def get(url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"GET {url} returned {response.status_code}")
+
+        steps["cycle_state"] = self.measure(
+            "cycle_state", click, calls=options["clicks"]
+        )
+        unit_url = reverse(
+            "syllabooster:unit",
+            kwargs={"course": course.id, "unit": unit_ids[len(unit_ids) // 2]},
+        )
+        steps["UnitView"] = self.measure("UnitView", lambda: get(unit_url))
+        coursepoint_url = reverse(
+            "syllabooster:coursepointdetail",
+            args=[coursepoint_ids[len(coursepoint_ids) // 2]],
+        )
+        steps["CoursePointView"] = self.measure(
+            "CoursePointView", lambda: get(coursepoint_url)
+        )
+        return {
+            "units": units,
+            "points": len(coursepoint_ids),
+            "megabytes": len(org.encode()) / (1024 * 1024),
+            "steps": steps,
+        }
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist' % options["user"])
+        self.repeat = options["repeat"]
+        self.memory = not options["no_memory"]
+
+        results = {
+            "commit": current_commit(),
+            "database": connection.vendor,
+            "seed": options["seed"],
+            "points_per_unit": options["points"],
+            "sizes": [],
+        }
+        try:
+            # The test client talks to the views in-process, as "testserver".
+            with override_settings(ALLOWED_HOSTS=["testserver"]):
+                for units in options["sizes"]:
+                    self.stdout.write(f"{units} units:")
+                    results["sizes"].append(self.benchmark_size(user, units, options))
+        finally:
+            delete_courses(
+                Course.objects.filter(user=user, name__startswith="benchmark-")
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
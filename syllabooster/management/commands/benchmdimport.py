@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+# Adds a command to manage.py to compare the speed of the Markdown import with
+# the org one on equivalent synthetic courses.
+#
+# Command arguments:
+# - -u,--user: the user the courses are imported for;
+# - --units, --points: size of the synthetic courses;
+# - -r,--repeat: number of runs of each step (the best one is reported);
+# - -o,--output: file to write the results to as JSON.
+#
+# For each format, the command times parsing alone and the whole streamed
+# import (parsing and writing, as importcourse does for a single file) into
+# a new course. Both formats must give the same units and points (contents
+# aside, since they are kept in their own markup): the command fails
+# otherwise. The command works on its own "benchmdimport" courses, which are
+# deleted at the end.
+
+import io
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from syllabooster.models import *
+from syllabooster.utils.bulkimport import (
+    COURSE_PARSERS,
+    iter_course_units,
+    write_course_units,
+)
+from syllabooster.utils.synthetic import synthetic_md, synthetic_org
+
+
+def structure(parsed):
+    """The units and points of a ParsedCourse, leaving out the contents."""
+    return (
+        [vars(unit) for unit in parsed.units],
+        [
+            {key: value for key, value in vars(point).items() if key != "contents"}
+            for point in parsed.points
+        ],
+    )
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+class Command(BaseCommand):
+    help = "Compares the speed of the Markdown import with the org one"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-u", "--user", default="manuel")
+        parser.add_argument("--units", type=int, default=40)
+        parser.add_argument("--points", type=int, default=50)
+        parser.add_argument("-r", "--repeat", type=int, default=3)
+        parser.add_argument("-o", "--output", help="JSON output file")
+
+    def import_time(self, user, input_format, input_string, repeat):
+        def import_course():
+            course = Course.objects.create(
+                name=f"benchmdimport-{input_format}", user=user
+            )
+            try:
+                return write_course_units(
+                    course,
+                    iter_course_units(
+                        io.StringIO(input_string), input_format, numbering="sequential"
+                    ),
+                    include_orphans=True,
+                    prune=True,
+                )
+            finally:
+                course.delete()
+
+        return best_time(import_course, repeat)[0]
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist' % options["user"])
+        Course.objects.filter(user=user, name__startswith="benchmdimport").delete()
+
+        inputs = {
+            "org": synthetic_org(options["units"], options["points"], rich=True),
+            "md": synthetic_md(options["units"], options["points"], rich=True),
+        }
+        results = {
+            "units": options["units"],
+            "points": options["points"],
+            "formats": {},
+        }
+        parsed_courses = {}
+        for input_format, input_string in inputs.items():
+            parse_time, parsed_courses[input_format] = best_time(
+                lambda: COURSE_PARSERS[input_format](input_string), options["repeat"]
+            )
+            import_time = self.import_time(
+                user, input_format, input_string, options["repeat"]
+            )
+            megabytes = len(input_string.encode()) / (1024 * 1024)
+            results["formats"][input_format] = {
+                "megabytes": megabytes,
+                "parse": parse_time,
+                "import": import_time,
+            }
+            self.stdout.write(
+                f"{input_format}: {megabytes:.1f} MB, parsed in {parse_time:.2f} s "
+                f"({megabytes / parse_time:.1f} MB/s), imported in {import_time:.2f} s"
+            )
+        if structure(parsed_courses["org"]) != structure(parsed_courses["md"]):
+            raise CommandError("The org and Markdown courses differ")
+
+        formats = results["formats"]
+        results["parse_ratio"] = formats["md"]["parse"] / formats["org"]["parse"]
+        results["import_ratio"] = formats["md"]["import"] / formats["org"]["import"]
+        self.stdout.write(
+            f"Markdown takes {results['parse_ratio']:.1f}x the time of org to parse "
+            f"and {results['import_ratio']:.1f}x to import."
+        )
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
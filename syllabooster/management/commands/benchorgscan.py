@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Adds a command to manage.py to compare the speed of the org scanner used by
+# the importers with orgparse.
+#
+# Command arguments:
+# - inputfilename: (optional) the org file to parse;
+# - -s,--size: size in MB of the synthetic course parsed when no file is given;
+# - -r,--repeat: number of runs of each parser (the best one is reported);
+# - -o,--output: file to write the results to as JSON.
+#
+# Both parsers must return the same headings: the command fails otherwise.
+
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from syllabooster.utils.orgscan import scan_org, scan_org_with_orgparse
+from syllabooster.utils.synthetic import synthetic_org
+
+
+def best_time(function, argument, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+class Command(BaseCommand):
+    help = "Compares the speed of the org scanner with orgparse"
+
+    def add_arguments(self, parser):
+        parser.add_argument("inputfilename", nargs="?", help="Input file name")
+        parser.add_argument(
+            "-s", "--size", type=float, default=4, help="Synthetic course size in MB"
+        )
+        parser.add_argument("-r", "--repeat", type=int, default=3)
+        parser.add_argument("-o", "--output", help="JSON output file")
+
+    def handle(self, *args, **options):
+        if options["inputfilename"]:
+            try:
+                with open(options["inputfilename"], "r") as orgfile:
+                    input_string = orgfile.read()
+            except OSError:
+                raise CommandError('File "%s" not found' % options["inputfilename"])
+        else:
+            # Each rich unit of 50 points takes about 18 KB.
+            units = max(round(options["size"] * 1024 * 1024 / 18000), 1)
+            input_string = synthetic_org(units, 50, rich=True)
+        megabytes = len(input_string.encode()) / (1024 * 1024)
+
+        scan_time, headings = best_time(scan_org, input_string, options["repeat"])
+        orgparse_time, reference = best_time(
+            scan_org_with_orgparse, input_string, options["repeat"]
+        )
+        if headings != reference:
+            raise CommandError("The scanner and orgparse disagree on this input")
+
+        results = {
+            "megabytes": megabytes,
+            "headings": len(headings),
+            "scan_org": scan_time,
+            "orgparse": orgparse_time,
+            "speedup": orgparse_time / scan_time,
+        }
+        self.stdout.write(
+            f"{megabytes:.1f} MB, {len(headings)} headings: "
+            f"scan_org {scan_time:.2f} s ({megabytes / scan_time:.1f} MB/s), "
+            f"orgparse {orgparse_time:.2f} s ({megabytes / orgparse_time:.1f} MB/s), "
+            f"{results['speedup']:.1f}x faster"
+        )
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
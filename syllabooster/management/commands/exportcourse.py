@@ -26,4 +26,5 @@ class Command(BaseCommand):
             self.course = Course.objects.get(user=self.user, name=coursename)
         except Course.DoesNotExist:
             raise CommandError('Course "%s" does not exist.' % coursename)
-        self.stdout.write(export_course_org(self.course))
+        for chunk in export_course_org(self.course):
+            self.stdout.write(chunk, ending="")
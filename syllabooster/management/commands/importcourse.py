@@ -1,15 +1,19 @@
 #!/usr/bin/env python
 #
-# Adds a command to manage.py to import a Course from an org file.
+# Adds a command to manage.py to import a Course from an org or Markdown file.
 #
 # Command arguments:
 # - course: the name of the course to import;
-# - inputfilename: the name of the input file;
+# - inputfilename: the name of the input file, of a directory of org (or .md) files
+#   (one per unit) or a glob pattern matching them;
+# - -j,--jobs: the number of files parsed in parallel (one per CPU by default);
 # - -t,--type: the format of the input file (currently, only org and MD are supported).
 # - -f,--force: don't ask for confirmation before overwriting an existing course
 #
 # If the course exists, it will be overwritten, but the user will be asked for confirmation
-# unless -f,--format is given.
+# unless -f,--format is given. Only the units and course points that differ from the file
+# are written: the rest of the course is left untouched. A single file is read and written
+# one unit at a time, so courses of any size can be imported.
 #
 # Org file conventions.
 #
@@ -39,16 +43,23 @@
 # Any level > 2 heading is parsed as part of their parent's contents.
 #
 # Tags of units are applied to all their children points.
-
-
-from pathlib import Path
-
-import mistune
-import orgparse
+#
+# Markdown files follow the same conventions, with "#" and "##" headings for units and
+# points and "KEY: value" lines right below a heading for its TYPE, STATE and TAGS (see
+# utils/mdscan.py).
 
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Max
 from syllabooster.models import *
+from syllabooster.utils.bulkimport import (
+    ImportFormatError,
+    describe_changes,
+    course_input_files,
+    iter_course_units,
+    parse_course_files,
+    write_course,
+    write_course_units,
+)
 
 
 class Command(BaseCommand):
@@ -56,9 +67,17 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("course", help="Course name")
-        parser.add_argument("inputfilename", help="Input file name")
+        parser.add_argument(
+            "inputfilename", help="Input file name, directory or glob pattern"
+        )
         parser.add_argument("-u", "--user", default="manuel")
         parser.add_argument("-t", "--type", default="org", help="Input file type")
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="Number of files parsed in parallel (default: one per CPU)",
+        )
         parser.add_argument(
             "-f",
             "--force",
@@ -66,68 +85,53 @@ class Command(BaseCommand):
             help="Replace course without confirmation",
         )
 
-    def parse_org(self, input_string):
-        root = orgparse.loads(input_string)
-        current_unit = 0
-        next_point = 1
-        unit_tags = {}
-        for node in root[1:]:
-            if node.level == 1:
-                current_unit = current_unit + 1
-                node.unit = current_unit
-                unit = Unit.objects.create(
-                    course=self.course, position=current_unit, title=node.heading
+    def import_files(self, paths, input_format, jobs):
+        try:
+            if len(paths) == 1:
+                # A single file is read and written one unit at a time.
+                with open(paths[0], "r") as coursefile:
+                    result = write_course_units(
+                        self.course,
+                        iter_course_units(
+                            coursefile, input_format, numbering="sequential"
+                        ),
+                        include_orphans=True,
+                        prune=True,
+                    )
+            else:
+                # Each file is parsed in its own process, and the results are
+                # written in file order by this one.
+                parsed = parse_course_files(
+                    paths,
+                    input_format,
+                    unit_positions="sequential",
+                    numbering="sequential",
+                    jobs=jobs,
                 )
-                unit_tags[current_unit] = []
-                for tag in node.tags:
-                    unit_tags[current_unit].append(tag)
-            elif node.level == 2:
-                point, created = Point.objects.get_or_create(headline=node.heading)
-                point.contents = node.body
-                point.save()
-                for tag in node.tags:
-                    db_tag, created = Tag.objects.get_or_create(name=tag)
-                    point.tags.add(db_tag)
-                point_type = node.get_property("TYPE") or "Theory"
-                point.point_type = PointType.objects.get(name=point_type)
-                point.save()
-
-                state = None
-                todo = node.todo.lower()
-                if todo:
-                    try:
-                        state = DeliveryState.objects.filter(
-                            point_type_id=point.point_type.id
-                        ).get(name=todo)
-                    except DeliveryState.DoesNotExist:
-                        state = None
-                unit = None
-                if not (node.parent is root):
-                    unit_position = node.parent.unit
-                    unit = Unit.objects.get(course=self.course, position=unit_position)
-                    for tag in unit_tags[unit_position]:
-                        db_tag, created = Tag.objects.get_or_create(name=tag)
-                        point.tags.add(db_tag)
-                    point.save()
-
-                coursepoint = CoursePoint(
-                    course=self.course,
-                    point=point,
-                    position=next_point,
-                    state=state,
-                    unit=unit,
+                result = write_course(
+                    self.course, parsed, include_orphans=True, prune=True
                 )
-                coursepoint.save()
-                next_point = next_point + 1
-
-    def parse_md(self, input_string):
-        markdown_parser = mistune.create_markdown(renderer=None)
-        ast = markdown_parser(input_string)
-        print(ast)
+        except ImportFormatError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Imported {result["points"]} points in {result["units"]} units '
+                f"from {len(paths)} files."
+            )
+        )
+        self.stdout.write(describe_changes(result["changes"]) or "Nothing changed.")
 
     def handle(self, *args, **options):
-        # If there's already a course with the given name, it will be deleted.
-        # Then a new one is created.
+        # If there's already a course with the given name, it will be updated
+        # to match the input. Otherwise, a new one is created.
+
+        input_format = options["type"]
+        if input_format not in ("org", "md"):
+            raise CommandError('Unsupported format "%s"' % input_format)
+        inputfilename = options["inputfilename"]
+        paths = course_input_files(inputfilename, input_format)
+        if not paths:
+            raise CommandError('File "%s" not found' % inputfilename)
 
         user = options["user"]
         self.user = None
@@ -139,29 +143,15 @@ class Command(BaseCommand):
         self.course, created = Course.objects.get_or_create(
             name=course_name, user=self.user
         )
-        if Course.objects.filter(name=course_name, user=self.user).exists():
-            if not options["force"]:
-                self.stdout.write(
-                    self.style.WARNING(
-                        f"Course {course_name} for user {user} already exists and will be replaced."
-                    )
+        if not created and not options["force"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Course {course_name} for user {user} already exists and will be replaced."
                 )
-                confirm = input("Are you sure you want to proceed? [y/N]: ")
-                if confirm.lower() not in ["y", "yes"]:
-                    self.stdout.write(self.style.ERROR("Operation cancelled."))
-                    return
-            Course.objects.filter(name=course_name, user=self.user).delete()
-
-        self.course = Course.objects.create(name=course_name, user=self.user)
+            )
+            confirm = input("Are you sure you want to proceed? [y/N]: ")
+            if confirm.lower() not in ["y", "yes"]:
+                self.stdout.write(self.style.ERROR("Operation cancelled."))
+                return
 
-        inputfilename = options["inputfilename"]
-        inputfilepath = Path(inputfilename)
-        if not inputfilepath.is_file():
-            raise CommandError('File "%s" not found' % inputfilename)
-        with open(inputfilepath, "r") as mdfile:
-            input_string = mdfile.read()
-        input_format = options["type"]
-        if input_format == "md":
-            self.parse_md(input_string)
-        elif input_format == "org":
-            self.parse_org(input_string)
+        self.import_files(paths, input_format, options["jobs"])
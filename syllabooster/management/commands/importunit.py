@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 #
-# Adds a command to manage.py to import a Unit from an org file.
+# Adds a command to manage.py to import a Unit from an org or Markdown file.
 #
 # Command arguments:
 # - course: the name of the course to import the unit to;
-# - inputfilename: the name of the input file;
+# - inputfilename: the name of the input file, of a directory of org (or .md) files
+#   (one per unit) or a glob pattern matching them;
+# - -j,--jobs: the number of files parsed in parallel (one per CPU by default);
 # - -u,--user: the username;
 # - -t,--type: the format of the input file (currently, only org and MD are supported);
 # - -n,--unitnumber: (optional) the number of the unit to import;
@@ -57,27 +59,23 @@
 # Any level > 2 heading is parsed as part of their parent's contents.
 #
 # Tags of units are applied to all their children points.
-
-
-from pathlib import Path
-
-import mistune
-import orgparse
+#
+# Markdown files follow the same conventions, with "#" and "##" headings for units and
+# points and "KEY: value" lines right below a heading for its POSITION, TYPE, STATE and
+# TAGS (see utils/mdscan.py).
 
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Max, F
 from syllabooster.models import *
-
-
-def renumber_points(course):
-    units = Unit.objects.filter(course=course).order_by("position")
-    point_number = 1
-    for unit in units:
-        points = CoursePoint.objects.filter(unit=unit).order_by("position")
-        for point in points:
-            point.position = point_number
-            point.save()
-            point_number = point_number + 1
+from syllabooster.utils.bulkimport import (
+    ImportFormatError,
+    describe_changes,
+    course_input_files,
+    parse_course_files,
+    write_course,
+)
+from syllabooster.utils.changelog import UNIT, record_changes
+from syllabooster.utils.renumber import renumber_points
 
 
 def should_be_imported(unit, unitnumbers):
@@ -91,9 +89,17 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("course", help="Course name")
-        parser.add_argument("inputfilename", help="Input file name")
+        parser.add_argument(
+            "inputfilename", help="Input file name, directory or glob pattern"
+        )
         parser.add_argument("-u", "--user", default="manuel")
         parser.add_argument("-t", "--type", default="org", help="Input file type")
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="Number of files parsed in parallel (default: one per CPU)",
+        )
         parser.add_argument(
             "-n", "--unitnumber", type=int, help="Unit number to be imported"
         )
@@ -107,106 +113,89 @@ class Command(BaseCommand):
             help="Replace course without confirmation",
         )
 
-    def parse_org(self, input_string, unitnumbers, insert, force):
-        root = orgparse.loads(input_string)
-        current_unit = 0
-        next_point = 1
-        unit_tags = {}
+    def import_files(self, paths, input_format, unitnumbers, insert, force, jobs):
+        try:
+            parsed = parse_course_files(
+                paths,
+                input_format,
+                unit_positions="property",
+                numbering="sequential",
+                jobs=jobs,
+            )
+        except ImportFormatError as e:
+            raise CommandError(str(e))
         self.stdout.write(f"Unit numbers to be imported: {unitnumbers or 'all'}")
-        for node in root[1:]:
-            if node.level == 1:
-                current_unit = int(node.get_property("POSITION"))
-                node.unit = current_unit
-                self.stdout.write(
-                    f'Found unit "{node.heading}" with position {current_unit}'
-                )
-                if should_be_imported(current_unit, unitnumbers):
-                    self.stdout.write(f"Position {current_unit} should be imported.")
-                    if Unit.objects.filter(
-                        course=self.course, position=current_unit
-                    ).exists():
-                        if not insert:
-                            if not force:
-                                self.stdout.write(
-                                    self.style.WARNING(
-                                        f"There is already a unit with number {current_unit} in course {self.course.name} for user {self.user.username}: it will be replaced."
-                                    )
-                                )
-                                confirm = input(
-                                    "Are you sure you want to proceed? [y/N]: "
-                                )
-                                if confirm.lower() not in ["y", "yes"]:
-                                    self.stdout.write(self.style.ERROR("Unit skipped."))
-                                    continue
-                            Unit.objects.filter(
-                                course=self.course, position=current_unit
-                            ).delete()
-                        else:
-                            Unit.objects.filter(
-                                course=self.course, position__gte=current_unit
-                            ).update(position=F("position") + 10000)
-                            Unit.objects.filter(
-                                self.course, position__gte=current_unit + 10000
-                            ).update(position=F("position") - 9999)
-
-                    unit = Unit.objects.create(
-                        course=self.course,
-                        position=current_unit,
-                        title=node.heading,
+        existing_positions = set(
+            Unit.objects.filter(course=self.course).values_list("position", flat=True)
+        )
+        imported_positions = []
+        for unit in parsed.units:
+            current_unit = unit.position
+            self.stdout.write(f'Found unit "{unit.title}" with position {current_unit}')
+            if not should_be_imported(current_unit, unitnumbers):
+                continue
+            self.stdout.write(f"Position {current_unit} should be imported.")
+            if current_unit in existing_positions:
+                if not insert:
+                    if not force:
+                        self.stdout.write(
+                            self.style.WARNING(
+                                f"There is already a unit with number {current_unit} in course {self.course.name} for user {self.user.username}: it will be replaced."
+                            )
+                        )
+                        confirm = input("Are you sure you want to proceed? [y/N]: ")
+                        if confirm.lower() not in ["y", "yes"]:
+                            self.stdout.write(self.style.ERROR("Unit skipped."))
+                            continue
+                else:
+                    shifted = Unit.objects.filter(
+                        course=self.course, position__gte=current_unit
                     )
-                    unit_tags[current_unit] = []
-                    for tag in node.tags:
-                        unit_tags[current_unit].append(tag)
-            elif should_be_imported(current_unit, unitnumbers) and node.level == 2:
-                point_type = node.get_property("TYPE") or "Theory"
-                self.stdout.write(
-                    f'Importing point "{node.heading}" of type {point_type}'
-                )
-                point, created = Point.objects.get_or_create(headline=node.heading)
-                point.contents = node.body
-                point.save()
-                for tag in node.tags:
-                    db_tag, created = Tag.objects.get_or_create(name=tag)
-                    point.tags.add(db_tag)
-                point.point_type = PointType.objects.get(name=point_type.lower())
-                point.save()
-
-                state = None
-                todo = node.todo.lower()
-                if todo:
-                    try:
-                        state = DeliveryState.objects.filter(
-                            point_type_id=point.point_type.id
-                        ).get(name=todo)
-                    except DeliveryState.DoesNotExist:
-                        state = None
-                unit = None
-                if not (node.parent is root):
-                    unit_position = node.parent.unit
-                    unit = Unit.objects.get(course=self.course, position=unit_position)
-                    for tag in unit_tags[unit_position]:
-                        db_tag, created = Tag.objects.get_or_create(name=tag)
-                        point.tags.add(db_tag)
-                    point.save()
-
-                coursepoint = CoursePoint(
-                    course=self.course,
-                    point=point,
-                    position=next_point,
-                    state=state,
-                    unit=unit,
-                )
-                coursepoint.save()
-                next_point = next_point + 1
-        renumber_points(self.course)
-
-    def parse_md(self, input_string, unitnumbers, insert, force):
-        markdown_parser = mistune.create_markdown(renderer=None)
-        ast = markdown_parser(input_string)
-        print(ast)
+                    record_changes(
+                        self.course.pk,
+                        [
+                            (UNIT, pk, False)
+                            for pk in shifted.values_list("pk", flat=True)
+                        ],
+                    )
+                    shifted.update(position=F("position") + 10000)
+                    Unit.objects.filter(
+                        course=self.course, position__gte=current_unit + 10000
+                    ).update(position=F("position") - 9999)
+                    existing_positions = {
+                        position + 1 if position >= current_unit else position
+                        for position in existing_positions
+                    }
+            existing_positions.add(current_unit)
+            imported_positions.append(current_unit)
+
+        parsed = parsed.only_units(imported_positions, include_orphans=not unitnumbers)
+        try:
+            result = write_course(self.course, parsed, include_orphans=True)
+        except ImportFormatError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f'Imported {result["points"]} points in {result["units"]} units.'
+        )
+        self.stdout.write(describe_changes(result["changes"]) or "Nothing changed.")
+        if imported_positions:
+            renumber_points(
+                self.course,
+                from_unit=Unit.objects.get(
+                    course=self.course, position=min(imported_positions)
+                ),
+            )
 
     def handle(self, *args, **options):
 
+        input_format = options["type"]
+        if input_format not in ("org", "md"):
+            raise CommandError('Unsupported format "%s"' % input_format)
+        inputfilename = options["inputfilename"]
+        paths = course_input_files(inputfilename, input_format)
+        if not paths:
+            raise CommandError('File "%s" not found' % inputfilename)
+
         user = options["user"]
         self.user = None
         try:
@@ -217,21 +206,14 @@ class Command(BaseCommand):
         self.course, created = Course.objects.get_or_create(
             name=course_name, user=self.user
         )
-        inputfilename = options["inputfilename"]
-        inputfilepath = Path(inputfilename)
-        if not inputfilepath.is_file():
-            raise CommandError('File "%s" not found' % inputfilename)
-        with open(inputfilepath, "r") as mdfile:
-            input_string = mdfile.read()
         self.unitnumbers = []
         if options["unitnumber"]:
             self.unitnumbers = [options["unitnumber"]]
-        input_format = options["type"]
-        if input_format == "md":
-            self.parse_md(
-                input_string, self.unitnumbers, options["insert"], options["force"]
-            )
-        elif input_format == "org":
-            self.parse_org(
-                input_string, self.unitnumbers, options["insert"], options["force"]
-            )
+        self.import_files(
+            paths,
+            input_format,
+            self.unitnumbers,
+            options["insert"],
+            options["force"],
+            options["jobs"],
+        )
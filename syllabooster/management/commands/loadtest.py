@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+#
+# Adds a command to manage.py to measure the throughput of a running server
+# under a mixed load of course imports and state cycling.
+#
+# Command arguments:
+# - -b,--base-url: URL of the running server;
+# - -u,--user: the user the requests are made as;
+# - -d,--duration: seconds to run the load for;
+# - -c,--clickers: concurrent clients cycling point states;
+# - -i,--importers: concurrent clients importing courses through the API;
+# - --units, --points: size of the course each importer uploads;
+# - -o,--output: file to write the results to as JSON.
+#
+# Run it once against the WSGI deployment and once against the ASGI one
+# (see DEPLOY.org) with the same arguments, and compare the results.
+#
+# The import API only queues a job, so each importer polls its job until it
+# finishes: "importorg" is the time from the request to the end of the
+# import, and needs runimportworker to be running, while "importorg-enqueue"
+# is the time the API takes to queue the job. Jobs that don't finish within
+# JOB_TIMEOUT seconds of the end of the run count as errors.
+#
+# The command works on its own "loadtest" courses, which are deleted at the
+# end, along with their import jobs, once the running ones have finished.
+
+import json
+import math
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.crypto import get_random_string
+from syllabooster.models import *
+from syllabooster.utils import importstr
+from syllabooster.utils.synthetic import synthetic_org
+
+JOB_TIMEOUT = 60
+JOB_POLL_INTERVAL = 0.1
+
+
+class ImportJobError(Exception):
+    pass
+
+
+def percentile(sorted_values, fraction):
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = "Measures server throughput under mixed import and state-cycling load"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-b", "--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("-u", "--user", default="manuel")
+        parser.add_argument("-d", "--duration", type=float, default=30)
+        parser.add_argument("-c", "--clickers", type=int, default=8)
+        parser.add_argument("-i", "--importers", type=int, default=2)
+        parser.add_argument("--units", type=int, default=20)
+        parser.add_argument("--points", type=int, default=50)
+        parser.add_argument("-o", "--output", help="JSON output file")
+
+    def login(self, user):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        csrf_token = get_random_string(32)
+        return {
+            "Cookie": f"{settings.SESSION_COOKIE_NAME}={session.session_key}; "
+            f"{settings.CSRF_COOKIE_NAME}={csrf_token}",
+            "X-CSRFToken": csrf_token,
+            "Referer": self.base_url + "/",
+        }
+
+    def post(self, path, payload, headers):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json", **headers},
+        )
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return json.loads(response.read())
+
+    def get(self, path):
+        with urllib.request.urlopen(self.base_url + path, timeout=300) as response:
+            return json.loads(response.read())
+
+    def record(self, name, latency):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(latency)
+
+    def wait_for_job(self, status_url):
+        """Poll an import job until it finishes."""
+        while True:
+            job = self.get(status_url)
+            if job["jobStatus"] == ImportJob.DONE:
+                return
+            if job["jobStatus"] == ImportJob.FAILED:
+                raise ImportJobError(job["message"])
+            if time.monotonic() > self.deadline + JOB_TIMEOUT:
+                raise ImportJobError("Timed out waiting for the import job")
+            time.sleep(JOB_POLL_INTERVAL)
+
+    def run_client(self, name, request):
+        latencies = []
+        errors = 0
+        while time.monotonic() < self.deadline:
+            start = time.perf_counter()
+            try:
+                request()
+            except (urllib.error.URLError, OSError, ImportJobError):
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        with self.lock:
+            self.latencies.setdefault(name, []).extend(latencies)
+            self.errors[name] = self.errors.get(name, 0) + errors
+
+    def clean_up(self, user):
+        """Delete the loadtest courses and import jobs, waiting for the
+        running jobs first so that they don't create the courses again."""
+        jobs = ImportJob.objects.filter(user=user, course_name__startswith="loadtest")
+        jobs.filter(status=ImportJob.PENDING).delete()
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while (
+            jobs.filter(status__in=[ImportJob.PARSING, ImportJob.WRITING]).exists()
+            and time.monotonic() < deadline
+        ):
+            time.sleep(JOB_POLL_INTERVAL)
+        jobs.delete()
+        Course.objects.filter(user=user, name__startswith="loadtest").delete()
+
+    def handle(self, *args, **options):
+        self.base_url = options["base_url"].rstrip("/")
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist' % options["user"])
+
+        org = synthetic_org(options["units"], options["points"])
+        result = importstr.import_course("loadtest", org, user.username, "org")
+        if result["status"] != "ok":
+            raise CommandError(result["message"])
+        coursepoint_ids = list(
+            CoursePoint.objects.filter(
+                course__user=user, course__name="loadtest"
+            ).values_list("id", flat=True)
+        )
+        headers = self.login(user)
+
+        def click():
+            self.post(
+                "/cyclestate/",
+                {"coursepointId": random.choice(coursepoint_ids)},
+                headers,
+            )
+
+        def import_course(number):
+            def request():
+                start = time.perf_counter()
+                job = self.post(
+                    "/api/importorg/",
+                    {
+                        "course_name": f"loadtest-{number}",
+                        "input_string": org,
+                        "username": user.username,
+                    },
+                    headers,
+                )
+                self.record("importorg-enqueue", time.perf_counter() - start)
+                self.wait_for_job(job["statusUrl"])
+
+            return request
+
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.deadline = time.monotonic() + options["duration"]
+        threads = [
+            threading.Thread(target=self.run_client, args=("cyclestate", click))
+            for _ in range(options["clickers"])
+        ] + [
+            threading.Thread(
+                target=self.run_client, args=("importorg", import_course(number))
+            )
+            for number in range(options["importers"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.clean_up(user)
+
+        results = {
+            "base_url": self.base_url,
+            "duration": options["duration"],
+            "clickers": options["clickers"],
+            "importers": options["importers"],
+            "endpoints": {},
+            "notes": {
+                "importorg": "time from the request to the end of the import job",
+                "importorg-enqueue": "time the API takes to queue the import job "
+                "(the enqueue path only)",
+            },
+        }
+        for name, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            summary = {
+                "requests": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "throughput": len(latencies) / options["duration"],
+            }
+            if latencies:
+                summary.update(
+                    {
+                        "p50": statistics.median(latencies),
+                        "p95": percentile(latencies, 0.95),
+                        "p99": percentile(latencies, 0.99),
+                    }
+                )
+            results["endpoints"][name] = summary
+            self.stdout.write(
+                f"{name}: {summary['requests']} requests, "
+                f"{summary['throughput']:.1f} req/s, {summary['errors']} errors"
+                + (
+                    f", p50 {summary['p50'] * 1000:.0f} ms, p95 {summary['p95'] * 1000:.0f} ms"
+                    if latencies
+                    else ""
+                )
+            )
+        for name, note in results["notes"].items():
+            self.stdout.write(f"{name} is the {note}.")
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
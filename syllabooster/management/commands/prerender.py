@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+# Adds a command to manage.py to render the HTML of points in bulk.
+#
+# Command arguments:
+# - -c,--course: (optional) only render the points of this course;
+# - -u,--user: the owner of the course;
+# - -a,--all: render every point, not only the stale ones;
+# - -j,--jobs: the number of rendering processes (one per CPU by default);
+# - -b,--batch-size: the number of points rendered and stored at a time.
+#
+# Only points whose cached HTML is missing or stale (because their contents
+# or the renderer configuration changed) are rendered, unless -a,--all is given.
+
+from django.core.management.base import BaseCommand, CommandError
+from syllabooster.models import *
+from syllabooster.utils.prerender import PRERENDER_BATCH_SIZE, prerender_points
+
+
+class Command(BaseCommand):
+    help = "Renders and stores the HTML of points whose cached HTML is stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-c", "--course", help="Course name")
+        parser.add_argument("-u", "--user", default="manuel")
+        parser.add_argument(
+            "-a", "--all", action="store_true", help="Render every point"
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="Number of rendering processes (default: one per CPU)",
+        )
+        parser.add_argument(
+            "-b", "--batch-size", type=int, default=PRERENDER_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        points = Point.objects.all()
+        if options["course"]:
+            try:
+                course = Course.objects.get(
+                    name=options["course"], user__username=options["user"]
+                )
+            except Course.DoesNotExist:
+                raise CommandError(
+                    'Course "%s" of user "%s" does not exist'
+                    % (options["course"], options["user"])
+                )
+            points = points.filter(coursepoint__course=course)
+        rendered = prerender_points(
+            points,
+            jobs=options["jobs"],
+            batch_size=options["batch_size"],
+            render_all=options["all"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} points."))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Adds a command to manage.py to run the course imports queued by the API,
+# and the rendering of the HTML of the imported courses.
+#
+# Command arguments:
+# - -c,--concurrency: maximum number of imports run at the same time;
+# - -p,--poll-interval: seconds to wait before looking for jobs again when
+#   the queue is empty;
+# - --once: run the queued jobs and exit instead of waiting for more;
+# - --stale-after: seconds without a heartbeat after which a running job is
+#   queued again (its worker refreshes the heartbeat while it runs).
+#
+# Several workers can run at the same time, even on different machines
+# sharing the database.
+
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from syllabooster.utils.jobs import (
+    DEFAULT_STALE_AFTER,
+    claim_job,
+    requeue_stale_jobs,
+    run_import_job,
+)
+
+
+class Command(BaseCommand):
+    help = "Runs queued course imports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-c", "--concurrency", type=int, default=2)
+        parser.add_argument("-p", "--poll-interval", type=float, default=2)
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty"
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=int(DEFAULT_STALE_AFTER.total_seconds()),
+            help="Seconds without a heartbeat after which a running job is "
+            "queued again",
+        )
+
+    def work(self, options):
+        while not self.stopping.is_set():
+            close_old_connections()
+            job = claim_job()
+            if job is None:
+                if options["once"]:
+                    break
+                self.stopping.wait(options["poll_interval"])
+                continue
+            self.stdout.write(f"Running {job.kind} job {job.pk} ({job.course_name})")
+            run_import_job(job)
+            self.stdout.write(
+                f"{job.get_kind_display()} job {job.pk}: {job.status} {job.message}"
+            )
+        connection.close()
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(timedelta(seconds=options["stale_after"]))
+        if requeued:
+            self.stdout.write(
+                self.style.WARNING(f"Queued {requeued} stale jobs again.")
+            )
+        self.stopping = threading.Event()
+        workers = [
+            threading.Thread(target=self.work, args=(options,))
+            for _ in range(options["concurrency"])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the running jobs finish...")
+            self.stopping.set()
+        for worker in workers:
+            worker.join()
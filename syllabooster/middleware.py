@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Middleware recording per-view latency and database metrics (see
+# utils/metrics.py).
+#
+# The body of a streaming response is generated after the view returns: its
+# iterator is wrapped so that the queries it runs are counted too, and the
+# request is only recorded once the stream is exhausted (or closed).
+
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from .utils.metrics import RequestMetrics, current_request, registry, view_name
+
+_END = object()
+
+
+def record_request(request, response, start, request_metrics):
+    registry.record(
+        view_name(request),
+        response.status_code,
+        time.perf_counter() - start,
+        request_metrics,
+    )
+
+
+def metered_content(iterator, request_metrics, record):
+    """Generate the chunks of 'iterator' counting the queries run to produce
+    each one, and call record() when done. The context variable is set and
+    reset around each chunk, since the server may iterate in another
+    context than the view's."""
+    try:
+        while True:
+            token = current_request.set(request_metrics)
+            try:
+                chunk = next(iterator, _END)
+            finally:
+                current_request.reset(token)
+            if chunk is _END:
+                break
+            yield chunk
+    finally:
+        record()
+
+
+async def ametered_content(iterator, request_metrics, record):
+    """metered_content() for async iterators."""
+    try:
+        while True:
+            token = current_request.set(request_metrics)
+            try:
+                chunk = await anext(iterator, _END)
+            finally:
+                current_request.reset(token)
+            if chunk is _END:
+                break
+            yield chunk
+    finally:
+        record()
+
+
+def finish_response(request, response, start, request_metrics):
+    """Record the request now, or once its streaming body has been sent."""
+    if not response.streaming:
+        record_request(request, response, start, request_metrics)
+        return response
+
+    def record():
+        record_request(request, response, start, request_metrics)
+
+    if response.is_async:
+        response.streaming_content = ametered_content(
+            aiter(response.streaming_content), request_metrics, record
+        )
+    else:
+        response.streaming_content = metered_content(
+            iter(response.streaming_content), request_metrics, record
+        )
+    return response
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Time each request and count its queries. It runs in the mode of the
+    handler (WSGI or ASGI), so async views aren't switched to sync."""
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            request_metrics = RequestMetrics()
+            token = current_request.set(request_metrics)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                current_request.reset(token)
+            return finish_response(request, response, start, request_metrics)
+
+    else:
+
+        def middleware(request):
+            request_metrics = RequestMetrics()
+            token = current_request.set(request_metrics)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                current_request.reset(token)
+            return finish_response(request, response, start, request_metrics)
+
+    return middleware
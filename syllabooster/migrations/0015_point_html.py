@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 21:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0014_alter_point_contents"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="point",
+            name="html",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="point",
+            name="html_key",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-17 21:57
+
+from django.db import migrations, models
+
+
+def set_terminal_flags(apps, schema_editor):
+    DeliveryState = apps.get_model("syllabooster", "DeliveryState")
+    last_positions = (
+        DeliveryState.objects.filter(point_type__isnull=False)
+        .values("point_type")
+        .annotate(last_position=models.Max("position"))
+    )
+    for row in last_positions:
+        DeliveryState.objects.filter(
+            point_type_id=row["point_type"], position=row["last_position"]
+        ).update(is_terminal=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0015_point_html"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deliverystate",
+            name="is_terminal",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(set_terminal_flags, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="coursepoint",
+            index=models.Index(
+                fields=["course", "position"], name="coursepoint_course_pos_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deliverystate",
+            index=models.Index(
+                condition=models.Q(("is_terminal", True)),
+                fields=["point_type"],
+                name="deliverystate_terminal_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-17 21:59
+
+from django.db import migrations, models
+
+
+def set_relative_positions(apps, schema_editor):
+    CoursePoint = apps.get_model("syllabooster", "CoursePoint")
+    counters = {}
+    coursepoints = []
+    for coursepoint in CoursePoint.objects.order_by(
+        "unit_id", "position", "id"
+    ).select_related("point"):
+        unit_key = (coursepoint.course_id, coursepoint.unit_id)
+        type_key = unit_key + (coursepoint.point.point_type_id,)
+        counters[unit_key] = counters.get(unit_key, 0) + 1
+        counters[type_key] = counters.get(type_key, 0) + 1
+        coursepoint.relative_position = counters[unit_key]
+        coursepoint.type_relative_position = counters[type_key]
+        coursepoints.append(coursepoint)
+    CoursePoint.objects.bulk_update(
+        coursepoints,
+        ["relative_position", "type_relative_position"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0016_deliverystate_is_terminal"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coursepoint",
+            name="relative_position",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="coursepoint",
+            name="type_relative_position",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(set_relative_positions, migrations.RunPython.noop),
+    ]
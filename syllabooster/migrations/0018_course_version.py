@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 22:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0017_coursepoint_relative_positions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
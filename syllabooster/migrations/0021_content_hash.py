@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 22:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0020_importjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coursepoint",
+            name="content_hash",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="unit",
+            name="content_hash",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
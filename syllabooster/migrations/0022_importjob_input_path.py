@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 22:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0021_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="input_path",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
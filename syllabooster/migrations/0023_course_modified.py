@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-17 23:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0022_importjob_input_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="modified",
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
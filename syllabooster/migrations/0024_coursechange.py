@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-17 22:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0023_course_modified"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CourseChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sequence", models.PositiveIntegerField()),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("unit", "Unit"),
+                            ("coursepoint", "Course point"),
+                            ("point", "Point"),
+                        ],
+                        max_length=12,
+                    ),
+                ),
+                ("object_id", models.PositiveIntegerField()),
+                ("deleted", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "course",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="syllabooster.course",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["course", "sequence", "id"],
+                        name="coursechange_sequence_idx",
+                    )
+                ],
+            },
+        ),
+    ]
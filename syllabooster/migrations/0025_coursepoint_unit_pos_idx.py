@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-17 22:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0024_coursechange"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="coursepoint",
+            index=models.Index(
+                fields=["unit", "position"], name="coursepoint_unit_pos_idx"
+            ),
+        ),
+    ]
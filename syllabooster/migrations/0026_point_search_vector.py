@@ -0,0 +1,74 @@
+# Generated by Django 6.0 on 2026-10-17 22:35
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The search vector is only maintained on PostgreSQL: other databases get
+# the column, but neither the index nor the trigger (see utils/search.py).
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(
+    fields=["search_vector"], name="point_search_idx"
+)
+
+CREATE_TRIGGER = """
+CREATE FUNCTION syllabooster_point_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.headline, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.contents, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER syllabooster_point_search_vector
+BEFORE INSERT OR UPDATE OF headline, contents ON syllabooster_point
+FOR EACH ROW EXECUTE FUNCTION syllabooster_point_search_vector();
+
+UPDATE syllabooster_point SET search_vector =
+    setweight(to_tsvector('simple', coalesce(headline, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(contents, '')), 'B');
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS syllabooster_point_search_vector ON syllabooster_point;
+DROP FUNCTION IF EXISTS syllabooster_point_search_vector();
+"""
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_TRIGGER)
+        schema_editor.add_index(apps.get_model("syllabooster", "Point"), SEARCH_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.remove_index(
+            apps.get_model("syllabooster", "Point"), SEARCH_INDEX
+        )
+        schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0025_coursepoint_unit_pos_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="point",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name="point", index=SEARCH_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0026_point_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-17 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("syllabooster", "0027_importjob_heartbeat_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="kind",
+            field=models.CharField(
+                choices=[("import", "Import"), ("prerender", "Prerender")],
+                default="import",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -1,11 +1,12 @@
 from django.db import models
+from django.db.models.functions import Now
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
-from markdown_it import MarkdownIt
-import bleach
+import uuid
 
-
-md = MarkdownIt("commonmark", {"html": False})
+from syllabooster.utils.rendering import html_cache_key, render_html
 
 
 class Tag(models.Model):
@@ -32,13 +33,37 @@ class DeliveryState(models.Model):
     display_name = models.CharField(max_length=100, blank=True)
     description = models.TextField(blank=True)
     css_class = models.CharField(max_length=200, blank=True)
+    # Whether this is the last state of its point type, i.e. the point is
+    # done. Maintained by update_terminal_flags().
+    is_terminal = models.BooleanField(default=False, editable=False)
 
     class Meta:
         unique_together = ["point_type", "name"]
+        indexes = [
+            models.Index(
+                fields=["point_type"],
+                condition=models.Q(is_terminal=True),
+                name="deliverystate_terminal_idx",
+            )
+        ]
 
     def __str__(self):
         return f"{self.point_type.name}:{self.display_name}"
 
+    @classmethod
+    def update_terminal_flags(cls, point_type_id):
+        """Flag the state with the highest position of the point type as
+        terminal, and only that one."""
+        last_position = cls.objects.filter(point_type_id=point_type_id).aggregate(
+            models.Max("position")
+        )["position__max"]
+        cls.objects.filter(point_type_id=point_type_id).update(
+            is_terminal=models.Case(
+                models.When(position=last_position, then=True),
+                default=False,
+            )
+        )
+
 
 class Point(models.Model):
     headline = models.CharField(max_length=200)
@@ -46,55 +71,41 @@ class Point(models.Model):
         blank=True,
         help_text="Write contents in MarkDown. Use $...$ for inline math and $$...$$ for display math.",
     )
+    html = models.TextField(blank=True, editable=False)
+    html_key = models.CharField(max_length=64, blank=True, editable=False)
     tags = models.ManyToManyField(Tag)
     point_type = models.ForeignKey(
         PointType, on_delete=models.PROTECT, related_name="points", null=True
     )
+    # Weighted headline and contents for full-text search, maintained by a
+    # trigger on PostgreSQL (see utils/search.py).
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [GinIndex(fields=["search_vector"], name="point_search_idx")]
+
+    def html_cache_key(self):
+        """Key identifying the cached HTML for the current contents."""
+        return html_cache_key(self.contents)
+
+    def has_fresh_html(self):
+        return self.html_key == self.html_cache_key()
+
+    def refresh_html(self):
+        """Render 'contents' into the cached HTML fields without saving them."""
+        self.html = render_html(self.contents)
+        self.html_key = self.html_cache_key()
 
     def get_html(self):
-        """Convert markdown in 'contents' field to HTML and sanitize."""
-        html = md.render(self.contents)
-        clean_html = bleach.clean(
-            html,
-            tags=[
-                "p",
-                "br",
-                "strong",
-                "em",
-                "a",
-                "ul",
-                "ol",
-                "li",
-                "h1",
-                "h2",
-                "h3",
-                "h4",
-                "h5",
-                "h6",
-                "code",
-                "pre",
-                "blockquote",
-                "hr",
-                "table",
-                "thead",
-                "tbody",
-                "tr",
-                "th",
-                "td",
-                "span",
-                "div",
-                "img",
-            ],
-            attributes={
-                "a": ["href", "title"],
-                "img": ["src", "alt", "title"],
-                "code": ["class"],
-                "span": ["class"],
-                "div": ["class"],
-            },
-            strip=True,
-        )
-        return clean_html
+        """Return the sanitized HTML for 'contents', rendering it only when
+        the cached copy is missing or stale."""
+        if not self.has_fresh_html():
+            self.refresh_html()
+            if self.pk:
+                Point.objects.filter(pk=self.pk).update(
+                    html=self.html, html_key=self.html_key
+                )
+        return self.html
 
     def __str__(self):
         return str(self.headline)
@@ -126,6 +137,11 @@ class Course(models.Model):
     user = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
     points = models.ManyToManyField(Point, through="CoursePoint")
     current_position = models.PositiveIntegerField(db_default=0)  # type: ignore[call-arg]
+    # Bumped on every change that affects how the course is displayed; it is
+    # part of the key of the cached fragments of the course.
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # When the version was last bumped, for Last-Modified headers.
+    modified = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ["name", "user"]
@@ -133,11 +149,26 @@ class Course(models.Model):
     def __str__(self):
         return str(self.name)
 
+    @classmethod
+    def bump_versions(cls, **filters):
+        """Bump the version of the courses matching 'filters'."""
+        return cls.objects.filter(**filters).update(
+            version=models.F("version") + 1, modified=Now()
+        )
+
+    @classmethod
+    async def abump_versions(cls, **filters):
+        return await cls.objects.filter(**filters).aupdate(
+            version=models.F("version") + 1, modified=Now()
+        )
+
 
 class Unit(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     position = models.PositiveIntegerField()
     title = models.CharField(max_length=50)
+    # Hash of the imported title and tags (see utils/bulkimport.py).
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
 
     class Meta:
         ordering = ["position"]
@@ -155,10 +186,24 @@ class CoursePoint(models.Model):
         DeliveryState, on_delete=models.PROTECT, related_name="course_points", null=True
     )
     unit = models.ForeignKey(Unit, null=True, blank=True, on_delete=models.CASCADE)
+    # Position in the unit, overall and among points of the same type.
+    # Maintained by the importers and by renumber_points().
+    relative_position = models.PositiveIntegerField(default=0)
+    type_relative_position = models.PositiveIntegerField(default=0)
+    # Hash of the imported headline, contents, tags, type and state
+    # (see utils/bulkimport.py).
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
 
     class Meta:
         ordering = ["position"]
         unique_together = ["course", "point"]
+        indexes = [
+            models.Index(
+                fields=["course", "position"], name="coursepoint_course_pos_idx"
+            ),
+            # Pages of the points of a unit (see utils/keyset.py).
+            models.Index(fields=["unit", "position"], name="coursepoint_unit_pos_idx"),
+        ]
 
     def __str__(self):
         return f"{self.course}:{self.position}:{self.point}"
@@ -176,3 +221,114 @@ class CoursePoint(models.Model):
             .order_by("position")
             .first()
         )
+
+
+class StateSyncOperation(models.Model):
+    """A state change sent by a client through the batched sync endpoint.
+
+    (user, client_id, client_seq) is the idempotency key of the operation:
+    replayed operations are recognised and not applied again."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    client_id = models.CharField(max_length=64)
+    client_seq = models.PositiveBigIntegerField()
+    coursepoint = models.ForeignKey(CoursePoint, null=True, on_delete=models.SET_NULL)
+    state = models.ForeignKey(DeliveryState, null=True, on_delete=models.SET_NULL)
+    accepted = models.BooleanField()
+    applied_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ["user", "client_id", "client_seq"]
+
+    def __str__(self):
+        return f"{self.user}:{self.client_id}:{self.client_seq}"
+
+
+class ImportJob(models.Model):
+    """A course import queued by the API, or the rendering of the HTML of a
+    course after an import, run by the runimportworker command."""
+
+    IMPORT = "import"
+    PRERENDER = "prerender"
+    KIND_CHOICES = [(IMPORT, "Import"), (PRERENDER, "Prerender")]
+
+    PENDING = "pending"
+    PARSING = "parsing"
+    WRITING = "writing"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PARSING, "Parsing"),
+        (WRITING, "Writing"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=IMPORT)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    course_name = models.CharField(max_length=100)
+    input_format = models.CharField(max_length=10, default="org")
+    input_string = models.TextField(blank=True)
+    # Large inputs are spooled to this file instead of 'input_string'.
+    input_path = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # Points written out of the points found in the input.
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while it runs the job (see utils/jobs.py).
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(status="pending"),
+                name="importjob_pending_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user}:{self.course_name}:{self.status}"
+
+
+class CourseChange(models.Model):
+    """Entry of the append-only log of changes to a course, read by the
+    delta sync API (see utils/changelog.py).
+
+    'sequence' is the version the course got with the change: entries
+    written together share it, and the entries of a course are ordered by
+    (sequence, id)."""
+
+    UNIT = "unit"
+    COURSEPOINT = "coursepoint"
+    POINT = "point"
+    KIND_CHOICES = [
+        (UNIT, "Unit"),
+        (COURSEPOINT, "Course point"),
+        (POINT, "Point"),
+    ]
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField()
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["course", "sequence", "id"], name="coursechange_sequence_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.course}:{self.sequence}:{self.kind}:{self.object_id}"
@@ -0,0 +1,67 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import DeliveryState, PointType
+from .utils.metrics import install_query_wrapper
+from .utils.statemachine import invalidate_transition_table
+
+
+def states_changed(sender, **kwargs):
+    # A table rebuilt before the commit could hold rows that get rolled
+    # back, so drop it again once the transaction is over.
+    invalidate_transition_table()
+    transaction.on_commit(invalidate_transition_table)
+
+
+def remember_point_type(sender, instance, **kwargs):
+    """Keep the stored point type of a state about to be saved, whose
+    terminal flags must be updated too if it changes."""
+    instance._stored_point_type_id = (
+        DeliveryState.objects.filter(pk=instance.pk)
+        .values_list("point_type_id", flat=True)
+        .first()
+        if instance.pk is not None
+        else None
+    )
+
+
+def update_terminal_flags(sender, instance, **kwargs):
+    point_type_ids = {
+        instance.point_type_id,
+        getattr(instance, "_stored_point_type_id", None),
+    }
+    for point_type_id in point_type_ids - {None}:
+        DeliveryState.update_terminal_flags(point_type_id)
+
+
+def connect_signals():
+    connection_created.connect(
+        install_query_wrapper, dispatch_uid="install_query_wrapper"
+    )
+    pre_save.connect(
+        remember_point_type,
+        sender=DeliveryState,
+        dispatch_uid="remember_point_type",
+    )
+    post_save.connect(
+        update_terminal_flags,
+        sender=DeliveryState,
+        dispatch_uid="update_terminal_flags_save",
+    )
+    post_delete.connect(
+        update_terminal_flags,
+        sender=DeliveryState,
+        dispatch_uid="update_terminal_flags_delete",
+    )
+    for model in (DeliveryState, PointType):
+        post_save.connect(
+            states_changed,
+            sender=model,
+            dispatch_uid=f"states_changed_{model.__name__}_save",
+        )
+        post_delete.connect(
+            states_changed,
+            sender=model,
+            dispatch_uid=f"states_changed_{model.__name__}_delete",
+        )
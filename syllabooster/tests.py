@@ -1,3 +1,1555 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import (
+    AsyncClient,
+    LiveServerTestCase,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .admin import CoursePointAdmin, UnitAdmin
+from .middleware import metrics_middleware
+from .models import *
+from .utils.bulkimport import (
+    iter_org_units,
+    parse_md_course,
+    parse_org_course,
+    write_course,
+    write_course_units,
+)
+from .utils import importstr, statemachine
+from .utils.exportcourse import export_course_org
+from .utils.changelog import changes_since, record_changes
+from .utils.jobs import (
+    claim_job,
+    job_heartbeat,
+    requeue_stale_jobs,
+    run_import_job,
+)
+from .utils.metrics import registry, save_metrics
+from .utils.orgscan import scan_org, scan_org_with_orgparse
+from .utils.prerender import prerender_points
+from .utils.rendering import html_cleaner, render_html
+from .utils.snapshot import course_snapshot, json_array, snapshot_json
+from .utils.synthetic import synthetic_md, synthetic_org
+from .utils.renumber import renumber_points
+from .views import (
+    MAX_SYNC_OPERATIONS,
+    move_course_current_position,
+    update_course_current_position,
+)
+
+
+class CourseTestCase(TestCase):
+    """A course of "teacher", who is logged in, with a unit of three points:
+    theory, exercise and theory."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="teacher")
+        theory = PointType.objects.create(name="theory")
+        exercise = PointType.objects.create(name="exercise")
+        pending = DeliveryState.objects.create(
+            point_type=theory, position=0, name="pending"
+        )
+        unassigned = DeliveryState.objects.create(
+            point_type=exercise, position=0, name="unassigned"
+        )
+        cls.course = Course.objects.create(name="Course", user=cls.user)
+        unit = Unit.objects.create(course=cls.course, position=1, title="Unit")
+        cls.coursepoints = []
+        for position, (point_type, state) in enumerate(
+            [(theory, pending), (exercise, unassigned), (theory, pending)], start=1
+        ):
+            point = Point.objects.create(
+                headline=f"Point {position}",
+                contents=f"*Contents* of point {position}",
+                point_type=point_type,
+            )
+            cls.coursepoints.append(
+                CoursePoint.objects.create(
+                    course=cls.course,
+                    point=point,
+                    position=position,
+                    state=state,
+                    unit=unit,
+                )
+            )
+        renumber_points(cls.course)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, coursepoint):
+        return self.client.get(
+            reverse("syllabooster:coursepointdetail", args=[coursepoint.pk])
+        )
+
+
+class PointHtmlCacheTests(CourseTestCase):
+    def test_html_is_stored_until_the_contents_change(self):
+        point = Point.objects.get(pk=self.coursepoints[0].point_id)
+        self.assertFalse(point.has_fresh_html())
+        with self.assertNumQueries(1):
+            html = point.get_html()
+        self.assertEqual(html, "<p><em>Contents</em> of point 1</p>\n")
+        point = Point.objects.get(pk=point.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(point.get_html(), html)
+        point.contents = "New *contents*"
+        self.assertFalse(point.has_fresh_html())
+        self.assertEqual(point.get_html(), "<p>New <em>contents</em></p>\n")
+        self.assertEqual(Point.objects.get(pk=point.pk).html, point.html)
+
+    def test_threads_render_like_one(self):
+        contents = [
+            f"# Point {n}\n\n*Contents* <script>x</script> [link](/{n})\n"
+            for n in range(200)
+        ]
+        expected = [render_html(text) for text in contents]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertEqual(list(executor.map(render_html, contents)), expected)
+            cleaners = set(executor.map(lambda _: id(html_cleaner()), range(64)))
+        self.assertNotIn(id(html_cleaner()), cleaners)
+
+
+class CoursePointViewTests(CourseTestCase):
+    # Session, user and the annotated course point.
+    QUERY_BUDGET = 3
+
+    def test_navigation_and_type_relative_position(self):
+        response = self.get(self.coursepoints[2])
+        self.assertEqual(response.context["previous_point_id"], self.coursepoints[1].pk)
+        self.assertIsNone(response.context["next_point_id"])
+        self.assertEqual(response.context["type_relative_position"], 2)
+        self.assertContains(response, "<em>Contents</em> of point 3")
+
+    def test_query_budget(self):
+        # The first visit stores the rendered HTML.
+        self.get(self.coursepoints[1])
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.get(self.coursepoints[1])
+        self.assertEqual(response.context["previous_point_id"], self.coursepoints[0].pk)
+        self.assertEqual(response.context["next_point_id"], self.coursepoints[2].pk)
+
+    def test_neighbours_at_the_same_position(self):
+        CoursePoint.objects.filter(pk=self.coursepoints[2].pk).update(position=2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(self.coursepoints[1])
+        self.assertEqual(response.context["previous_point_id"], self.coursepoints[0].pk)
+        self.assertEqual(response.context["next_point_id"], self.coursepoints[2].pk)
+        for query in queries:
+            self.assertNotIn(" OVER ", query["sql"])
+        response = self.get(self.coursepoints[2])
+        self.assertEqual(response.context["previous_point_id"], self.coursepoints[1].pk)
+        self.assertIsNone(response.context["next_point_id"])
+
+    def test_points_of_other_users(self):
+        self.assertEqual(
+            self.client.get(
+                reverse("syllabooster:coursepointdetail", args=[0])
+            ).status_code,
+            404,
+        )
+        self.client.force_login(User.objects.create_user(username="other"))
+        self.assertContains(
+            self.get(self.coursepoints[0]), "Access Denied", status_code=403
+        )
+
+
+class UnitViewTests(CourseTestCase):
+    def test_queries_dont_grow_with_the_unit(self):
+        unit = self.coursepoints[0].unit
+        url = reverse("syllabooster:unit", args=[self.course.pk, unit.pk])
+
+        def get():
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            return response, len(queries)
+
+        response, queries = get()
+        self.assertEqual(
+            [
+                (coursepoint.relative_position, coursepoint.type_relative_position)
+                for coursepoint in response.context["page"]
+            ],
+            [(1, 1), (2, 1), (3, 2)],
+        )
+        point_type = self.coursepoints[0].point.point_type
+        state = self.coursepoints[0].state
+        for position in range(4, 14):
+            CoursePoint.objects.create(
+                course=self.course,
+                point=Point.objects.create(
+                    headline=f"Point {position}", point_type=point_type
+                ),
+                position=position,
+                state=state,
+                unit=unit,
+            )
+        renumber_points(self.course)
+        response, more_queries = get()
+        self.assertEqual(len(list(response.context["page"])), 13)
+        self.assertEqual(more_queries, queries)
+        self.assertContains(response, "Point 13")
+
+
+class FragmentCacheTests(CourseTestCase):
+    def test_fragment_cache_follows_the_course_version(self):
+        cache.clear()
+        coursepoint = self.coursepoints[0]
+        url = reverse("syllabooster:unit", args=[self.course.pk, coursepoint.unit_id])
+        self.assertContains(self.client.get(url), "Point 1")
+        Point.objects.filter(pk=coursepoint.point_id).update(headline="Renamed")
+        self.assertNotContains(self.client.get(url), "Renamed")
+        record_changes(
+            self.course.pk, [(CourseChange.POINT, coursepoint.point_id, False)]
+        )
+        self.assertContains(self.client.get(url), "Renamed")
+
+        list_url = reverse("syllabooster:unitlist", args=[self.course.pk])
+        self.assertContains(self.client.get(list_url), "Unit")
+        Unit.objects.filter(pk=coursepoint.unit_id).update(title="Retitled")
+        self.assertNotContains(self.client.get(list_url), "Retitled")
+        Course.bump_versions(pk=self.course.pk)
+        self.assertContains(self.client.get(list_url), "Retitled")
+
+    def test_deploys_change_the_fragment_cache_key(self):
+        cache.clear()
+        coursepoint = self.coursepoints[0]
+        url = reverse("syllabooster:unit", args=[self.course.pk, coursepoint.unit_id])
+        self.assertContains(self.client.get(url), "Point 1")
+        Point.objects.filter(pk=coursepoint.point_id).update(headline="Renamed")
+        self.assertNotContains(self.client.get(url), "Renamed")
+        with mock.patch(
+            "syllabooster.views.pages_fingerprint", return_value="redeployed"
+        ):
+            self.assertContains(self.client.get(url), "Renamed")
+
+    def test_pages_of_the_user(self):
+        unit = self.coursepoints[0].unit
+        response = self.client.get(reverse("syllabooster:index"), follow=True)
+        self.assertEqual(list(response.context["object_list"]), [self.course])
+        current_url = reverse("syllabooster:currentunit", args=[self.course.pk])
+        self.assertRedirects(
+            self.client.get(current_url),
+            reverse("syllabooster:unit", args=[self.course.pk, unit.pk]),
+        )
+        CoursePoint.objects.filter(course=self.course).delete()
+        self.assertRedirects(
+            self.client.get(current_url),
+            reverse("syllabooster:unitlist", args=[self.course.pk]),
+        )
+
+        self.client.force_login(User.objects.create_user(username="other"))
+        response = self.client.get(reverse("syllabooster:courselist"))
+        self.assertEqual(list(response.context["object_list"]), [])
+        for url in [
+            reverse("syllabooster:unitlist", args=[self.course.pk]),
+            reverse("syllabooster:unit", args=[self.course.pk, unit.pk]),
+        ]:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.client.get(url), "Access Denied", status_code=403
+                )
+        self.assertContains(
+            self.client.get(reverse("syllabooster:unauthorised")), "Access Denied"
+        )
+        self.client.logout()
+        response = self.client.get(reverse("syllabooster:courselist"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_unit_of_another_course(self):
+        unit = self.coursepoints[0].unit
+        self.client.get(reverse("syllabooster:unit", args=[self.course.pk, unit.pk]))
+        other = User.objects.create_user(username="other")
+        course = Course.objects.create(name="Other", user=other)
+        Course.objects.filter(pk=course.pk).update(version=self.course.version)
+        self.client.force_login(other)
+        for name in ["unit", "unitfragment"]:
+            with self.subTest(name=name):
+                response = self.client.get(
+                    reverse(f"syllabooster:{name}", args=[course.pk, unit.pk]),
+                    {"after": "0.0"} if name == "unitfragment" else {},
+                )
+                self.assertEqual(response.status_code, 404)
+                self.assertNotContains(response, "Point 1", status_code=404)
+
+    def test_admin_edits_are_cached_under_a_new_version(self):
+        point = self.coursepoints[0].point
+        tag = Tag.objects.create(name="new-tag")
+        versions = []
+        original_bump_versions = Course.bump_versions
+
+        def bump_versions(**filters):
+            # The tags must be saved by the time the version changes.
+            versions.append(list(point.tags.values_list("name", flat=True)))
+            return original_bump_versions(**filters)
+
+        self.client.force_login(User.objects.create_superuser("admin"))
+        with mock.patch.object(Course, "bump_versions", side_effect=bump_versions):
+            response = self.client.post(
+                reverse("admin:syllabooster_point_change", args=[point.pk]),
+                {
+                    "headline": point.headline,
+                    "contents": point.contents,
+                    "tags": [tag.pk],
+                    "point_type": point.point_type_id,
+                },
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(versions, [["new-tag"]])
+
+
+class MetricsTests(CourseTestCase):
+    def test_metrics(self):
+        self.get(self.coursepoints[1])
+        registry.clear()
+        self.get(self.coursepoints[1])
+        labels = f'pid="{os.getpid()}",view="syllabooster:coursepointdetail"'
+        response = self.client.get(reverse("syllabooster:metrics"))
+        self.assertContains(
+            response, f'syllabooster_requests_total{{{labels},status="200"}} 1'
+        )
+        self.assertContains(
+            response,
+            f"syllabooster_request_queries_sum{{{labels}}} {CoursePointViewTests.QUERY_BUDGET}",
+        )
+        response = self.client.get(
+            reverse("syllabooster:metrics"), REMOTE_ADDR="192.0.2.1"
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_of_all_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_DIR=directory):
+                registry.clear()
+                self.get(self.coursepoints[1])
+                save_metrics(directory)
+                saved = os.path.join(directory, f"{os.getpid()}.json")
+                # A live worker, and one that died without removing its file.
+                for pid in [os.getppid(), 2**22 + 1]:
+                    shutil.copy(saved, os.path.join(directory, f"{pid}.json"))
+                registry.clear()
+                response = self.client.get(reverse("syllabooster:metrics"))
+                self.assertEqual(
+                    set(os.listdir(directory)),
+                    {f"{os.getpid()}.json", f"{os.getppid()}.json"},
+                )
+        self.assertContains(
+            response,
+            f'syllabooster_requests_total{{pid="{os.getppid()}",'
+            'view="syllabooster:coursepointdetail",status="200"} 1',
+        )
+        self.assertNotContains(response, f'pid="{os.getpid()}"')
+        self.assertNotContains(response, f'pid="{2**22 + 1}"')
+        self.assertEqual(
+            response.content.decode().count(
+                "# TYPE syllabooster_requests_total counter"
+            ),
+            1,
+        )
+
+    def test_metrics_of_streaming_responses(self):
+        def chunks():
+            yield "courses: "
+            yield str(Course.objects.count())
+            yield str(Unit.objects.count())
+
+        async def achunks():
+            yield "courses: "
+            yield str(await Course.objects.acount())
+            yield str(await Unit.objects.acount())
+
+        def view(request):
+            return StreamingHttpResponse(chunks())
+
+        async def aview(request):
+            return StreamingHttpResponse(achunks())
+
+        registry.clear()
+        response = metrics_middleware(view)(RequestFactory().get("/"))
+        self.assertEqual(registry.views, {})
+        self.assertEqual(b"".join(response.streaming_content), b"courses: 11")
+        metrics = registry.views["unmatched"]
+        self.assertEqual((metrics.queries.sum, metrics.statuses), (2, {200: 1}))
+
+        async def consume():
+            response = await metrics_middleware(aview)(RequestFactory().get("/"))
+            return [chunk async for chunk in response.streaming_content]
+
+        registry.clear()
+        self.assertEqual(async_to_sync(consume)(), [b"courses: ", b"1", b"1"])
+        self.assertEqual(registry.views["unmatched"].queries.sum, 2)
+
+
+class ConditionalGetTests(CourseTestCase):
+    def test_conditional_get(self):
+        unit = self.coursepoints[0].unit
+        for url in [
+            reverse("syllabooster:unitlist", args=[self.course.pk]),
+            reverse("syllabooster:unit", args=[self.course.pk, unit.pk]),
+            reverse("syllabooster:exportcourse")
+            + f"?username={self.user.username}&coursename={self.course.name}",
+        ]:
+            with self.subTest(url=url):
+                # The first page sets the CSRF cookie, which is part of the ETag.
+                self.client.get(url)
+                etag = self.client.get(url)["ETag"]
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                for query in queries:
+                    self.assertNotIn("point", query["sql"])
+                Course.bump_versions(pk=self.course.pk)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_deploys_change_the_etag(self):
+        url = reverse("syllabooster:unitlist", args=[self.course.pk])
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        with mock.patch(
+            "syllabooster.views.pages_fingerprint", return_value="redeployed"
+        ):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class KeysetPaginationTests(CourseTestCase):
+    @override_settings(LIST_PAGE_SIZE=2)
+    def test_unit_pages(self):
+        unit = self.coursepoints[0].unit
+        url = reverse("syllabooster:unit", args=[self.course.pk, unit.pk])
+        fragment_url = reverse(
+            "syllabooster:unitfragment", args=[self.course.pk, unit.pk]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            page = self.client.get(url).context["page"]
+        self.assertEqual(list(page), self.coursepoints[:2])
+        for query in queries:
+            self.assertNotIn("OFFSET", query["sql"])
+        self.assertIsNone(page.previous_key)
+        response = self.client.get(fragment_url, {"after": page.next_key})
+        self.assertEqual(list(response.context["page"]), self.coursepoints[2:])
+        self.assertIsNone(response.context["page"].next_key)
+        self.assertContains(response, "Point 3")
+        self.assertNotContains(response, "<html")
+
+        # Deep links start a row before the current point.
+        Course.objects.filter(pk=self.course.pk).update(current_position=3)
+        Course.bump_versions(pk=self.course.pk)
+        page = self.client.get(url).context["page"]
+        self.assertEqual(list(page), self.coursepoints[1:])
+        response = self.client.get(fragment_url, {"before": page.previous_key})
+        self.assertEqual(list(response.context["page"]), self.coursepoints[:1])
+
+        self.assertEqual(self.client.get(fragment_url).status_code, 400)
+        self.assertEqual(self.client.get(url, {"after": "x"}).status_code, 400)
+
+
+class SearchTests(CourseTestCase):
+    def test_search(self):
+        other = User.objects.create_user(username="other")
+        course = Course.objects.create(name="Other", user=other)
+        CoursePoint.objects.create(
+            course=course, point=self.coursepoints[0].point, position=1
+        )
+        url = reverse("syllabooster:search")
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {"q": "contents"})
+        results = response.json()["results"]
+        self.assertEqual(
+            [result["coursePointId"] for result in results],
+            [coursepoint.pk for coursepoint in self.coursepoints],
+        )
+        self.assertEqual(results[0]["unitTitle"], "Unit")
+        self.assertEqual(results[0]["headline"], "Point 1")
+        response = self.client.get(url, {"q": "point 2", "course": self.course.pk})
+        self.assertEqual(
+            [result["coursePointId"] for result in response.json()["results"]],
+            [self.coursepoints[1].pk],
+        )
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {"q": "point", "course": course.pk}).status_code, 404
+        )
+
+
+class StateMachineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        theory = PointType.objects.create(name="theory")
+        cls.pending = DeliveryState.objects.create(
+            point_type=theory, position=0, name="pending"
+        )
+
+    def setUp(self):
+        statemachine.invalidate_transition_table()
+
+    def rename_elsewhere(self, name):
+        """Rename the state the way another process would: no signal
+        reaches this one."""
+        DeliveryState.objects.filter(pk=self.pending.pk).update(display_name=name)
+
+    def test_transitions(self):
+        delivered = DeliveryState.objects.create(
+            point_type=self.pending.point_type, position=1, name="delivered"
+        )
+        exercise = PointType.objects.create(name="exercise")
+        assigned = DeliveryState.objects.create(
+            point_type=exercise, position=0, name="assigned"
+        )
+        pending = statemachine.get_state(self.pending.pk)
+        self.assertEqual((pending.next_pk, pending.terminal), (delivered.pk, False))
+        # The table is read once, and then served from memory.
+        with self.assertNumQueries(0):
+            delivered = statemachine.get_state(delivered.pk)
+            self.assertEqual(
+                (delivered.next_pk, delivered.terminal), (pending.pk, True)
+            )
+            self.assertEqual(statemachine.next_state(assigned.pk).pk, assigned.pk)
+            self.assertEqual(
+                [state.name for state in statemachine.get_states(exercise.pk)],
+                ["assigned"],
+            )
+            self.assertIsNone(statemachine.get_state(0))
+
+    @mock.patch.object(statemachine, "STATE_TABLE_CHECK_INTERVAL", 0)
+    def test_other_processes_invalidate_the_table(self):
+        self.rename_elsewhere("Before")
+        self.assertEqual(statemachine.get_state(self.pending.pk).display_name, "Before")
+        self.rename_elsewhere("After")
+        self.assertEqual(statemachine.get_state(self.pending.pk).display_name, "Before")
+        cache.incr(statemachine.STATE_TABLE_GENERATION_KEY)
+        self.assertEqual(statemachine.get_state(self.pending.pk).display_name, "After")
+        self.rename_elsewhere("Async")
+        cache.incr(statemachine.STATE_TABLE_GENERATION_KEY)
+        state = async_to_sync(statemachine.aget_state)(self.pending.pk)
+        self.assertEqual(state.display_name, "Async")
+
+    def test_table_expires(self):
+        self.rename_elsewhere("Before")
+        self.assertEqual(statemachine.get_state(self.pending.pk).display_name, "Before")
+        self.rename_elsewhere("After")
+        now = time.monotonic()
+        with mock.patch.object(time, "monotonic", return_value=now + 1000):
+            state = statemachine.get_state(self.pending.pk)
+        self.assertEqual(state.display_name, "After")
+
+
+class StateTestCase(TestCase):
+    """A course of "teacher", who is logged in, with a theory point, and the
+    states of the theory (pending and delivered) and exercise (assigned)
+    point types."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="teacher")
+        theory = PointType.objects.create(name="theory")
+        exercise = PointType.objects.create(name="exercise")
+        cls.pending = DeliveryState.objects.create(
+            point_type=theory, position=0, name="pending"
+        )
+        cls.delivered = DeliveryState.objects.create(
+            point_type=theory, position=1, name="delivered"
+        )
+        cls.assigned = DeliveryState.objects.create(
+            point_type=exercise, position=0, name="assigned"
+        )
+        cls.course = Course.objects.create(name="Course", user=cls.user)
+        cls.coursepoint = CoursePoint.objects.create(
+            course=cls.course,
+            point=Point.objects.create(headline="Point", point_type=theory),
+            position=1,
+            state=cls.pending,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+
+class CurrentPositionTests(StateTestCase):
+    def test_moving_a_state_updates_both_point_types(self):
+        self.delivered.point_type = self.assigned.point_type
+        self.delivered.position = 1
+        self.delivered.save()
+        self.assertEqual(
+            dict(DeliveryState.objects.values_list("name", "is_terminal")),
+            {"pending": True, "delivered": True, "assigned": False},
+        )
+
+    def test_current_position_follows_the_frontier(self):
+        coursepoints = [self.coursepoint] + [
+            CoursePoint.objects.create(
+                course=self.course,
+                point=Point.objects.create(
+                    headline=f"Point {position}",
+                    point_type=self.pending.point_type,
+                ),
+                position=position,
+                state=self.pending,
+            )
+            for position in (2, 3, 4)
+        ]
+
+        def set_done(index, done):
+            coursepoint = coursepoints[index]
+            coursepoint.state = self.delivered if done else self.pending
+            coursepoint.save(update_fields=["state"])
+            return move_course_current_position(
+                self.course, coursepoint, not done, done
+            )
+
+        self.assertEqual(set_done(1, True), 3)
+        self.assertEqual(set_done(3, True), 5)
+        # Points done behind the frontier don't move it back.
+        self.assertEqual(set_done(0, True), 5)
+        # Undoing the last done point goes back to the previous done one,
+        # undoing others doesn't move it.
+        self.assertEqual(set_done(1, False), 5)
+        self.assertEqual(set_done(3, False), 2)
+        self.assertEqual(set_done(0, False), 0)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.current_position, 0)
+        # The full recompute agrees.
+        self.assertEqual(update_course_current_position(self.course), 0)
+        set_done(2, True)
+        self.assertEqual(update_course_current_position(self.course), 4)
+
+
+class SyncStatesTests(StateTestCase):
+    def sync(self, operations, client_id="phone"):
+        return self.client.post(
+            reverse("syllabooster:syncstates"),
+            {"clientId": client_id, "operations": operations},
+            content_type="application/json",
+        )
+
+    def operation(self, state, client_seq):
+        return {
+            "coursePointId": self.coursepoint.pk,
+            "targetStateId": state.pk,
+            "clientSeq": client_seq,
+        }
+
+    def test_applied_and_duplicate(self):
+        operations = [self.operation(self.delivered, 1)]
+        data = self.sync(operations).json()
+        self.assertEqual(data["results"], [{"clientSeq": 1, "status": "applied"}])
+        self.assertEqual(data["states"][0]["stateId"], self.delivered.pk)
+        self.assertEqual(data["currentPositions"], {str(self.course.pk): 2})
+        self.coursepoint.refresh_from_db()
+        self.assertEqual(self.coursepoint.state, self.delivered)
+
+        # Replaying the operation after a later change doesn't undo it.
+        self.sync([self.operation(self.pending, 2)])
+        data = self.sync(operations).json()
+        self.assertEqual(data["results"], [{"clientSeq": 1, "status": "duplicate"}])
+        self.coursepoint.refresh_from_db()
+        self.assertEqual(self.coursepoint.state, self.pending)
+        self.assertEqual(StateSyncOperation.objects.count(), 2)
+        # The same sequence number from another client is another operation.
+        data = self.sync(operations, client_id="laptop").json()
+        self.assertEqual(data["results"][0]["status"], "applied")
+
+    def test_batches_are_applied_in_client_order(self):
+        data = self.sync(
+            [self.operation(self.pending, 2), self.operation(self.delivered, 1)]
+        ).json()
+        self.assertEqual([result["clientSeq"] for result in data["results"]], [1, 2])
+        self.assertEqual(data["states"][0]["stateId"], self.pending.pk)
+        self.assertEqual(data["currentPositions"], {str(self.course.pk): 0})
+        response = self.sync(
+            [
+                self.operation(self.delivered, seq)
+                for seq in range(MAX_SYNC_OPERATIONS + 1)
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_transition(self):
+        data = self.sync([self.operation(self.assigned, 1)]).json()
+        self.assertEqual(data["results"][0]["status"], "rejected")
+        self.coursepoint.refresh_from_db()
+        self.assertEqual(self.coursepoint.state, self.pending)
+        self.assertFalse(StateSyncOperation.objects.get().accepted)
+        # Course points of other users are rejected too.
+        other = User.objects.create_user(username="other")
+        self.client.force_login(other)
+        data = self.sync([self.operation(self.delivered, 1)]).json()
+        self.assertEqual(data["results"][0]["status"], "rejected")
+
+    def test_malformed_payload(self):
+        for operations in [
+            None,
+            [{"coursePointId": self.coursepoint.pk, "clientSeq": 1}],
+            [self.operation(self.delivered, "one")],
+            [self.operation(self.delivered, -1)],
+            [self.operation(self.delivered, 2**63)],
+        ]:
+            with self.subTest(operations=operations):
+                response = self.sync(operations)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["status"], "error")
+        self.assertFalse(StateSyncOperation.objects.exists())
+
+
+class AsyncViewTests(StateTestCase):
+    def test_cycle_state(self):
+        url = reverse("syllabooster:cyclestate")
+        body = {"coursepointId": self.coursepoint.pk}
+        data = self.client.post(url, body, content_type="application/json").json()
+        self.assertEqual(data["stateId"], self.delivered.pk)
+        self.assertEqual((data["currentPosition"], data["done"]), (2, True))
+        data = self.client.post(url, body, content_type="application/json").json()
+        self.assertEqual(data["stateId"], self.pending.pk)
+        self.assertEqual((data["currentPosition"], data["done"]), (0, False))
+        self.client.force_login(User.objects.create_user(username="other"))
+        response = self.client.post(url, body, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.coursepoint.refresh_from_db()
+        self.assertEqual(self.coursepoint.state, self.pending)
+
+    def test_cycle_state_is_atomic(self):
+        url = reverse("syllabooster:cyclestate")
+        body = {"coursepointId": self.coursepoint.pk}
+        with mock.patch(
+            "syllabooster.views.record_changes", side_effect=RuntimeError("log")
+        ):
+            response = self.client.post(url, body, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.coursepoint.refresh_from_db()
+        self.course.refresh_from_db()
+        self.assertEqual(self.coursepoint.state, self.pending)
+        self.assertEqual(self.course.current_position, 0)
+
+    async def test_export_under_asgi(self):
+        client = AsyncClient()
+        url = reverse("syllabooster:exportcourse")
+        params = {"username": "teacher", "coursename": "Course"}
+        response = await client.get(url, params)
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        expected = await sync_to_async(
+            lambda: "".join(export_course_org(self.course))
+        )()
+        self.assertEqual(b"".join(chunks).decode(), expected)
+        response = await client.get(
+            url, params, headers={"If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class OrgCourseTestCase(TestCase):
+    """An empty course of "teacher", the point type and states of ORG, and
+    write() to import an org text into the course."""
+
+    ORG = """#+TODO: PENDING | DELIVERED
+* Unit one
+** PENDING Point A
+   Contents of A
+** PENDING Point B
+   Contents of B
+* Unit two
+** DELIVERED Point C
+   Contents of C
+"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="teacher")
+        theory = PointType.objects.create(name="theory")
+        DeliveryState.objects.create(
+            point_type=theory, position=0, name="pending", display_name="PENDING"
+        )
+        DeliveryState.objects.create(
+            point_type=theory, position=1, name="delivered", display_name="DELIVERED"
+        )
+        cls.course = Course.objects.create(name="Course", user=cls.user)
+
+    def write(self, org):
+        return write_course(self.course, parse_org_course(org), prune=True)
+
+
+class BulkImportTests(OrgCourseTestCase):
+    def test_queries_dont_grow_with_the_course(self):
+        PointType.objects.create(name="exercise")
+        counts = []
+        for units in (2, 16):
+            Point.objects.all().delete()
+            Tag.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                result = importstr.parse_org(
+                    self.course,
+                    synthetic_org(units, 5, rich=True),
+                    self.user,
+                    output=io.StringIO(),
+                )
+            self.assertEqual((result["units"], result["points"]), (units, units * 5))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(
+            Point.objects.get(headline="Load test point 3.3").point_type.name,
+            "exercise",
+        )
+        coursepoint = CoursePoint.objects.get(
+            course=self.course, point__headline="Load test point 3.1"
+        )
+        self.assertEqual(coursepoint.state.name, "pending")
+        self.assertEqual(
+            sorted(coursepoint.point.tags.values_list("name", flat=True)),
+            ["tag1", "unit3"],
+        )
+
+
+class RenumberPointsTests(OrgCourseTestCase):
+    def positions(self):
+        return list(
+            CoursePoint.objects.filter(course=self.course)
+            .order_by("position")
+            .values_list("point__headline", "position", "relative_position")
+        )
+
+    def test_renumber_from_unit(self):
+        self.write(self.ORG + "** PENDING Point D\n   Contents of D\n")
+        one, two = Unit.objects.filter(course=self.course).order_by("position")
+        for headline, position in [
+            ("Point A", 10),
+            ("Point B", 20),
+            ("Point C", 105),
+            ("Point D", 106),
+        ]:
+            CoursePoint.objects.filter(point__headline=headline).update(
+                position=position
+            )
+
+        self.assertEqual(renumber_points(self.course, from_unit=two), 2)
+        self.assertEqual(
+            self.positions(),
+            [
+                ("Point A", 10, 1),
+                ("Point B", 20, 2),
+                ("Point C", 21, 1),
+                ("Point D", 22, 2),
+            ],
+        )
+        self.assertEqual(renumber_points(self.course, from_unit=two), 0)
+        self.assertEqual(renumber_points(self.course), 4)
+        self.assertEqual(
+            [position for _, position, _ in self.positions()], [1, 2, 3, 4]
+        )
+
+    def test_changed_points_are_logged(self):
+        self.write(self.ORG)
+        renumber_points(self.course)
+        CoursePoint.objects.filter(point__headline="Point B").update(position=0)
+        version = changes_since(self.course)["version"]
+        self.assertEqual(renumber_points(self.course), 2)
+        delta = changes_since(self.course, since=version)
+        self.assertEqual(
+            sorted(change["data"]["position"] for change in delta["changes"]),
+            [1, 2],
+        )
+        self.assertEqual(
+            [headline for headline, _, _ in self.positions()],
+            ["Point B", "Point A", "Point C"],
+        )
+
+
+class ExportCourseTests(OrgCourseTestCase):
+    def export(self):
+        return "".join(export_course_org(self.course, chunk_size=100))
+
+    def test_exported_org(self):
+        self.write(self.ORG + "* Unit three\n")
+        Point.objects.get(headline="Point B").tags.add(
+            Tag.objects.create(name="x"), Tag.objects.create(name="y")
+        )
+        # The text written by the export before it was streamed, including
+        # the space after headlines without tags.
+        self.assertEqual(
+            self.export(),
+            "#+title: Course\n"
+            "#+TODO: PENDING(p) | DELIVERED(d)\n"
+            "#+TODO: UNASSIGNED(u) ASSIGNED(a) | REVIEWED(r)\n"
+            "* Unit one\n  :PROPERTIES:\n  :POSITION: 1\n  :END:\n"
+            "** PENDING Point A \n"
+            "   :PROPERTIES:\n   :TYPE: theory\n   :POSITION: 1001\n   :END:\n"
+            "      Contents of A\n"
+            "** PENDING Point B  :x:y:\n"
+            "   :PROPERTIES:\n   :TYPE: theory\n   :POSITION: 1002\n   :END:\n"
+            "      Contents of B\n"
+            "* Unit two\n  :PROPERTIES:\n  :POSITION: 2\n  :END:\n"
+            "** DELIVERED Point C \n"
+            "   :PROPERTIES:\n   :TYPE: theory\n   :POSITION: 2001\n   :END:\n"
+            "      Contents of C\n"
+            "* Unit three\n  :PROPERTIES:\n  :POSITION: 3\n  :END:\n",
+        )
+        response = self.client.get(
+            reverse("syllabooster:exportcourse"),
+            {"username": "teacher", "coursename": "Course"},
+        )
+        self.assertEqual(b"".join(response.streaming_content).decode(), self.export())
+
+    def test_queries_dont_grow_with_the_course(self):
+        # Units, course points and their tags.
+        for units in (2, 20):
+            self.write(synthetic_org(units, 5))
+            with self.assertNumQueries(3):
+                self.export()
+
+
+class DirectoryImportTests(OrgCourseTestCase):
+    def test_import_of_a_directory(self):
+        files = {
+            "unit1.org": "* One\n** PENDING Point 1.1\n** DELIVERED Point 1.2\n",
+            "unit2.org": "* Two\n** PENDING Point 2.1\n",
+            "unit10.org": "* Ten\n** PENDING Point 10.1\n** PENDING Point 10.2\n",
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for name, org in files.items():
+                with open(os.path.join(directory, name), "w") as orgfile:
+                    orgfile.write("#+TODO: PENDING | DELIVERED\n" + org)
+            call_command(
+                "importcourse",
+                "Course",
+                directory,
+                user="teacher",
+                force=True,
+                jobs=2,
+                stdout=io.StringIO(),
+            )
+        self.assertEqual(
+            list(
+                CoursePoint.objects.filter(course=self.course)
+                .order_by("position")
+                .values_list("unit__position", "unit__title", "position", "state__name")
+            ),
+            [
+                (1, "One", 1, "pending"),
+                (1, "One", 2, "delivered"),
+                (2, "Two", 3, "pending"),
+                (3, "Ten", 4, "pending"),
+                (3, "Ten", 5, "pending"),
+            ],
+        )
+
+
+class DiffImportTests(OrgCourseTestCase):
+    def test_unchanged_import_writes_nothing(self):
+        self.write(self.ORG)
+        ids = set(CoursePoint.objects.values_list("id", flat=True))
+        # Savepoint and release, point types, states, units, course points
+        # and the lookup of stale course points: no writes.
+        with self.assertNumQueries(7):
+            result = self.write(self.ORG)
+        self.assertEqual(result["changes"]["coursepoints"]["unchanged"], 3)
+        self.assertEqual(set(CoursePoint.objects.values_list("id", flat=True)), ids)
+
+    def test_only_changed_rows_are_written(self):
+        self.write(self.ORG)
+        result = self.write(
+            self.ORG.replace("Contents of B", "New contents of B").replace(
+                "* Unit two\n** DELIVERED Point C\n   Contents of C\n", ""
+            )
+        )
+        changes = result["changes"]
+        self.assertEqual(changes["units"]["deleted"], 1)
+        self.assertEqual(changes["points"]["updated"], 1)
+        self.assertEqual(changes["coursepoints"]["updated"], 1)
+        self.assertEqual(changes["coursepoints"]["deleted"], 1)
+        self.assertEqual(changes["coursepoints"]["unchanged"], 1)
+        self.assertEqual(
+            Point.objects.get(headline="Point B").contents, "   New contents of B"
+        )
+
+    def test_reimport_keeps_states_set_in_the_app(self):
+        self.write(self.ORG)
+        delivered = DeliveryState.objects.get(name="delivered")
+        CoursePoint.objects.filter(point__headline="Point A").update(state=delivered)
+        result = self.write(self.ORG.replace("Contents of B", "New contents of B"))
+        self.assertEqual(result["changes"]["coursepoints"]["updated"], 1)
+        coursepoint = CoursePoint.objects.get(point__headline="Point A")
+        self.assertEqual(coursepoint.state, delivered)
+        # A state changed in the file is imported.
+        self.write(self.ORG.replace("PENDING Point B", "DELIVERED Point B"))
+        coursepoint = CoursePoint.objects.get(point__headline="Point B")
+        self.assertEqual(coursepoint.state, delivered)
+        self.assertEqual(
+            CoursePoint.objects.get(point__headline="Point A").state, delivered
+        )
+
+
+class PrerenderTests(OrgCourseTestCase):
+    def test_prerender_after_import(self):
+        for org in [self.ORG, self.ORG.replace("Contents of A", "New contents")]:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.write(org)
+        # The import only queues the rendering, once per course.
+        job = ImportJob.objects.get()
+        self.assertEqual((job.kind, job.course_name), (ImportJob.PRERENDER, "Course"))
+        self.assertFalse(any(point.has_fresh_html() for point in Point.objects.all()))
+        run_import_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (ImportJob.DONE, {"points": 3}))
+        for point in Point.objects.all():
+            self.assertTrue(point.has_fresh_html())
+        self.assertEqual(
+            Point.objects.get(headline="Point A").html, "<p>New contents</p>\n"
+        )
+        with override_settings(PRERENDER_AFTER_IMPORT=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.write(self.ORG)
+        self.assertEqual(ImportJob.objects.count(), 1)
+
+    def test_prerender_in_processes(self):
+        self.write(self.ORG)
+        Point.objects.update(html="", html_key="")
+        self.assertEqual(prerender_points(Point.objects.all(), jobs=2, batch_size=1), 3)
+        self.assertEqual(prerender_points(Point.objects.all(), jobs=2, batch_size=1), 0)
+        for point in Point.objects.all():
+            self.assertTrue(point.has_fresh_html())
+
+
+class StreamingImportTests(OrgCourseTestCase):
+    def test_streamed_import_matches_whole_import(self):
+        self.write(self.ORG)
+        edited = self.ORG.replace("Contents of B", "New contents of B").replace(
+            "** PENDING Point A\n   Contents of A\n", ""
+        )
+        result = write_course_units(
+            self.course, iter_org_units(io.StringIO(edited)), prune=True
+        )
+        self.assertEqual(result["changes"]["coursepoints"]["updated"], 1)
+        self.assertEqual(result["changes"]["coursepoints"]["deleted"], 1)
+        streamed = list(
+            CoursePoint.objects.values_list(
+                "point__headline", "position", "unit__position", "content_hash"
+            )
+        )
+        result = self.write(edited)
+        self.assertEqual(result["changes"]["coursepoints"]["unchanged"], 2)
+        self.assertEqual(
+            list(
+                CoursePoint.objects.values_list(
+                    "point__headline", "position", "unit__position", "content_hash"
+                )
+            ),
+            streamed,
+        )
+
+    def test_units_are_parsed_as_they_are_read(self):
+        lines = self.ORG.splitlines(keepends=True)
+        read = []
+
+        def reader():
+            for line in lines:
+                read.append(line)
+                yield line
+
+        units = iter_org_units(reader())
+        first = next(units)
+        self.assertEqual([unit.title for unit in first.units], ["Unit one"])
+        self.assertLess(len(read), len(lines))
+        self.assertEqual([point.headline for point in next(units).points], ["Point C"])
+
+
+class ChangeLogTests(OrgCourseTestCase):
+    def test_changes_since_version(self):
+        self.write(self.ORG)
+        version = changes_since(self.course)["version"]
+        self.assertEqual(changes_since(self.course, since=version)["changes"], [])
+
+        self.write(
+            self.ORG.replace("Contents of B", "New contents of B").replace(
+                "* Unit two\n** DELIVERED Point C\n   Contents of C\n", ""
+            )
+        )
+        delta = changes_since(self.course, since=version)
+        self.assertGreater(delta["version"], version)
+        point_b = Point.objects.get(headline="Point B")
+        self.assertIn(
+            {
+                "sequence": delta["version"],
+                "kind": "point",
+                "id": point_b.pk,
+                "deleted": False,
+                "data": {
+                    "headline": "Point B",
+                    "contents": "   New contents of B",
+                    "pointType": "theory",
+                    "tags": [],
+                },
+            },
+            delta["changes"],
+        )
+        deleted = [change for change in delta["changes"] if change["deleted"]]
+        self.assertEqual(
+            sorted(change["kind"] for change in deleted), ["coursepoint", "unit"]
+        )
+        self.assertTrue(all(change["data"] is None for change in deleted))
+
+        # Paging through the same delta gives the same changes.
+        paged, cursor = [], None
+        while True:
+            page = changes_since(self.course, since=version, cursor=cursor, limit=1)
+            paged += page["changes"]
+            cursor = page["nextCursor"]
+            if cursor is None:
+                break
+        self.assertEqual(paged, delta["changes"])
+
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse("syllabooster:coursechanges", args=[self.course.pk]),
+            {"since": version},
+        )
+        self.assertEqual(response.json()["changes"], delta["changes"])
+        response = self.client.get(
+            reverse("syllabooster:coursechanges", args=[self.course.pk]),
+            {"cursor": "nonsense"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_shared_point_changes_are_logged_in_every_course(self):
+        other = Course.objects.create(name="Other", user=self.user)
+        write_course(other, parse_org_course(self.ORG))
+        version = changes_since(other)["version"]
+        self.write(self.ORG.replace("Contents of B", "New contents of B"))
+        delta = changes_since(other, since=version)
+        point_b = Point.objects.get(headline="Point B")
+        self.assertEqual(
+            [(change["kind"], change["id"]) for change in delta["changes"]],
+            [("point", point_b.pk)],
+        )
+        self.assertEqual(
+            delta["changes"][0]["data"]["contents"], "   New contents of B"
+        )
+
+    def test_cascaded_deletes_in_admin_are_logged(self):
+        self.write(self.ORG)
+        version = changes_since(self.course)["version"]
+        unit = Unit.objects.get(title="Unit one")
+        unit_id = unit.pk
+        coursepoint_ids = set(unit.coursepoint_set.values_list("pk", flat=True))
+        UnitAdmin(Unit, admin.site).delete_model(None, unit)
+        delta = changes_since(self.course, since=version)
+        self.assertEqual(
+            {(change["kind"], change["id"]) for change in delta["changes"]},
+            {("unit", unit_id)} | {("coursepoint", pk) for pk in coursepoint_ids},
+        )
+        self.assertTrue(all(change["deleted"] for change in delta["changes"]))
+
+    def test_points_moved_in_admin_are_logged_in_both_courses(self):
+        self.write(self.ORG)
+        other = Course.objects.create(name="Other", user=self.course.user)
+        versions = [changes_since(course)["version"] for course in [self.course, other]]
+        coursepoint = CoursePoint.objects.get(point__headline="Point A")
+        coursepoint.course = other
+        coursepoint_admin = CoursePointAdmin(CoursePoint, admin.site)
+        coursepoint_admin.save_model(None, coursepoint, None, True)
+        coursepoint_admin.save_related(None, mock.Mock(instance=coursepoint), [], True)
+        for course, version, deleted in [
+            (self.course, versions[0], True),
+            (other, versions[1], False),
+        ]:
+            delta = changes_since(course, since=version)
+            self.assertEqual(
+                [
+                    (change["kind"], change["id"], change["deleted"])
+                    for change in delta["changes"]
+                ],
+                [("coursepoint", coursepoint.pk, deleted)],
+            )
+
+
+class SnapshotTests(OrgCourseTestCase):
+    def test_snapshot(self):
+        self.write(self.ORG)
+        Point.objects.get(headline="Point B").tags.add(Tag.objects.create(name="x"))
+        url = reverse("syllabooster:snapshot")
+        params = {"username": "teacher", "coursename": "Course"}
+        # User, course, point types, states, units, course points and tags.
+        with self.assertNumQueries(7):
+            response = self.client.get(url, params, HTTP_ACCEPT_ENCODING="gzip")
+            body = b"".join(response.streaming_content)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        snapshot = json.loads(gzip.decompress(body))
+        points = snapshot["points"]
+        self.assertEqual(points["headline"], ["Point A", "Point B", "Point C"])
+        self.assertEqual(
+            [snapshot["units"]["title"][unit] for unit in points["unit"]],
+            ["Unit one", "Unit one", "Unit two"],
+        )
+        self.assertEqual(
+            [snapshot["states"]["name"][state] for state in points["state"]],
+            ["pending", "pending", "delivered"],
+        )
+        self.assertEqual(
+            [
+                [snapshot["tags"]["name"][tag] for tag in tags]
+                for tags in points["tags"]
+            ],
+            [[], ["x"], []],
+        )
+
+        response = self.client.get(url, params)
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), snapshot)
+
+    def test_columns_are_encoded_in_batches(self):
+        self.write(self.ORG)
+        snapshot = course_snapshot(self.course)
+        snapshot["points"]["contents"] = [f"Contents {n}" for n in range(25)]
+        chunks = list(snapshot_json(snapshot, batch_size=10))
+        self.assertEqual(json.loads("".join(chunks)), snapshot)
+        batches = [chunk for chunk in chunks if "Contents " in chunk]
+        self.assertEqual(
+            [batch.split(",")[-1] for batch in batches],
+            ['"Contents 9"', '"Contents 19"', '"Contents 24"'],
+        )
+        self.assertEqual(json.loads("".join(json_array([], batch_size=10))), [])
+
+
+class ImportJobTests(TransactionTestCase):
+    # The worker runs its jobs in threads, with their own connections (only
+    # one here: SQLite doesn't take concurrent writes).
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="teacher")
+        self.client.force_login(self.user)
+        theory = PointType.objects.create(name="theory")
+        DeliveryState.objects.create(point_type=theory, position=0, name="pending")
+        DeliveryState.objects.create(point_type=theory, position=1, name="delivered")
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        self.spool_dir = spool_dir.name
+        settings = override_settings(IMPORT_SPOOL_DIR=self.spool_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def post_file(self, contents, content_type="text/markdown"):
+        return self.client.post(
+            reverse("syllabooster:importorg")
+            + "?username=teacher&course_name=Uploaded",
+            contents,
+            content_type=content_type,
+        )
+
+    def job_status(self, response):
+        return self.client.get(response.json()["statusUrl"]).json()
+
+    def test_worker_runs_queued_imports(self):
+        json_response = self.client.post(
+            reverse("syllabooster:importorg"),
+            {
+                "username": "teacher",
+                "course_name": "Sent",
+                "input_string": synthetic_org(2, 3),
+            },
+            content_type="application/json",
+        )
+        file_response = self.post_file(synthetic_md(3, 2))
+        self.assertEqual(json_response.status_code, 202)
+        self.assertEqual(self.job_status(json_response)["jobStatus"], ImportJob.PENDING)
+        self.assertEqual(len(os.listdir(self.spool_dir)), 1)
+
+        output = io.StringIO()
+        call_command("runimportworker", "--once", concurrency=1, stdout=output)
+        for response, course_name, points in [
+            (json_response, "Sent", 6),
+            (file_response, "Uploaded", 6),
+        ]:
+            status = self.job_status(response)
+            self.assertEqual(status["jobStatus"], ImportJob.DONE, status["message"])
+            self.assertEqual((status["progress"], status["total"]), (points, points))
+            course = Course.objects.get(user=self.user, name=course_name)
+            self.assertEqual(course.coursepoint_set.count(), points)
+        # Each import queued the rendering of its course, which ran after it.
+        self.assertEqual(output.getvalue().count("Import job"), 2)
+        self.assertEqual(output.getvalue().count("Prerender job"), 2)
+        self.assertEqual(output.getvalue().count(": done"), 4)
+        for point in Point.objects.all():
+            self.assertTrue(point.has_fresh_html())
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_stale_jobs_are_queued_again(self):
+        started_at = timezone.now() - timedelta(hours=2)
+        for course_name, heartbeat_at in [
+            ("Stale", started_at),
+            ("Running", timezone.now()),
+        ]:
+            ImportJob.objects.create(
+                user=self.user,
+                course_name=course_name,
+                input_string=synthetic_org(1, 2),
+                status=ImportJob.WRITING,
+                started_at=started_at,
+                heartbeat_at=heartbeat_at,
+            )
+        output = io.StringIO()
+        call_command("runimportworker", "--once", concurrency=1, stdout=output)
+        self.assertIn("Queued 1 stale jobs again.", output.getvalue())
+        self.assertEqual(
+            dict(
+                ImportJob.objects.filter(kind=ImportJob.IMPORT).values_list(
+                    "course_name", "status"
+                )
+            ),
+            {"Stale": ImportJob.DONE, "Running": ImportJob.WRITING},
+        )
+
+    def test_running_jobs_refresh_their_heartbeat(self):
+        job = ImportJob.objects.create(
+            user=self.user,
+            course_name="Running",
+            status=ImportJob.PARSING,
+            started_at=timezone.now() - timedelta(hours=2),
+        )
+        with job_heartbeat(job, interval=0.01):
+            time.sleep(0.1)
+        job.refresh_from_db()
+        self.assertIsNotNone(job.heartbeat_at)
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=1)), 0)
+
+    def test_imports_of_other_users(self):
+        self.client.logout()
+        response = self.post_file("# Unit\n## Point\n")
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(User.objects.create_user(username="other"))
+        response = self.post_file("# Unit\n## Point\n")
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ImportJob.objects.exists())
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        self.client.force_login(User.objects.create_superuser("admin"))
+        self.assertEqual(self.post_file("# Unit\n## Point\n").status_code, 202)
+        self.assertEqual(ImportJob.objects.get().user, self.user)
+
+    def test_bad_requests(self):
+        url = reverse("syllabooster:importjob", args=[uuid.uuid4()])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        for query, user in [
+            ("?username=teacher", self.user),
+            ("?course_name=x&username=nobody", User.objects.create_superuser("admin")),
+        ]:
+            self.client.force_login(user)
+            response = self.client.post(
+                reverse("syllabooster:importorg") + query,
+                "* Unit",
+                content_type="text/org",
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(ImportJob.objects.exists())
+
+    @override_settings(IMPORT_MAX_UPLOAD_SIZE=1000)
+    def test_too_large_upload(self):
+        response = self.post_file(synthetic_md(3, 5))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()["status"], "error")
+        self.assertFalse(ImportJob.objects.exists())
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_failed_job_removes_its_spool(self):
+        response = self.post_file("# Unit\n## Point\n")
+        self.assertEqual(response.status_code, 202)
+        ImportJob.objects.update(input_format="txt")
+        job = run_import_job(claim_job())
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertEqual(job.input_path, "")
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+
+class OrgScanConformanceTests(SimpleTestCase):
+    LINES = [
+        "* Unit :a:b:",
+        "* [#B] Unit with priority",
+        "* PENDING",
+        "** TODO Point",
+        "** DONE [#A] Done point :x:",
+        "** PENDING Point with [[https://example.com][a link]] :t:",
+        "**  Spaced heading   :tag:  ",
+        "** Heading: 10:30: x",
+        "*** Child",
+        "**** Grandchild :z:",
+        "#+TODO: PENDING(p) | DELIVERED(d)",
+        "#+todo: A B",
+        "  #+SEQ_TODO: X | Y",
+        "#+FILETAGS: :ft1:ft2:",
+        "   :PROPERTIES:",
+        "   :TYPE: exercise",
+        "   :POSITION: 3",
+        "   :END:",
+        "   SCHEDULED: <2024-01-02 Tue>",
+        "DEADLINE: <2024-01-03 Wed>",
+        "   CLOCK: [2024-01-02 Tue 10:00]--[2024-01-02 Tue 11:00] =>  1:00",
+        '   - State "DONE"       from "TODO"       [2024-01-02 Tue 10:00]',
+        "Text with :PROPERTIES: inside",
+        "Time 10:30:",
+        "",
+        "   Indented **bold** text",
+        "\tTabbed text",
+        "*bold* is not a heading",
+        "*",
+        "**\tnot a heading either",
+        "# Comment",
+        "[[only a link]]",
+    ]
+
+    def assertConforms(self, input_string):
+        self.assertEqual(scan_org(input_string), scan_org_with_orgparse(input_string))
+
+    def test_synthetic_course(self):
+        self.assertConforms(synthetic_org(3, 5, rich=True))
+
+    def test_random_documents(self):
+        generator = random.Random(0)
+        for _ in range(500):
+            lines = generator.choices(self.LINES, k=generator.randint(0, 30))
+            with self.subTest(lines=lines):
+                self.assertConforms("\n".join(lines))
+
+
+class MarkdownImportTests(SimpleTestCase):
+    def test_same_course_as_org(self):
+        def without_contents(parsed):
+            for point in parsed.points:
+                point.contents = ""
+            return parsed
+
+        self.assertEqual(
+            without_contents(parse_md_course(synthetic_md(3, 5, rich=True))),
+            without_contents(parse_org_course(synthetic_org(3, 5, rich=True))),
+        )
+
+    def test_attributes_and_contents(self):
+        parsed = parse_md_course(
+            "Preamble\n"
+            "## Orphan point\n"
+            "# Unit *one*\n"
+            "POSITION: 4\n"
+            "TAGS: u\n"
+            "\n"
+            "## Exercise\n"
+            "TYPE: Exercise\n"
+            "STATE: PENDING\n"
+            "TAGS: a, b\n"
+            "\n"
+            "Note: not an attribute.\n"
+            "```\n"
+            "# Not a unit\n"
+            "```\n"
+            "### Part of the point\n",
+            unit_positions="property",
+        )
+        self.assertEqual(
+            [(unit.position, unit.title, unit.tags) for unit in parsed.units],
+            [(4, "Unit *one*", ["u"])],
+        )
+        orphan, exercise = parsed.points
+        self.assertEqual((orphan.headline, orphan.unit), ("Orphan point", None))
+        self.assertEqual(
+            (exercise.point_type, exercise.todo, exercise.tags, exercise.position),
+            ("exercise", "pending", ["a", "b", "u"], 4001),
+        )
+        self.assertEqual(
+            exercise.contents,
+            "Note: not an attribute.\n\n```\n# Not a unit\n```\n\n"
+            "### Part of the point",
+        )
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_small_benchmark(self):
+        user = User.objects.create_user(username="teacher")
+        theory = PointType.objects.create(name="theory")
+        for position, name in enumerate(["pending", "delivered"]):
+            DeliveryState.objects.create(
+                point_type=theory, position=position, name=name
+            )
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+            call_command(
+                "benchmark",
+                "--no-memory",
+                user="teacher",
+                sizes=[2],
+                points=4,
+                clicks=3,
+                output=output.name,
+                stdout=io.StringIO(),
+            )
+            results = json.load(output)
+        (size,) = results["sizes"]
+        self.assertEqual(size["units"], 2)
+        self.assertEqual(
+            set(size["steps"]),
+            {
+                "parse_org",
+                "renumber_points",
+                "export_course_org",
+                "cycle_state",
+                "UnitView",
+                "CoursePointView",
+            },
+        )
+        self.assertEqual(size["steps"]["cycle_state"]["calls"], 3)
+        self.assertFalse(Course.objects.filter(user=user).exists())
+        self.assertFalse(Point.objects.exists())
+
+
+class LoadTestCommandTests(LiveServerTestCase):
+    # The live server shares its SQLite connection between its threads, so
+    # only one client runs at a time.
+
+    def test_cycling_load(self):
+        user = User.objects.create_user(username="teacher")
+        theory = PointType.objects.create(name="theory")
+        for position, name in enumerate(["pending", "delivered"]):
+            DeliveryState.objects.create(
+                point_type=theory, position=position, name=name
+            )
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+            call_command(
+                "loadtest",
+                base_url=self.live_server_url,
+                user="teacher",
+                duration=0.5,
+                clickers=1,
+                importers=0,
+                units=2,
+                points=3,
+                output=output.name,
+                stdout=io.StringIO(),
+            )
+            results = json.load(output)
+        cyclestate = results["endpoints"]["cyclestate"]
+        self.assertGreater(cyclestate["requests"], 0)
+        self.assertEqual(cyclestate["errors"], 0)
+        self.assertFalse(Course.objects.filter(user=user).exists())
@@ -10,7 +10,17 @@ urlpatterns = [
     path("unauthorised/", views.unauthorised, name="unauthorised"),
     path("courselist/", views.CourseListView.as_view(), name="courselist"),
     path("unitlist/<course>/", views.UnitListView.as_view(), name="unitlist"),
+    path(
+        "unitlist/<course>/units/",
+        views.UnitListFragmentView.as_view(),
+        name="unitlistfragment",
+    ),
     path("unit/<course>/<unit>/", views.UnitView.as_view(), name="unit"),
+    path(
+        "unit/<course>/<unit>/points/",
+        views.UnitFragmentView.as_view(),
+        name="unitfragment",
+    ),
     path("currentunit/<course>/", views.currentView, name="currentunit"),
     path(
         "coursepointdetail/<int:pk>/",
@@ -18,10 +28,16 @@ urlpatterns = [
         name="coursepointdetail",
     ),
     path("cyclestate/", views.cycle_state, name="cyclestate"),
+    path("api/syncstates/", views.sync_states, name="syncstates"),
+    path("api/changes/<int:course>/", views.course_changes, name="coursechanges"),
+    path("api/search/", views.search_points, name="search"),
     path(
         "api/importorg/",
         views.api_import_org,
         name="importorg",
     ),
+    path("api/importjob/<uuid:token>/", views.api_import_job, name="importjob"),
     path("api/exportcourse/", views.api_export_org, name="exportcourse"),
+    path("api/snapshot/", views.api_export_snapshot, name="snapshot"),
+    path("metrics/", views.metrics, name="metrics"),
 ]
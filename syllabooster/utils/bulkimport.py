@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+#
+# Set-based import engine shared by the import API and the import commands.
+#
+# Importing happens in two steps:
+#
+# 1. The input is parsed into plain records (ParsedUnit and ParsedPoint)
+#    without touching the database (see utils/parsing.py).
+# 2. write_course() resolves tags, point types and states from in-memory
+#    maps and writes everything with bulk queries inside one transaction, so
+#    the number of queries doesn't depend on the size of the course.
+#
+# Units and course points store a hash of the contents they were imported
+# from, so re-importing a course only writes the rows whose hash changed.
+#
+# With PRERENDER_AFTER_IMPORT, the HTML of new and changed points is rendered
+# by the import worker after the import (see utils/prerender.py).
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from syllabooster.models import *
+from syllabooster.utils.changelog import (
+    COURSEPOINT,
+    POINT,
+    UNIT,
+    record_changes,
+    record_course_changes,
+)
+from syllabooster.utils.parsing import (
+    COURSE_PARSERS,
+    ImportFormatError,
+    ParsedCourse,
+    ParsedPoint,
+    ParsedUnit,
+    content_hash,
+    course_input_files,
+    iter_course_units,
+    iter_md_units,
+    iter_org_units,
+    merge_parsed_courses,
+    parse_course_file,
+    parse_md_course,
+    parse_org_course,
+)
+from syllabooster.utils.prerender import prerender_course
+
+_parse_executor = None
+
+
+def parse_executor():
+    """Process pool for CPU-bound parsing, created on first use."""
+    global _parse_executor
+    if _parse_executor is None:
+        _parse_executor = ProcessPoolExecutor(max_workers=settings.IMPORT_PARSE_WORKERS)
+    return _parse_executor
+
+
+def parse_course_files(
+    paths, input_format="org", unit_positions="sequential", numbering="unit", jobs=None
+):
+    """Parse several org or Markdown files, one per process (up to 'jobs',
+    by default one per CPU), and merge them in the given order into one
+    ParsedCourse."""
+    paths = [str(path) for path in paths]
+    if len(paths) == 1:
+        parsed_courses = [
+            parse_course_file(paths[0], input_format, unit_positions, numbering)
+        ]
+    else:
+        max_workers = min(jobs or os.cpu_count() or 1, len(paths))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            parsed_courses = list(
+                executor.map(
+                    parse_course_file,
+                    paths,
+                    repeat(input_format),
+                    repeat(unit_positions),
+                    repeat(numbering),
+                )
+            )
+    return merge_parsed_courses(parsed_courses, unit_positions, numbering)
+
+
+CHANGE_KINDS = ("created", "updated", "deleted", "unchanged")
+
+
+def describe_changes(changes):
+    """One line summing up the "changes" of a write_course() result."""
+    return "; ".join(
+        f"{model}: "
+        + ", ".join(f"{counts[kind]} {kind}" for kind in CHANGE_KINDS if counts[kind])
+        for model, counts in changes.items()
+        if any(counts.values())
+    )
+
+
+@transaction.atomic
+def write_course(course, parsed, include_orphans=False, prune=False, delete_stale=True):
+    """Write the parsed units and points into 'course', changing only the
+    rows that differ from what is stored.
+
+    Units are matched by position and course points by headline, and are
+    compared through the hash of their imported contents (see
+    parsing.content_hash). Course points of the imported units that are
+    missing from the input are deleted. With 'prune', every unit and course
+    point of the course missing from the input is deleted, so that the
+    course ends up matching the input. The state of a course point is only
+    taken from the input if its hash changed, so states set in the app
+    survive re-imports of the same file.
+    Points that don't belong to any unit are skipped unless 'include_orphans'.
+    Nothing is deleted unless 'delete_stale' (see write_course_units).
+
+    Returns the number of imported units and points and, in "changes", how
+    many rows of each model were created, updated, deleted or left unchanged.
+    """
+    point_types = {
+        point_type.name: point_type for point_type in PointType.objects.all()
+    }
+    states = {
+        (state.point_type_id, state.name): state
+        for state in DeliveryState.objects.all()
+    }
+    changes = {
+        model: dict.fromkeys(CHANGE_KINDS, 0)
+        for model in ("units", "points", "coursepoints")
+    }
+
+    parsed_points = {}
+    point_tags = {}
+    for parsed_point in parsed.points:
+        if parsed_point.unit is None and not include_orphans:
+            continue
+        # A repeated headline refers to the same point: the last one wins.
+        parsed_points[parsed_point.headline] = parsed_point
+        point_tags.setdefault(parsed_point.headline, set()).update(parsed_point.tags)
+
+    unknown_types = {
+        parsed_point.point_type for parsed_point in parsed_points.values()
+    } - point_types.keys()
+    if unknown_types:
+        raise ImportFormatError(
+            f"Unknown point type(s): {', '.join(sorted(unknown_types))}"
+        )
+
+    # Units
+    existing_units = Unit.objects.filter(course=course)
+    if not (prune and delete_stale):
+        existing_units = existing_units.filter(
+            position__in=[unit.position for unit in parsed.units]
+        )
+    stale_units = {unit.position: unit for unit in existing_units}
+    units = {}
+    new_units = []
+    changed_units = []
+    for parsed_unit in parsed.units:
+        unit_hash = parsed_unit.content_hash()
+        unit = stale_units.pop(parsed_unit.position, None)
+        if unit is None:
+            unit = Unit(course=course, position=parsed_unit.position)
+            new_units.append(unit)
+        elif unit.content_hash != unit_hash:
+            changed_units.append(unit)
+        else:
+            changes["units"]["unchanged"] += 1
+        unit.title = parsed_unit.title
+        unit.content_hash = unit_hash
+        units[unit.position] = unit
+    Unit.objects.bulk_update(changed_units, ["title", "content_hash"])
+    Unit.objects.bulk_create(new_units)
+    changes["units"]["created"] = len(new_units)
+    changes["units"]["updated"] = len(changed_units)
+
+    # Points, only for the course points whose hash changed
+    coursepoints = {}
+    for coursepoint in CoursePoint.objects.filter(
+        course=course, point__headline__in=parsed_points.keys()
+    ).annotate(headline=F("point__headline")):
+        coursepoints.setdefault(coursepoint.headline, coursepoint)
+    point_hashes = {
+        headline: content_hash(
+            headline,
+            parsed_point.contents,
+            ":".join(sorted(point_tags[headline])),
+            parsed_point.point_type,
+            parsed_point.todo,
+        )
+        for headline, parsed_point in parsed_points.items()
+    }
+    dirty = [
+        headline
+        for headline in parsed_points
+        if headline not in coursepoints
+        or coursepoints[headline].content_hash != point_hashes[headline]
+    ]
+    linked_ids = [
+        coursepoints[headline].point_id
+        for headline in dirty
+        if headline in coursepoints
+    ]
+    unlinked = [headline for headline in dirty if headline not in coursepoints]
+    points_by_id = {}
+    points_by_headline = {}
+    for point in (
+        Point.objects.filter(Q(pk__in=linked_ids) | Q(headline__in=unlinked))
+        .only("id", "headline", "contents", "point_type")
+        .order_by("-id")
+    ):
+        points_by_id[point.pk] = point
+        points_by_headline[point.headline] = point
+    points = {}
+    new_points = []
+    changed_points = []
+    for headline in dirty:
+        parsed_point = parsed_points[headline]
+        point_type = point_types[parsed_point.point_type]
+        if headline in coursepoints:
+            point = points_by_id[coursepoints[headline].point_id]
+        else:
+            point = points_by_headline.get(headline)
+        if point is None:
+            point = Point(headline=headline)
+            new_points.append(point)
+        elif (
+            point.contents != parsed_point.contents
+            or point.point_type_id != point_type.pk
+        ):
+            changed_points.append(point)
+        else:
+            changes["points"]["unchanged"] += 1
+        point.contents = parsed_point.contents
+        point.point_type = point_type
+        points[headline] = point
+    Point.objects.bulk_update(changed_points, ["contents", "point_type"])
+    Point.objects.bulk_create(new_points)
+    changes["points"]["created"] = len(new_points)
+    changes["points"]["updated"] = len(changed_points)
+    changes["points"]["unchanged"] += len(parsed_points) - len(dirty)
+
+    # Tags, only added to the points whose hash changed
+    tag_names = set().union(*(point_tags[headline] for headline in dirty))
+    tags = {}
+    for tag in Tag.objects.filter(name__in=tag_names).order_by("-id"):
+        tags[tag.name] = tag
+    new_tags = [Tag(name=name) for name in tag_names if name not in tags]
+    for tag in Tag.objects.bulk_create(new_tags):
+        tags[tag.name] = tag
+    point_tag_pairs = set(
+        Point.tags.through.objects.filter(
+            point_id__in=[points[headline].pk for headline in dirty]
+        ).values_list("point_id", "tag_id")
+    )
+    Point.tags.through.objects.bulk_create(
+        [
+            Point.tags.through(point_id=point_id, tag_id=tag_id)
+            for point_id, tag_id in {
+                (points[headline].pk, tags[name].pk)
+                for headline in dirty
+                for name in point_tags[headline]
+            }
+            - point_tag_pairs
+        ]
+    )
+
+    # Course points
+    new_coursepoints = []
+    changed_coursepoints = []
+    # Course points with the same imported contents, only renumbered.
+    moved_coursepoints = []
+    kept = set()
+    relative_positions = {}
+    fields = [
+        "position",
+        "state_id",
+        "unit_id",
+        "relative_position",
+        "type_relative_position",
+        "content_hash",
+    ]
+    for headline, parsed_point in sorted(
+        parsed_points.items(), key=lambda item: item[1].position
+    ):
+        point_type_id = point_types[parsed_point.point_type].pk
+        unit_key = parsed_point.unit
+        type_key = (parsed_point.unit, point_type_id)
+        relative_positions[unit_key] = relative_positions.get(unit_key, 0) + 1
+        relative_positions[type_key] = relative_positions.get(type_key, 0) + 1
+        state = states.get((point_type_id, parsed_point.todo))
+        unit = units.get(parsed_point.unit)
+        values = {
+            "position": parsed_point.position,
+            "state_id": state.pk if state else None,
+            "unit_id": unit.pk if unit else None,
+            "relative_position": relative_positions[unit_key],
+            "type_relative_position": relative_positions[type_key],
+            "content_hash": point_hashes[headline],
+        }
+        coursepoint = coursepoints.get(headline)
+        if coursepoint is None:
+            new_coursepoints.append(
+                CoursePoint(course=course, point=points[headline], **values)
+            )
+            continue
+        kept.add(coursepoint.pk)
+        if coursepoint.content_hash == values["content_hash"]:
+            # The state in the input is the one imported last time: keep the
+            # state set in the app since.
+            del values["state_id"]
+        if all(getattr(coursepoint, name) == value for name, value in values.items()):
+            changes["coursepoints"]["unchanged"] += 1
+            continue
+        for name, value in values.items():
+            setattr(coursepoint, name, value)
+        if "state_id" in values:
+            changed_coursepoints.append(coursepoint)
+        else:
+            moved_coursepoints.append(coursepoint)
+    stale_coursepoint_ids = []
+    if delete_stale:
+        stale_coursepoints = CoursePoint.objects.filter(course=course).exclude(
+            pk__in=kept
+        )
+        if not prune:
+            stale_coursepoints = stale_coursepoints.filter(
+                unit__in=[unit.pk for unit in units.values()]
+            )
+        stale_coursepoint_ids = list(stale_coursepoints.values_list("pk", flat=True))
+        if stale_coursepoint_ids:
+            stale_coursepoints.delete()
+        changes["coursepoints"]["deleted"] = len(stale_coursepoint_ids)
+    CoursePoint.objects.bulk_update(changed_coursepoints, fields)
+    CoursePoint.objects.bulk_update(
+        moved_coursepoints, [name for name in fields if name != "state_id"]
+    )
+    changed_coursepoints += moved_coursepoints
+    CoursePoint.objects.bulk_create(new_coursepoints)
+    changes["coursepoints"]["created"] = len(new_coursepoints)
+    changes["coursepoints"]["updated"] = len(changed_coursepoints)
+
+    # Units missing from the input, once their course points have moved out
+    if stale_units:
+        Unit.objects.filter(pk__in=[unit.pk for unit in stale_units.values()]).delete()
+        changes["units"]["deleted"] = len(stale_units)
+
+    if any(
+        counts[kind]
+        for counts in changes.values()
+        for kind in ("created", "updated", "deleted")
+    ):
+        # Points of new course points are logged even if they didn't
+        # change, since the clients of this course may not have them.
+        # Changed points are shared: they are logged in the other courses
+        # that have them too.
+        changes_by_course = {
+            course.pk: [(UNIT, unit.pk, False) for unit in new_units + changed_units]
+            + [(UNIT, unit.pk, True) for unit in stale_units.values()]
+            + [(POINT, point.pk, False) for point in points.values()]
+            + [
+                (COURSEPOINT, coursepoint.pk, False)
+                for coursepoint in new_coursepoints + changed_coursepoints
+            ]
+            + [(COURSEPOINT, pk, True) for pk in stale_coursepoint_ids]
+        }
+        if changed_points:
+            for course_id, point_id in (
+                CoursePoint.objects.filter(point__in=changed_points)
+                .exclude(course=course)
+                .values_list("course_id", "point_id")
+            ):
+                changes_by_course.setdefault(course_id, []).append(
+                    (POINT, point_id, False)
+                )
+        record_course_changes(changes_by_course)
+    # write_course_units() prerenders once all its chunks are written.
+    if delete_stale and (changes["points"]["created"] or changes["points"]["updated"]):
+        prerender_course(course)
+
+    return {
+        "status": "ok",
+        "units": len(parsed.units),
+        "points": len(parsed_points),
+        "changes": changes,
+    }
+
+
+def write_course_units(
+    course, chunks, include_orphans=False, prune=False, progress=None
+):
+    """Write a course parsed one unit at a time (see parsing.iter_org_units),
+    so that only one unit is in memory at any time.
+
+    Each chunk is written by write_course() in its own transaction, and
+    'progress' (if given) is called with the result so far after each one.
+    The rows missing from the input are only deleted once every chunk has
+    been written, so an import that fails half-way doesn't delete anything:
+    running it again finishes it, writing only what is still missing.
+    """
+    result = {
+        "status": "ok",
+        "units": 0,
+        "points": 0,
+        "changes": {
+            model: dict.fromkeys(CHANGE_KINDS, 0)
+            for model in ("units", "points", "coursepoints")
+        },
+    }
+    positions = set()
+    headlines = set()
+    for chunk in chunks:
+        chunk_result = write_course(
+            course, chunk, include_orphans=include_orphans, delete_stale=False
+        )
+        result["units"] += chunk_result["units"]
+        result["points"] += chunk_result["points"]
+        for model, counts in chunk_result["changes"].items():
+            for kind, count in counts.items():
+                result["changes"][model][kind] += count
+        positions.update(unit.position for unit in chunk.units)
+        headlines.update(
+            point.headline
+            for point in chunk.points
+            if include_orphans or point.unit is not None
+        )
+        if progress is not None:
+            progress(result)
+
+    with transaction.atomic():
+        stale_coursepoints = CoursePoint.objects.filter(course=course).exclude(
+            point__headline__in=headlines
+        )
+        # Course points were deleted first, so deleting the units only
+        # deletes the units.
+        stale_units = Unit.objects.none()
+        if prune:
+            stale_units = Unit.objects.filter(course=course).exclude(
+                position__in=positions
+            )
+        else:
+            stale_coursepoints = stale_coursepoints.filter(unit__position__in=positions)
+        stale_coursepoint_ids = list(stale_coursepoints.values_list("pk", flat=True))
+        stale_unit_ids = list(stale_units.values_list("pk", flat=True))
+        stale_coursepoints.delete()
+        stale_units.delete()
+        result["changes"]["coursepoints"]["deleted"] += len(stale_coursepoint_ids)
+        result["changes"]["units"]["deleted"] += len(stale_unit_ids)
+        if stale_coursepoint_ids or stale_unit_ids:
+            record_changes(
+                course.pk,
+                [(COURSEPOINT, pk, True) for pk in stale_coursepoint_ids]
+                + [(UNIT, pk, True) for pk in stale_unit_ids],
+            )
+    if result["changes"]["points"]["created"] or result["changes"]["points"]["updated"]:
+        prerender_course(course)
+    return result
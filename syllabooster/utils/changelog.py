@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# Append-only log of the changes to courses, for delta sync.
+#
+# Every write to the units, course points (including their state) or points
+# of a course goes through record_changes(), which bumps the version of the
+# course and logs one CourseChange per changed row under the new version.
+# Entries only name the rows: changes_since() reads the current values of the
+# rows when they are asked for, so a client catching up receives each
+# changed row once per page, in time proportional to the number of changes.
+#
+# Bumping the version locks the course row until the transaction commits, so
+# the versions of a course are committed in order and a client that has read
+# every entry up to a version will never see a new entry below it.
+
+from django.db import transaction
+from django.db.models import Q
+from syllabooster.models import *
+
+UNIT = CourseChange.UNIT
+COURSEPOINT = CourseChange.COURSEPOINT
+POINT = CourseChange.POINT
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+
+
+def record_changes(course_id, changes):
+    """Bump the version of a course and log 'changes', (kind, object id,
+    deleted) triples, under it. Returns the new version."""
+    with transaction.atomic():
+        Course.bump_versions(pk=course_id)
+        version = Course.objects.values_list("version", flat=True).get(pk=course_id)
+        CourseChange.objects.bulk_create(
+            CourseChange(
+                course_id=course_id,
+                sequence=version,
+                kind=kind,
+                object_id=object_id,
+                deleted=deleted,
+            )
+            for kind, object_id, deleted in changes
+        )
+    return version
+
+
+def record_course_changes(changes_by_course):
+    """record_changes() for several courses, in a fixed order so that
+    concurrent writers don't deadlock on their rows."""
+    with transaction.atomic():
+        for course_id in sorted(changes_by_course):
+            record_changes(course_id, changes_by_course[course_id])
+
+
+def encode_cursor(change):
+    return f"{change.sequence}.{change.pk}"
+
+
+def decode_cursor(cursor):
+    sequence, _, pk = cursor.partition(".")
+    return int(sequence), int(pk)
+
+
+def unit_data(unit):
+    return {"position": unit.position, "title": unit.title}
+
+
+def coursepoint_data(coursepoint):
+    return {
+        "pointId": coursepoint.point_id,
+        "unitId": coursepoint.unit_id,
+        "stateId": coursepoint.state_id,
+        "position": coursepoint.position,
+        "relativePosition": coursepoint.relative_position,
+        "typeRelativePosition": coursepoint.type_relative_position,
+    }
+
+
+def point_data(point):
+    return {
+        "headline": point.headline,
+        "contents": point.contents,
+        "pointType": point.point_type.name if point.point_type else None,
+        "tags": sorted(tag.name for tag in point.tags.all()),
+    }
+
+
+def current_rows(kind, ids):
+    """The rows of 'kind' with the given ids that still exist, by id."""
+    if kind == UNIT:
+        rows = Unit.objects.filter(pk__in=ids)
+    elif kind == COURSEPOINT:
+        rows = CoursePoint.objects.filter(pk__in=ids)
+    else:
+        rows = (
+            Point.objects.filter(pk__in=ids)
+            .select_related("point_type")
+            .prefetch_related("tags")
+            .defer("html", "html_key", "search_vector")
+        )
+    return {row.pk: row for row in rows}
+
+
+SERIALIZERS = {UNIT: unit_data, COURSEPOINT: coursepoint_data, POINT: point_data}
+
+
+def changes_since(course, since=0, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """A page of the changes of 'course' after version 'since', or after
+    'cursor' (returned by the previous page), up to the version the course
+    had when the page was read.
+
+    Each change holds the current values of its row ("data"), or None if the
+    row was deleted since. When "nextCursor" is None the client is up to
+    date with "version", and should ask for the changes since it next time.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # Read first: entries logged after this are left for the next sync.
+    version = Course.objects.values_list("version", flat=True).get(pk=course.pk)
+    entries = CourseChange.objects.filter(course=course, sequence__lte=version)
+    if cursor:
+        sequence, pk = decode_cursor(cursor)
+        entries = entries.filter(
+            Q(sequence__gt=sequence) | Q(sequence=sequence, pk__gt=pk)
+        )
+    else:
+        entries = entries.filter(sequence__gt=since)
+    entries = list(entries.order_by("sequence", "pk")[: limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    rows = {
+        kind: current_rows(
+            kind,
+            {entry.object_id for entry in entries if entry.kind == kind},
+        )
+        for kind in SERIALIZERS
+        if any(entry.kind == kind for entry in entries)
+    }
+    changes = []
+    for entry in entries:
+        row = None if entry.deleted else rows[entry.kind].get(entry.object_id)
+        changes.append(
+            {
+                "sequence": entry.sequence,
+                "kind": entry.kind,
+                "id": entry.object_id,
+                "deleted": entry.deleted,
+                "data": SERIALIZERS[entry.kind](row) if row is not None else None,
+            }
+        )
+    return {
+        "version": version,
+        "changes": changes,
+        "nextCursor": encode_cursor(entries[-1]) if has_more else None,
+    }
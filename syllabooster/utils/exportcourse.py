@@ -1,28 +1,120 @@
 #!/usr/bin/env python
 
+from django.db.models import Prefetch
+
 from syllabooster.models import *
 
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_QUERY_CHUNK_SIZE = 2000
+
+
+def org_header(course):
+    return f"#+title: {course.name}\n#+TODO: PENDING(p) | DELIVERED(d)\n#+TODO: UNASSIGNED(u) ASSIGNED(a) | REVIEWED(r)\n"
+
+
+def org_unit(unit):
+    return f"* {unit.title}\n  :PROPERTIES:\n  :POSITION: {unit.position}\n  :END:\n"
+
+
+def org_point(coursepoint):
+    point = coursepoint.point
+    point_tags = ""
+    tags = point.tags.all()
+    if tags:
+        point_tags = " :" + "".join(f"{tag.name}:" for tag in tags)
+    lines = [
+        f"** {coursepoint.state.display_name} {point.headline} {point_tags}\n   :PROPERTIES:\n   :TYPE: {point.point_type}\n   :POSITION: {coursepoint.position}\n   :END:\n"
+    ]
+    lines.extend(f"   {line}\n" for line in point.contents.splitlines())
+    return "".join(lines)
+
+
+def course_points_for_export(course):
+    """Course points of the units of 'course' in export order, with
+    everything needed to write them."""
+    return (
+        CoursePoint.objects.filter(course=course, unit__isnull=False)
+        .select_related("point__point_type", "state", "unit")
+        .defer("point__html", "point__search_vector")
+        .prefetch_related(Prefetch("point__tags", queryset=Tag.objects.only("name")))
+        .order_by("unit__position", "position")
+    )
+
+
+class OrgExport:
+    """Org text of a course, handed out in chunks of about 'chunk_size'
+    characters as course points are added in export order."""
+
+    def __init__(self, course, units, chunk_size):
+        self.chunk_size = chunk_size
+        self.units = iter(units)
+        self.next_unit = next(self.units, None)
+        self.buffer = [org_header(course)]
+        self.buffered = len(self.buffer[0])
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+
+    def flush(self):
+        chunk = "".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        return chunk
+
+    def add_point(self, coursepoint):
+        """Add a course point, returning a chunk if the buffer is full."""
+        # Units without points are written before the next point's unit.
+        while (
+            self.next_unit is not None
+            and self.next_unit.position <= coursepoint.unit.position
+        ):
+            self.write(org_unit(self.next_unit))
+            self.next_unit = next(self.units, None)
+        self.write(org_point(coursepoint))
+        if self.buffered >= self.chunk_size:
+            return self.flush()
+        return None
+
+    def finish(self):
+        """The remaining text, including the units after the last point."""
+        while self.next_unit is not None:
+            self.write(org_unit(self.next_unit))
+            self.next_unit = next(self.units, None)
+        return self.flush()
 
-def export_course_org(course):
 
-    output = f"#+title: {course.name}\n#+TODO: PENDING(p) | DELIVERED(d)\n#+TODO: UNASSIGNED(u) ASSIGNED(a) | REVIEWED(r)\n"
+def export_course_org(course, chunk_size=EXPORT_CHUNK_SIZE):
+    """Generate the org text of 'course' in chunks of about 'chunk_size'
+    characters.
 
-    units = Unit.objects.filter(course=course)
+    Units and points are read with a fixed number of queries per
+    EXPORT_QUERY_CHUNK_SIZE points, so memory use doesn't grow with the
+    size of the course."""
+    export = OrgExport(
+        course, Unit.objects.filter(course=course).order_by("position"), chunk_size
+    )
+    coursepoints = course_points_for_export(course).iterator(
+        chunk_size=EXPORT_QUERY_CHUNK_SIZE
+    )
+    for coursepoint in coursepoints:
+        chunk = export.add_point(coursepoint)
+        if chunk:
+            yield chunk
+    yield export.finish()
 
-    for unit in units:
-        output += (
-            f"* {unit.title}\n  :PROPERTIES:\n  :POSITION: {unit.position}\n  :END:\n"
-        )
-        points = CoursePoint.objects.filter(course=course, unit=unit)
-        for point in points:
-            point_tags = ""
-            if point.point.tags.exists() > 0:
-                point_tags = " :"
-            for tag in point.point.tags.all():
-                point_tags += f"{tag.name}:"
-            content_lines = point.point.contents.splitlines()
-            output += f"** {point.state.display_name} {point.point.headline} {point_tags}\n   :PROPERTIES:\n   :TYPE: {point.point.point_type}\n   :POSITION: {point.position}\n   :END:\n"
-            for line in content_lines:
-                output += f"   {line}\n"
 
-    return output
+async def aexport_course_org(course, chunk_size=EXPORT_CHUNK_SIZE):
+    """Asynchronous version of export_course_org()."""
+    units = [
+        unit async for unit in Unit.objects.filter(course=course).order_by("position")
+    ]
+    export = OrgExport(course, units, chunk_size)
+    coursepoints = course_points_for_export(course).aiterator(
+        chunk_size=EXPORT_QUERY_CHUNK_SIZE
+    )
+    async for coursepoint in coursepoints:
+        chunk = export.add_point(coursepoint)
+        if chunk:
+            yield chunk
+    yield export.finish()
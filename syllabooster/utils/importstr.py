@@ -4,10 +4,17 @@ from io import StringIO
 from collections import defaultdict
 
 from django.http import JsonResponse
-import orgparse
 
 from django.db.models import F
 from syllabooster.models import *
+from syllabooster.utils.bulkimport import (
+    ImportFormatError,
+    describe_changes,
+    parse_md_course,
+    parse_org_course,
+    write_course,
+)
+from syllabooster.utils.renumber import renumber_points
 
 
 class SyllaboostStyler:
@@ -18,109 +25,40 @@ class SyllaboostStyler:
         return message
 
 
-def renumber_points(course):
-    units = Unit.objects.filter(course=course).order_by("position")
-    point_number = 1
-    for unit in units:
-        points = CoursePoint.objects.filter(unit=unit).order_by("position")
-        for point in points:
-            point.position = point_number
-            point.save()
-            point_number = point_number + 1
-
-
 def should_be_imported(unit, unitnumbers):
     if len(unitnumbers) > 0:
         return unit in unitnumbers
     return True
 
 
-def is_unit(node):
-    return node.level and node.level == 1
-
-
-def is_point(node):
-    return node.level and node.level == 2
-
-
 def parse_org(
     course,
     input_string,
     user,
     output=sys.stdout,
     styler=SyllaboostStyler(),
+    parser=parse_org_course,
 ):
-    root = orgparse.loads(input_string)
-    current_unit = 0
-    current_point_position_in_unit = defaultdict(int)
-    unit_tags = {}
-    unit = None
     # Both units and points are imported in the order in which they are found in the org file.
-    # We expect the nodes in root[1:] to be stored in the order in which they were found in the file.
-    # TODO: check the above expectation is fulfilled by orgparse.
-    for node in root[1:]:
-        if is_unit(node):
-            current_unit += 1
-            node.unit = current_unit
-            if Unit.objects.filter(course=course, position=current_unit).exists():
-                Unit.objects.filter(course=course, position=current_unit).delete()
-            unit = Unit.objects.create(
-                course=course,
-                position=current_unit,
-                title=node.heading,
-            )
-            unit_tags[current_unit] = []
-            for tag in node.tags:
-                unit_tags[current_unit].append(tag)
-        elif is_point(node):
-            point_type = node.get_property("TYPE") or "Theory"
-            output.write(f'Importing point "{node.heading}" of type {point_type}')
-            point, created = Point.objects.get_or_create(headline=node.heading)
-            point.contents = node.body
-            point.save()
-            for tag in node.tags:
-                db_tag, created = Tag.objects.get_or_create(name=tag)
-                point.tags.add(db_tag)
-            point.point_type = PointType.objects.get(name=point_type.lower())
-            point.save()
-
-            state = None
-            todo = node.todo.lower()
-            if todo:
-                try:
-                    state = DeliveryState.objects.filter(
-                        point_type_id=point.point_type.id
-                    ).get(name=todo)
-                except DeliveryState.DoesNotExist:
-                    state = None
-                    unit = None
-            if not (node.parent is root):
-                unit_position = node.parent.unit
-                current_point_position_in_unit[unit_position] += 1
-                point_position = (
-                    current_point_position_in_unit[unit_position] + 1000 * unit_position
-                )
-                unit = Unit.objects.get(course=course, position=unit_position)
-                for tag in unit_tags[unit_position]:
-                    db_tag, created = Tag.objects.get_or_create(name=tag)
-                    point.tags.add(db_tag)
-                    point.save()
-                if CoursePoint.objects.filter(course=course, point=point).exists():
-                    CoursePoint.objects.filter(course=course, point=point).delete()
-                coursepoint = CoursePoint(
-                    course=course,
-                    point=point,
-                    position=point_position,
-                    state=state,
-                    unit=unit,
-                )
-                coursepoint.save()
-
-    return {"status": "ok"}
+    try:
+        parsed = parser(input_string)
+        result = write_course(course, parsed)
+    except ImportFormatError as e:
+        return {"status": "error", "message": styler.ERROR(str(e))}
+    output.write(f'Imported {result["points"]} points in {result["units"]} units\n')
+    output.write(describe_changes(result["changes"]) + "\n")
+    return result
 
 
-def parse_md(input_string):
-    return {"status": "error", "message": "Not implemented"}
+def parse_md(
+    course,
+    input_string,
+    user,
+    output=sys.stdout,
+    styler=SyllaboostStyler(),
+):
+    # Markdown courses have the same structure as org ones (see utils/mdscan.py).
+    return parse_org(course, input_string, user, output, styler, parser=parse_md_course)
 
 
 def import_course(
@@ -140,6 +78,6 @@ def import_course(
 
     course, created = Course.objects.get_or_create(name=course_name, user=user)
     if input_format == "md":
-        return parse_md(input_string)
+        return parse_md(course, input_string, user, output, styler)
     elif input_format == "org":
         return parse_org(course, input_string, user, output, styler)
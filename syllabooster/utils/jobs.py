@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# Database-backed queue of course imports.
+#
+# The API queues ImportJob rows and the runimportworker command claims and
+# runs them. Large inputs are spooled to a file in IMPORT_SPOOL_DIR and
+# imported one unit at a time. Claiming uses SELECT ... FOR UPDATE SKIP LOCKED, so several
+# workers can share the queue without an external broker.
+#
+# A running job holds a lease: its worker refreshes heartbeat_at every
+# HEARTBEAT_INTERVAL seconds, and only the jobs whose heartbeat is older
+# than the lease (e.g. because their worker died) are queued again.
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from syllabooster.models import *
+from syllabooster.utils.bulkimport import (
+    COURSE_PARSERS,
+    ImportFormatError,
+    iter_course_units,
+    parse_executor,
+    write_course,
+    write_course_units,
+)
+from syllabooster.utils.prerender import run_prerender_job
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 30
+DEFAULT_STALE_AFTER = timedelta(minutes=5)
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+
+def spool_path(token, input_format="org"):
+    return os.path.join(settings.IMPORT_SPOOL_DIR, f"{token}.{input_format}")
+
+
+class InputTooLarge(Exception):
+    pass
+
+
+def spool_input(stream, path, max_size=None):
+    """Copy a file-like object (e.g. a request) to 'path' a chunk at a time.
+
+    Raises InputTooLarge, leaving no file behind, once more than 'max_size'
+    bytes (settings.IMPORT_MAX_UPLOAD_SIZE by default) have been read."""
+    if max_size is None:
+        max_size = settings.IMPORT_MAX_UPLOAD_SIZE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = 0
+    try:
+        with open(path, "wb") as spool:
+            while chunk := stream.read(SPOOL_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise InputTooLarge(
+                        f"The course is larger than the limit of {max_size} bytes"
+                    )
+                spool.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+POINT_PREFIXES = {"org": "** ", "md": "## "}
+
+
+def count_points(path, input_format="org"):
+    """Rough number of level 2 headings in an org or Markdown file, read
+    line by line (only used to report progress)."""
+    prefix = POINT_PREFIXES[input_format]
+    with open(path, "r") as coursefile:
+        return sum(1 for line in coursefile if line.startswith(prefix))
+
+
+def claim_job():
+    """Mark the oldest pending job as started and return it, or None."""
+    with transaction.atomic():
+        job = (
+            ImportJob.objects.select_for_update(skip_locked=True)
+            .filter(status=ImportJob.PENDING)
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = ImportJob.PARSING
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(update_fields=["status", "started_at", "heartbeat_at"])
+    return job
+
+
+@contextmanager
+def job_heartbeat(job, interval=HEARTBEAT_INTERVAL):
+    """Refresh the heartbeat of 'job' every 'interval' seconds, from a
+    thread with its own connection, while the block runs."""
+    stopping = threading.Event()
+
+    def beat():
+        try:
+            while not stopping.wait(interval):
+                ImportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopping.set()
+        thread.join()
+
+
+def requeue_stale_jobs(older_than):
+    """Put back in the queue the unfinished jobs whose heartbeat is more
+    than 'older_than' old, i.e. whose worker stopped running them. Jobs
+    without a heartbeat fall back on their start time."""
+    cutoff = timezone.now() - older_than
+    return (
+        ImportJob.objects.filter(status__in=[ImportJob.PARSING, ImportJob.WRITING])
+        .filter(
+            Q(heartbeat_at__lt=cutoff)
+            | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+        )
+        .update(status=ImportJob.PENDING, started_at=None, heartbeat_at=None)
+    )
+
+
+def finish_job(job, status, message="", result=None):
+    job.status = status
+    job.message = message
+    job.result = result
+    job.finished_at = timezone.now()
+    update_fields = ["status", "message", "result", "finished_at", "progress", "total"]
+    if status == ImportJob.DONE:
+        job.progress = job.total
+        # The input isn't needed anymore and can be large.
+        job.input_string = ""
+        update_fields.append("input_string")
+    if job.input_path:
+        # Failed jobs aren't retried either: don't leave their spool behind.
+        try:
+            os.remove(job.input_path)
+        except FileNotFoundError:
+            pass
+        job.input_path = ""
+        update_fields.append("input_path")
+    job.save(update_fields=update_fields)
+
+
+def run_import_job(job):
+    """Parse and write the course of a claimed job, recording its progress,
+    or render its HTML for a PRERENDER job."""
+    with job_heartbeat(job):
+        try:
+            if job.kind == ImportJob.PRERENDER:
+                result = run_prerender_job(job)
+                job.total = result["points"]
+            elif job.input_format not in COURSE_PARSERS:
+                raise ImportFormatError(f"Unsupported format: {job.input_format}")
+            elif job.input_path:
+                result = write_spooled_job(job)
+            else:
+                parser = COURSE_PARSERS[job.input_format]
+                parsed = parse_executor().submit(parser, job.input_string)
+                parsed = parsed.result()
+                job.status = ImportJob.WRITING
+                job.total = len(parsed.points)
+                job.save(update_fields=["status", "total"])
+                course, created = Course.objects.get_or_create(
+                    name=job.course_name, user_id=job.user_id
+                )
+                result = write_course(course, parsed)
+        except ImportFormatError as e:
+            finish_job(job, ImportJob.FAILED, str(e))
+        except Exception as e:
+            logger.exception("Import job %s failed", job.pk)
+            finish_job(job, ImportJob.FAILED, str(e))
+        else:
+            finish_job(job, ImportJob.DONE, result=result)
+    return job
+
+
+def write_spooled_job(job):
+    """Import the spooled file of a job one unit at a time, so that only
+    one unit is ever in memory."""
+    job.status = ImportJob.WRITING
+    job.total = count_points(job.input_path, job.input_format)
+    job.save(update_fields=["status", "total"])
+    course, created = Course.objects.get_or_create(
+        name=job.course_name, user_id=job.user_id
+    )
+
+    def progress(result):
+        job.progress = result["points"]
+        job.save(update_fields=["progress"])
+
+    with open(job.input_path, "r") as coursefile:
+        result = write_course_units(
+            course, iter_course_units(coursefile, job.input_format), progress=progress
+        )
+    job.total = result["points"]
+    return result
+
+
+def job_status(job):
+    return {
+        "status": "ok",
+        "jobId": str(job.token),
+        "jobKind": job.kind,
+        "jobStatus": job.status,
+        "progress": job.progress,
+        "total": job.total,
+        "message": job.message,
+        "result": job.result,
+        "createdAt": job.created_at.isoformat(),
+        "startedAt": job.started_at.isoformat() if job.started_at else None,
+        "finishedAt": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Keyset pagination over (position, id), for the lists of units and points.
+#
+# A page is the rows after or before a key, or the rows around a position
+# (e.g. the course's current position), read with LIMIT on the index of the
+# position: unlike OFFSET, the cost of a page doesn't grow with its depth,
+# and pages don't shift when rows are inserted before them.
+#
+# Pages are lazy, so that nothing is read when the page is served from the
+# fragment cache.
+
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+PAGE_SIZE = 100
+
+
+def encode_key(row):
+    return f"{row.position}.{row.pk}"
+
+
+def decode_key(key):
+    """(position, id) of a key. Raises ValueError if it isn't one."""
+    position, _, pk = key.partition(".")
+    return int(position), int(pk)
+
+
+def after_key(queryset, key):
+    position, pk = decode_key(key)
+    return queryset.filter(
+        Q(position__gt=position) | Q(position=position, pk__gt=pk)
+    ).order_by("position", "pk")
+
+
+def before_key(queryset, key):
+    position, pk = decode_key(key)
+    return queryset.filter(
+        Q(position__lt=position) | Q(position=position, pk__lt=pk)
+    ).order_by("-position", "-pk")
+
+
+class KeysetPage:
+    """A page of 'queryset' of up to 'size' rows: those after the key
+    'after', before the key 'before', or else around 'position' (starting a
+    few rows before it, or from the start if it is past the last row), in
+    (position, id) order. 'position' may be a function, only called if the
+    page is read.
+
+    Pages after or before a key continue the page they were asked from, so
+    they only link to the next page in the same direction."""
+
+    def __init__(
+        self, queryset, after=None, before=None, position=None, size=PAGE_SIZE
+    ):
+        self.queryset = queryset
+        self.after = after
+        self.before = before
+        self.position = position
+        self.size = size
+        self.has_previous = False
+        self.has_next = False
+
+    @property
+    def cache_key(self):
+        """What the page depends on, besides the version of the course (which
+        changes with the position)."""
+        if self.after:
+            return f"after-{self.after}"
+        if self.before:
+            return f"before-{self.before}"
+        return "at"
+
+    @cached_property
+    def rows(self):
+        size = self.size
+        if self.after:
+            rows = list(after_key(self.queryset, self.after)[: size + 1])
+            self.has_next = len(rows) > size
+            return rows[:size]
+        if self.before:
+            rows = list(before_key(self.queryset, self.before)[: size + 1])
+            self.has_previous = len(rows) > size
+            return rows[:size][::-1]
+        position = self.position() if callable(self.position) else self.position
+        following = []
+        if position:
+            following = list(
+                self.queryset.filter(position__gte=position).order_by("position", "pk")[
+                    : size + 1
+                ]
+            )
+        if not following:
+            # No position, or it is past the last row: the first page.
+            rows = list(self.queryset.order_by("position", "pk")[: size + 1])
+            self.has_next = len(rows) > size
+            return rows[:size]
+        self.has_next = len(following) > size
+        # A few rows of context before the position, so that it isn't at the
+        # very top of the page, or more to fill the page near the end.
+        context = max(1, size // 10, size - len(following))
+        previous = list(
+            self.queryset.filter(position__lt=position).order_by("-position", "-pk")[
+                : context + 1
+            ]
+        )
+        self.has_previous = len(previous) > context
+        previous = previous[:context][::-1]
+        if len(previous) + len(following) > size:
+            following = following[: size - len(previous)]
+            self.has_next = True
+        return previous + following
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    @property
+    def previous_key(self):
+        """The key to ask for the page before this one, or None."""
+        rows = self.rows
+        return encode_key(rows[0]) if self.has_previous and rows else None
+
+    @property
+    def next_key(self):
+        """The key to ask for the page after this one, or None."""
+        rows = self.rows
+        return encode_key(rows[-1]) if self.has_next and rows else None
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Scanner for Markdown course files.
+#
+# Markdown courses follow the same structure as org ones:
+#
+# # (Unit 1) The first unit
+# POSITION: 1
+# TAGS: tag1
+#
+# ## (Point 1) Whatever
+# TYPE: theory
+# STATE: pending
+# TAGS: tag2 tag3
+#
+# Contents of the point, in Markdown.
+#
+# Level 1 headings are units and level 2 headings are points. Deeper
+# headings are part of their point's contents. A paragraph right below a
+# heading made only of "KEY: value" lines with the keys below sets its
+# attributes, like an org property drawer.
+#
+# The file is split before each level 1 heading and each unit is parsed by
+# mistune on its own, so only one unit is in memory at a time. Headings and
+# contents are rendered back to Markdown by mistune's MarkdownRenderer. The
+# headings are returned as the same OrgHeading records as the org scanner's,
+# so both formats share the rest of the import.
+
+import re
+
+import mistune
+from mistune.core import BlockState
+from mistune.renderers.markdown import MarkdownRenderer
+
+from syllabooster.utils.orgscan import OrgHeading
+
+ATTRIBUTES = {"POSITION", "STATE", "TAGS", "TYPE"}
+RE_ATTRIBUTE = re.compile(r"([A-Z]+):\s*(.*?)\s*$")
+RE_FENCE = re.compile(r" {0,3}(`{3,}|~{3,})")
+RE_TAG_SEPARATOR = re.compile(r"[\s,:]+")
+
+parse_markdown = mistune.create_markdown(renderer=None)
+markdown_renderer = MarkdownRenderer()
+
+
+def split_units(lines):
+    """Yield the text of a Markdown file in pieces, each starting with a
+    level 1 heading (but the first one). Headings in fenced code don't
+    count."""
+    fence = None
+    piece = []
+    for line in lines:
+        match = RE_FENCE.match(line)
+        if fence is None:
+            if match:
+                fence = match.group(1)
+            elif (line.startswith("# ") or line.rstrip() == "#") and piece:
+                yield "".join(piece)
+                piece = []
+        elif (
+            match
+            and match.group(1).startswith(fence)
+            and not line[match.end() :].strip()
+        ):
+            fence = None
+        piece.append(line)
+    if piece:
+        yield "".join(piece)
+
+
+def tokens_attributes(tokens):
+    """Return the attributes set by the first paragraph of 'tokens' and the
+    tokens after it, or no attributes and all the tokens."""
+    for index, token in enumerate(tokens):
+        if token["type"] == "blank_line":
+            continue
+        if token["type"] != "paragraph":
+            break
+        attributes = {}
+        text = markdown_renderer.render_children(token, BlockState())
+        for line in text.splitlines():
+            match = RE_ATTRIBUTE.match(line)
+            if not match or match.group(1) not in ATTRIBUTES:
+                return {}, tokens
+            attributes[match.group(1)] = match.group(2)
+        return attributes, tokens[index + 1 :]
+    return {}, tokens
+
+
+class MarkdownScanner:
+    """State of a scan: the current unit and points, and the open section
+    (a level 1 or 2 heading with the tokens below it)."""
+
+    def __init__(self):
+        self.unit = None
+        self.points = []
+        self.section = None
+        self.parent_tags = set()
+
+    def close_section(self):
+        if self.section is None:
+            return
+        level, heading_token, tokens = self.section
+        self.section = None
+        attributes, tokens = tokens_attributes(tokens)
+        shallow_tags = {
+            tag for tag in RE_TAG_SEPARATOR.split(attributes.pop("TAGS", "")) if tag
+        }
+        if level == 1:
+            tags = self.parent_tags = shallow_tags
+        else:
+            tags = shallow_tags | self.parent_tags
+        heading = OrgHeading(
+            level=level,
+            heading=markdown_renderer.render_children(
+                heading_token, BlockState()
+            ).strip(),
+            todo=attributes.pop("STATE", None),
+            shallow_tags=shallow_tags,
+            tags=tags,
+            properties=attributes,
+            body=markdown_renderer(tokens, BlockState()).strip("\n"),
+        )
+        if level == 1:
+            self.unit = heading
+        else:
+            self.points.append(heading)
+
+    def take_unit(self):
+        group = (self.unit, self.points)
+        self.unit = None
+        self.points = []
+        return group
+
+    def feed(self, tokens):
+        """Scan the tokens of a piece of the file, yielding the units
+        completed by it with their points."""
+        for token in tokens:
+            level = token["attrs"]["level"] if token["type"] == "heading" else None
+            if level == 1 or level == 2:
+                self.close_section()
+                if level == 1 and (self.unit is not None or self.points):
+                    yield self.take_unit()
+                self.section = (level, token, [])
+            elif self.section is not None:
+                self.section[2].append(token)
+
+
+def scan_md_units(lines):
+    """Yield each level 1 heading of a Markdown file with the list of its
+    level 2 headings, reading 'lines' one unit at a time (see
+    orgscan.scan_org_units)."""
+    scanner = MarkdownScanner()
+    for piece in split_units(lines):
+        yield from scanner.feed(parse_markdown(piece))
+    scanner.close_section()
+    if scanner.unit is not None or scanner.points:
+        yield scanner.take_unit()
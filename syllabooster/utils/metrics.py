@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+# Per-view request metrics in the Prometheus text format.
+#
+# metrics_middleware times each request and, through an execute wrapper
+# installed on every database connection, counts its queries and the time
+# spent in them. The current request's counters live in a context variable,
+# so queries run by async views in sync_to_async threads are counted too, and
+# a single wrapper per connection serves all the requests using it.
+#
+# Metrics are kept in memory per process and labelled with its pid. A scrape
+# reaches only one gunicorn worker, so with settings.METRICS_DIR set each
+# worker also saves its metrics there at most once per METRICS_SAVE_INTERVAL
+# seconds, and /metrics/ serves those of every live worker of the machine.
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Seconds, as in Prometheus' client libraries.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+METRICS_SAVE_INTERVAL = 1
+
+current_request = ContextVar("current_request", default=None)
+
+
+class RequestMetrics:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket, plus the +Inf one.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def dump(self):
+        return {"counts": list(self.counts), "sum": self.sum}
+
+    @classmethod
+    def load(cls, buckets, data):
+        histogram = cls(buckets)
+        histogram.counts = data["counts"]
+        histogram.sum = data["sum"]
+        return histogram
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_time = 0.0
+        self.statuses = {}
+
+    def dump(self):
+        return {
+            "latency": self.latency.dump(),
+            "queries": self.queries.dump(),
+            "db_time": self.db_time,
+            "statuses": self.statuses.copy(),
+        }
+
+    @classmethod
+    def load(cls, data):
+        metrics = cls()
+        metrics.latency = Histogram.load(LATENCY_BUCKETS, data["latency"])
+        metrics.queries = Histogram.load(QUERY_BUCKETS, data["queries"])
+        metrics.db_time = data["db_time"]
+        # JSON keys are strings.
+        metrics.statuses = {
+            int(status): count for status, count in data["statuses"].items()
+        }
+        return metrics
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.saved_at = 0.0
+
+    def record(self, view, status, latency, request_metrics):
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            metrics.latency.observe(latency)
+            metrics.queries.observe(request_metrics.queries)
+            metrics.db_time += request_metrics.db_time
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        if (
+            settings.METRICS_DIR
+            and time.monotonic() - self.saved_at >= METRICS_SAVE_INTERVAL
+        ):
+            save_metrics(settings.METRICS_DIR)
+
+    def clear(self):
+        with self.lock:
+            self.views = {}
+
+
+registry = Registry()
+
+
+def save_metrics(directory):
+    """Write the metrics of this process to <directory>/<pid>.json."""
+    with registry.lock:
+        data = {view: metrics.dump() for view, metrics in registry.views.items()}
+        registry.saved_at = time.monotonic()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    # Written aside and renamed, so that readers never see half a file.
+    temporary_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "w") as metricsfile:
+        json.dump(data, metricsfile)
+    os.replace(temporary_path, path)
+
+
+def process_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def load_metrics(directory):
+    """The metrics saved in 'directory' by the processes still running, by
+    pid. The files of the other processes are removed."""
+    processes = {}
+    for name in os.listdir(directory):
+        pid, extension = os.path.splitext(name)
+        if extension != ".json" or not pid.isdigit():
+            continue
+        path = os.path.join(directory, name)
+        if not process_is_alive(int(pid)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path) as metricsfile:
+                data = json.load(metricsfile)
+        except (FileNotFoundError, ValueError):
+            continue
+        processes[int(pid)] = {
+            view: ViewMetrics.load(metrics) for view, metrics in data.items()
+        }
+    return processes
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper adding the query to the current request's counters."""
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.db_time += time.perf_counter() - start
+        request_metrics.queries += 1
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """connection_created handler installing record_query() once per
+    connection."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "unmatched"
+
+
+def format_bound(bound):
+    return "+Inf" if bound is None else repr(float(bound))
+
+
+def format_histogram(lines, name, view_labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + (None,), histogram.counts):
+        cumulative += count
+        lines.append(
+            f'{name}_bucket{{{view_labels},le="{format_bound(bound)}"}} {cumulative}'
+        )
+    lines.append(f"{name}_sum{{{view_labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{view_labels}}} {cumulative}")
+
+
+def render_metrics():
+    """The metrics of every process saved in settings.METRICS_DIR, or only
+    those of this process without it, in the Prometheus text format."""
+    directory = settings.METRICS_DIR
+    if directory:
+        save_metrics(directory)
+        return format_metrics(load_metrics(directory))
+    with registry.lock:
+        return format_metrics({os.getpid(): registry.views})
+
+
+def format_metrics(processes):
+    """Format the metrics of 'processes', a dict of the views of each pid."""
+    views = sorted(
+        (
+            (view, pid, metrics)
+            for pid, process_views in processes.items()
+            for view, metrics in process_views.items()
+        ),
+        key=lambda row: row[:2],
+    )
+    lines = [
+        "# HELP syllabooster_requests_total Requests by view and status.",
+        "# TYPE syllabooster_requests_total counter",
+    ]
+    for view, pid, metrics in views:
+        for status, count in sorted(metrics.statuses.items()):
+            lines.append(
+                f'syllabooster_requests_total{{pid="{pid}",view="{view}",'
+                f'status="{status}"}} {count}'
+            )
+    lines += [
+        "# HELP syllabooster_request_duration_seconds Request latency by view.",
+        "# TYPE syllabooster_request_duration_seconds histogram",
+    ]
+    for view, pid, metrics in views:
+        format_histogram(
+            lines,
+            "syllabooster_request_duration_seconds",
+            f'pid="{pid}",view="{view}"',
+            metrics.latency,
+        )
+    lines += [
+        "# HELP syllabooster_request_queries Database queries per request by view.",
+        "# TYPE syllabooster_request_queries histogram",
+    ]
+    for view, pid, metrics in views:
+        format_histogram(
+            lines,
+            "syllabooster_request_queries",
+            f'pid="{pid}",view="{view}"',
+            metrics.queries,
+        )
+    lines += [
+        "# HELP syllabooster_db_duration_seconds_total Time spent in database "
+        "queries by view.",
+        "# TYPE syllabooster_db_duration_seconds_total counter",
+    ]
+    for view, pid, metrics in views:
+        lines.append(
+            f'syllabooster_db_duration_seconds_total{{pid="{pid}",view="{view}"}} '
+            f"{metrics.db_time}"
+        )
+    return "\n".join(lines) + "\n"
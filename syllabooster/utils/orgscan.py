@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+# Single-pass scanner for the subset of Org used by course files.
+#
+# Course files only use level 1 headings (units), level 2 headings (points),
+# TODO keywords, tags, a :PROPERTIES: drawer and a body. orgparse builds a
+# full node tree and parses timestamps in every line, which dominates the
+# time spent importing big files, so the importers use scan_org() instead.
+#
+# scan_org() follows orgparse's rules for everything it returns (see
+# scan_org_with_orgparse() and the conformance tests): the TODO keywords are
+# those of all the #+TODO, #+SEQ_TODO and #+TYP_TODO lines of the file (TODO
+# and DONE if there are none), tags are inherited from the parent heading and
+# the #+FILETAGS of the preamble, and the body leaves out the planning line,
+# CLOCK lines, the first property drawer, repeated-task lines and level > 2
+# children. Property values are kept as strings (orgparse turns Effort into
+# minutes). Nothing here touches the database.
+
+import re
+from typing import NamedTuple
+
+from orgparse.date import OrgDateClock, parse_sdc
+
+RE_HEADER = re.compile(r"\*+ ")
+RE_HEADING = re.compile(r"(\*+)\s+(.*?)\s*$")
+RE_HEADING_TAGS = re.compile(r"(.*?)\s*:([\w@:]+):\s*$")
+RE_HEADING_PRIORITY = re.compile(r"^\s*\[#([A-Z0-9])\] ?(.*)$")
+RE_SPECIAL_COMMENT = re.compile(r"\s*#\+([^:]*):(.*)")
+RE_PROPERTY = re.compile(r"^\s*:(.*?):\s*(.*?)\s*$")
+RE_REPEATED_TASK = re.compile(r'\s*-\s+State\s+"[^"]+"\s+from\s+"[^"]+"\s+\[[^\]]+\]')
+RE_LINK = re.compile(r"\[\[(?P<desc0>[^\]]+)\]\]|\[\[[^\]]+\]\[(?P<desc1>[^\]]+)\]\]")
+
+TODO_COMMENTS = ("TODO", "SEQ_TODO", "TYP_TODO")
+DEFAULT_TODO_KEYS = ["TODO", "DONE"]
+
+
+class OrgHeading(NamedTuple):
+    level: int
+    heading: str
+    todo: str | None
+    shallow_tags: set[str]
+    tags: set[str]
+    properties: dict[str, str]
+    body: str
+
+
+def to_plain_text(text):
+    """Replace links with their descriptions, as orgparse does."""
+    if "[[" not in text:
+        return text
+    return RE_LINK.sub(lambda m: m.group("desc0") or m.group("desc1"), text)
+
+
+def parse_todo_keys(value):
+    """Split the value of a #+TODO line into its TODO and DONE keywords."""
+    todos, _, dones = value.partition("|")
+    return (
+        [key.split("(", 1)[0] for key in todos.split()],
+        [key.split("(", 1)[0] for key in dones.split()],
+    )
+
+
+def is_planning_line(line):
+    return ("SCHEDULED:" in line or "DEADLINE:" in line or "CLOSED:" in line) and any(
+        parse_sdc(line)
+    )
+
+
+def scan_section(lines):
+    """Return the properties and the body of the lines below a heading."""
+    properties = {}
+    body = []
+    in_drawer = None
+    for index, line in enumerate(lines):
+        if index == 0 and is_planning_line(line):
+            continue
+        if "CLOCK:" in line and OrgDateClock.from_str(line):
+            continue
+        if in_drawer is None and ":PROPERTIES:" in line:
+            in_drawer = True
+            continue
+        if in_drawer:
+            # Only the first drawer holds properties.
+            if ":END:" in line:
+                in_drawer = False
+            else:
+                match = RE_PROPERTY.match(line)
+                if match:
+                    properties[match.group(1)] = match.group(2)
+            continue
+        if "State" in line and RE_REPEATED_TASK.search(line):
+            continue
+        body.append(line)
+    return properties, to_plain_text("\n".join(body))
+
+
+class OrgScanner:
+    """State of a scan: the TODO keywords and file tags found so far, the
+    lines of the current section and the tags inherited by level 2 headings.
+    """
+
+    def __init__(self):
+        self.todos = []
+        self.dones = []
+        self.has_todo_comment = False
+        self.filetags = set()
+        self.in_preamble = True
+        self.lines = None
+        # Tags of the last level 1 heading, inherited by level 2 ones.
+        self.parent_tags = self.filetags
+
+    @property
+    def todo_keys(self):
+        if self.has_todo_comment:
+            return self.todos + self.dones
+        return DEFAULT_TODO_KEYS
+
+    def feed(self, line):
+        """Scan a line. If it is a level 1 or 2 heading, return its section
+        (level, heading text and the list its lines will be added to)."""
+        if line.startswith("*") and RE_HEADER.match(line):
+            self.in_preamble = False
+            stars, text = RE_HEADING.match(line).groups()
+            if len(stars) <= 2:
+                self.lines = []
+                return (len(stars), text, self.lines)
+            self.lines = None
+            return None
+        if "#+" in line:
+            match = RE_SPECIAL_COMMENT.match(line)
+            if match:
+                key = match.group(1).upper()
+                value = match.group(2).strip()
+                if key in TODO_COMMENTS:
+                    self.has_todo_comment = True
+                    todos, dones = parse_todo_keys(value)
+                    self.todos.extend(todos)
+                    self.dones.extend(dones)
+                elif key == "FILETAGS" and self.in_preamble:
+                    self.filetags.update(
+                        tag.strip() for tag in value.split(":") if tag.strip()
+                    )
+        if self.lines is not None:
+            self.lines.append(line)
+        return None
+
+    def heading(self, section):
+        """Build the OrgHeading of a complete section. Sections must be
+        passed in order, for level 2 headings to inherit the right tags."""
+        level, text, lines = section
+        match = RE_HEADING_TAGS.search(text)
+        if match:
+            text = match.group(1)
+            shallow_tags = set(match.group(2).split(":"))
+        else:
+            shallow_tags = set()
+        todo = None
+        for key in self.todo_keys:
+            if text == key:
+                text, todo = "", key
+                break
+            if text.startswith(key + " "):
+                text, todo = text[len(key) + 1 :], key
+                break
+        match = RE_HEADING_PRIORITY.search(text)
+        if match:
+            text = match.group(2)
+        if level == 1:
+            tags = self.parent_tags = shallow_tags | self.filetags
+        else:
+            tags = shallow_tags | self.parent_tags
+        properties, body = scan_section(lines)
+        return OrgHeading(
+            level=level,
+            heading=to_plain_text(text),
+            todo=todo,
+            shallow_tags=shallow_tags,
+            tags=tags,
+            properties=properties,
+            body=body,
+        )
+
+
+def scan_org(input_string):
+    """Return the level 1 and 2 headings of an org string, in order."""
+    scanner = OrgScanner()
+    sections = []
+    for line in input_string.splitlines():
+        section = scanner.feed(line)
+        if section is not None:
+            sections.append(section)
+    return [scanner.heading(section) for section in sections]
+
+
+def scan_org_units(lines):
+    """Yield each level 1 heading of an org file with the list of its level
+    2 headings, reading 'lines' only up to the end of the unit. Level 2
+    headings before the first level 1 one are yielded first, with None.
+
+    Unlike scan_org(), a unit only knows the TODO keywords declared up to its
+    end, so they must be declared before the headings using them (as in the
+    preamble, where they usually are).
+    """
+    scanner = OrgScanner()
+    unit = None
+    points = []
+    for line in lines:
+        section = scanner.feed(line.rstrip("\n"))
+        if section is None:
+            continue
+        if section[0] == 2:
+            points.append(section)
+            continue
+        if unit is not None or points:
+            yield unit_headings(scanner, unit, points)
+        unit = section
+        points = []
+    if unit is not None or points:
+        yield unit_headings(scanner, unit, points)
+
+
+def group_units(headings):
+    """Group the headings returned by scan_org() as scan_org_units() does."""
+    unit = None
+    points = []
+    for heading in headings:
+        if heading.level == 2:
+            points.append(heading)
+            continue
+        if unit is not None or points:
+            yield unit, points
+        unit = heading
+        points = []
+    if unit is not None or points:
+        yield unit, points
+
+
+def unit_headings(scanner, unit, points):
+    return (
+        scanner.heading(unit) if unit is not None else None,
+        [scanner.heading(point) for point in points],
+    )
+
+
+def scan_org_with_orgparse(input_string):
+    """Reference implementation of scan_org() on top of orgparse."""
+    import orgparse
+
+    return [
+        OrgHeading(
+            level=node.level,
+            heading=node.heading,
+            todo=node.todo,
+            shallow_tags=node.shallow_tags,
+            tags=node.tags,
+            properties=node.properties,
+            body=node.body,
+        )
+        for node in orgparse.loads(input_string)[1:]
+        if node.level <= 2
+    ]
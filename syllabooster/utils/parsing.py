@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+#
+# Parsing of course files into plain records.
+#
+# Nothing here touches the database or imports Django models, so the
+# parsers can run in worker processes and return picklable results.
+
+import glob
+import hashlib
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from syllabooster.utils.mdscan import scan_md_units
+from syllabooster.utils.orgscan import group_units, scan_org, scan_org_units
+
+DEFAULT_POINT_TYPE = "theory"
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+def content_hash(*parts):
+    """Hex SHA-256 of the given strings, kept apart by separators."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@dataclass
+class ParsedUnit:
+    position: int
+    title: str
+    tags: list[str] = field(default_factory=list)
+
+    def content_hash(self):
+        return content_hash(self.title, ":".join(sorted(self.tags)))
+
+
+@dataclass
+class ParsedPoint:
+    headline: str
+    contents: str
+    point_type: str
+    todo: str
+    position: int
+    unit: int | None = None
+    tags: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ParsedCourse:
+    units: list[ParsedUnit] = field(default_factory=list)
+    points: list[ParsedPoint] = field(default_factory=list)
+
+    def only_units(self, positions, include_orphans=True):
+        """Return a copy keeping only the given units and their points."""
+        positions = set(positions)
+        return ParsedCourse(
+            units=[unit for unit in self.units if unit.position in positions],
+            points=[
+                point
+                for point in self.points
+                if point.unit in positions or (include_orphans and point.unit is None)
+            ],
+        )
+
+
+def parse_org_course(input_string, unit_positions="sequential", numbering="unit"):
+    """Parse an org string into a ParsedCourse.
+
+    Units are numbered in the order they appear in the file when
+    'unit_positions' is "sequential", or taken from their POSITION property
+    when it is "property".
+
+    Points are numbered 1000 * unit + position in unit when 'numbering' is
+    "unit", or in the order they appear in the file when it is "sequential".
+    """
+    parsed = ParsedCourse()
+    for chunk in parse_units(
+        group_units(scan_org(input_string)), unit_positions, numbering
+    ):
+        parsed.units.extend(chunk.units)
+        parsed.points.extend(chunk.points)
+    return parsed
+
+
+def iter_org_units(lines, unit_positions="sequential", numbering="unit"):
+    """Parse the lines of an org file as they are read, yielding one
+    ParsedCourse per unit with the unit and its points (see scan_org_units
+    and parse_org_course)."""
+    return parse_units(scan_org_units(lines), unit_positions, numbering)
+
+
+def parse_md_course(input_string, unit_positions="sequential", numbering="unit"):
+    """Parse a Markdown string into a ParsedCourse (see mdscan.py for the
+    format and parse_org_course for the arguments)."""
+    parsed = ParsedCourse()
+    for chunk in iter_md_units(
+        input_string.splitlines(keepends=True), unit_positions, numbering
+    ):
+        parsed.units.extend(chunk.units)
+        parsed.points.extend(chunk.points)
+    return parsed
+
+
+def iter_md_units(lines, unit_positions="sequential", numbering="unit"):
+    """Parse the lines of a Markdown file as they are read, yielding one
+    ParsedCourse per unit (see iter_org_units)."""
+    return parse_units(scan_md_units(lines), unit_positions, numbering)
+
+
+COURSE_PARSERS = {"org": parse_org_course, "md": parse_md_course}
+UNIT_ITERATORS = {"org": iter_org_units, "md": iter_md_units}
+
+
+def iter_course_units(
+    lines, input_format="org", unit_positions="sequential", numbering="unit"
+):
+    """Call the iter_*_units function of 'input_format'."""
+    try:
+        iterator = UNIT_ITERATORS[input_format]
+    except KeyError:
+        raise ImportFormatError(f"Unsupported format: {input_format}")
+    return iterator(lines, unit_positions, numbering)
+
+
+def parse_units(units, unit_positions="sequential", numbering="unit"):
+    """Turn the (unit, points) headings of scan_org_units() into one
+    ParsedCourse per unit."""
+    unit_count = 0
+    next_point = 1
+    points_in_unit = {}
+    for unit_heading, point_headings in units:
+        chunk = ParsedCourse()
+        # Points before the first unit don't belong to any.
+        current_unit = None
+        if unit_heading is not None:
+            unit_count += 1
+            if unit_positions == "property":
+                position = unit_heading.properties.get("POSITION")
+                try:
+                    current_unit = int(position)
+                except (TypeError, ValueError):
+                    raise ImportFormatError(
+                        f'Unit "{unit_heading.heading}" has no valid POSITION property'
+                    )
+            else:
+                current_unit = unit_count
+            chunk.units.append(
+                ParsedUnit(
+                    position=current_unit,
+                    title=unit_heading.heading,
+                    tags=sorted(unit_heading.shallow_tags),
+                )
+            )
+        for heading in point_headings:
+            points_in_unit[current_unit] = points_in_unit.get(current_unit, 0) + 1
+            if numbering == "unit":
+                position = points_in_unit[current_unit] + 1000 * (current_unit or 0)
+            else:
+                position = next_point
+            next_point += 1
+            chunk.points.append(
+                ParsedPoint(
+                    headline=heading.heading,
+                    contents=heading.body,
+                    point_type=(
+                        heading.properties.get("TYPE") or DEFAULT_POINT_TYPE
+                    ).lower(),
+                    todo=(heading.todo or "").lower(),
+                    position=position,
+                    unit=current_unit,
+                    tags=sorted(heading.tags),
+                )
+            )
+        yield chunk
+
+
+def natural_key(path):
+    """Sort key putting "unit2.org" before "unit10.org"."""
+    return [
+        int(part) if part.isdigit() else part for part in re.split(r"(\d+)", str(path))
+    ]
+
+
+def course_input_files(name, input_format="org"):
+    """Return the files named by 'name': the file itself, the files of
+    'input_format' (.org or .md) in it if it is a directory, or the files matching it if it is a glob pattern.
+    Files are sorted by name, with numbers in natural order."""
+    path = Path(name)
+    if path.is_file():
+        return [path]
+    if path.is_dir():
+        paths = path.glob(f"*.{input_format}")
+    else:
+        paths = map(Path, glob.glob(name))
+    return sorted((path for path in paths if path.is_file()), key=natural_key)
+
+
+def parse_course_file(
+    path, input_format="org", unit_positions="sequential", numbering="unit"
+):
+    """Parse an org or Markdown file into a ParsedCourse (see
+    parse_org_course)."""
+    if input_format not in COURSE_PARSERS:
+        raise ImportFormatError(f"Unsupported format: {input_format}")
+    with open(path, "r") as coursefile:
+        input_string = coursefile.read()
+    try:
+        return COURSE_PARSERS[input_format](input_string, unit_positions, numbering)
+    except ImportFormatError as e:
+        raise ImportFormatError(f"{path}: {e}")
+
+
+def merge_parsed_courses(parsed_courses, unit_positions="sequential", numbering="unit"):
+    """Join the courses parsed from several files into one, in order.
+
+    Positions numbered sequentially continue from one file to the next.
+    Positions taken from POSITION properties are kept, and must not repeat.
+    """
+    merged = ParsedCourse()
+    seen_positions = set()
+    for parsed in parsed_courses:
+        unit_offset = len(merged.units) if unit_positions == "sequential" else 0
+        point_offset = len(merged.points) if numbering == "sequential" else 0
+        for unit in parsed.units:
+            unit.position += unit_offset
+            if unit.position in seen_positions:
+                raise ImportFormatError(
+                    f'Unit "{unit.title}" repeats position {unit.position}'
+                )
+            seen_positions.add(unit.position)
+            merged.units.append(unit)
+        for point in parsed.points:
+            if point.unit is not None:
+                point.unit += unit_offset
+                if numbering == "unit":
+                    point.position += 1000 * unit_offset
+            point.position += point_offset
+            merged.points.append(point)
+    merged.units.sort(key=lambda unit: unit.position)
+    return merged
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Rendering of the HTML of many points at once, in a pool of processes.
+#
+# The points whose cached HTML is stale are read in batches and rendered by
+# utils/rendering.py in worker processes, and the results are stored with one
+# executemany() per batch. Only a few batches are in flight at a time, so
+# memory use doesn't grow with the number of points.
+#
+# After an import, the course is queued as a PRERENDER job for the import
+# worker (see utils/jobs.py), so that neither the import nor the request or
+# job that ran it waits for the rendering.
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from syllabooster.models import *
+from syllabooster.utils.rendering import html_cache_key, render_points
+
+PRERENDER_BATCH_SIZE = 500
+
+
+def stale_batches(points, batch_size, render_all=False):
+    """Yield lists of (id, contents) of the points with stale HTML."""
+    batch = []
+    for pk, contents, html_key in points.values_list(
+        "id", "contents", "html_key"
+    ).iterator(chunk_size=batch_size):
+        if render_all or html_key != html_cache_key(contents):
+            batch.append((pk, contents))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def store_rendered(rendered):
+    """Store a batch of render_points() results. A single executemany() of
+    a plain UPDATE is much faster than bulk_update(), whose CASE expressions
+    grow with the batch."""
+    point_table = connection.ops.quote_name(Point._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {point_table} SET html = %s, html_key = %s WHERE id = %s",
+            [(html, html_key, pk) for pk, html, html_key in rendered],
+        )
+    return len(rendered)
+
+
+def prerender_points(
+    points, jobs=None, batch_size=PRERENDER_BATCH_SIZE, render_all=False
+):
+    """Render and store the HTML of the points of the 'points' queryset
+    whose cached HTML is stale (or all of them, with 'render_all'), in up to
+    'jobs' processes (one per CPU by default). A single batch is rendered in
+    this process. Returns the number of rendered points."""
+    batches = stale_batches(points, batch_size, render_all)
+    first_batches = list(islice(batches, 2))
+    max_workers = jobs or os.cpu_count() or 1
+    if len(first_batches) < 2 or max_workers == 1:
+        return sum(
+            store_rendered(render_points(batch))
+            for batch in chain(first_batches, batches)
+        )
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for batch in chain(first_batches, batches):
+            pending.append(executor.submit(render_points, batch))
+            if len(pending) > 2 * max_workers:
+                rendered += store_rendered(pending.popleft().result())
+        while pending:
+            rendered += store_rendered(pending.popleft().result())
+    return rendered
+
+
+def queue_prerender(course):
+    """Queue a PRERENDER job for 'course', unless one is already waiting."""
+    job_fields = {
+        "kind": ImportJob.PRERENDER,
+        "user_id": course.user_id,
+        "course_name": course.name,
+        "status": ImportJob.PENDING,
+    }
+    if not ImportJob.objects.filter(**job_fields).exists():
+        ImportJob.objects.create(**job_fields)
+
+
+def prerender_course(course):
+    """Post-import hook: once the current transaction commits, queue the
+    rendering of the stale HTML of the points of 'course' if
+    PRERENDER_AFTER_IMPORT is set."""
+    if settings.PRERENDER_AFTER_IMPORT:
+        transaction.on_commit(lambda: queue_prerender(course))
+
+
+def run_prerender_job(job):
+    """Render the stale HTML of the course of a claimed PRERENDER job.
+    Returns the result of the job."""
+    course = Course.objects.filter(name=job.course_name, user_id=job.user_id).first()
+    if course is None:
+        # Deleted since it was imported: there is nothing left to render.
+        return {"points": 0}
+    rendered = prerender_points(
+        Point.objects.filter(coursepoint__course=course),
+        jobs=settings.PRERENDER_WORKERS,
+    )
+    return {"points": rendered}
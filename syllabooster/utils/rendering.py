@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Rendering of point contents into sanitized HTML.
+#
+# Nothing here touches the database or imports Django models, so points can
+# be rendered in worker processes (see utils/prerender.py). Each process
+# configures one markdown-it instance when this module is imported, and each
+# thread one bleach Cleaner (they aren't thread-safe) the first time it
+# renders a point, and reuses them for every point it renders.
+
+import hashlib
+import threading
+
+from markdown_it import MarkdownIt
+import bleach
+
+md = MarkdownIt("commonmark", {"html": False})
+
+HTML_ALLOWED_TAGS = [
+    "p",
+    "br",
+    "strong",
+    "em",
+    "a",
+    "ul",
+    "ol",
+    "li",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "code",
+    "pre",
+    "blockquote",
+    "hr",
+    "table",
+    "thead",
+    "tbody",
+    "tr",
+    "th",
+    "td",
+    "span",
+    "div",
+    "img",
+]
+
+HTML_ALLOWED_ATTRIBUTES = {
+    "a": ["href", "title"],
+    "img": ["src", "alt", "title"],
+    "code": ["class"],
+    "span": ["class"],
+    "div": ["class"],
+}
+
+_local = threading.local()
+
+
+def html_cleaner():
+    """The bleach Cleaner of the current thread."""
+    cleaner = getattr(_local, "cleaner", None)
+    if cleaner is None:
+        cleaner = _local.cleaner = bleach.Cleaner(
+            tags=HTML_ALLOWED_TAGS, attributes=HTML_ALLOWED_ATTRIBUTES, strip=True
+        )
+    return cleaner
+
+
+# Bump HTML_RENDERER_REVISION when the rendering changes in a way that the
+# configuration below doesn't capture. Any change in the fingerprint makes
+# every cached render stale.
+HTML_RENDERER_REVISION = 1
+HTML_RENDERER_FINGERPRINT = repr(
+    (
+        HTML_RENDERER_REVISION,
+        "commonmark",
+        sorted(md.options.items()),
+        HTML_ALLOWED_TAGS,
+        sorted(HTML_ALLOWED_ATTRIBUTES.items()),
+        bleach.__version__,
+    )
+)
+
+
+def render_html(contents):
+    """Convert markdown to HTML and sanitize it."""
+    return html_cleaner().clean(md.render(contents))
+
+
+def html_cache_key(contents):
+    """Hash of the contents and the renderer configuration."""
+    digest = hashlib.sha256(HTML_RENDERER_FINGERPRINT.encode())
+    digest.update(contents.encode())
+    return digest.hexdigest()
+
+
+def render_points(points):
+    """Render a batch of (id, contents) pairs into (id, html, html_key)
+    triples."""
+    return [
+        (pk, render_html(contents), html_cache_key(contents)) for pk, contents in points
+    ]
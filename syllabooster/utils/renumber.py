@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# Set-based renumbering of the course points of a course.
+
+from django.db import connection, transaction
+from syllabooster.models import *
+from syllabooster.utils.changelog import COURSEPOINT, record_changes
+
+
+def renumber_points(course, from_unit=None):
+    """Give the course points of 'course' dense positions following the
+    order of their units and their current positions, in a single UPDATE.
+    Their relative positions in their unit (overall and by point type) are
+    recomputed in the same statement.
+
+    If 'from_unit' is given, only the points of that unit and the units
+    after it are renumbered, continuing from the last position before it.
+    Points that don't belong to any unit are left untouched.
+
+    Returns the number of rows that changed.
+    """
+    coursepoint_table = connection.ops.quote_name(CoursePoint._meta.db_table)
+    unit_table = connection.ops.quote_name(Unit._meta.db_table)
+    point_table = connection.ops.quote_name(Point._meta.db_table)
+    from_position = from_unit.position if from_unit is not None else 0
+    sql = f"""
+        UPDATE {coursepoint_table}
+        SET position = numbered.new_position,
+            relative_position = numbered.relative_position,
+            type_relative_position = numbered.type_relative_position
+        FROM (
+            SELECT
+                cp.id AS id,
+                COALESCE((
+                    SELECT MAX(prev.position)
+                    FROM {coursepoint_table} prev
+                    INNER JOIN {unit_table} prev_unit ON prev_unit.id = prev.unit_id
+                    WHERE prev.course_id = %s AND prev_unit.position < %s
+                ), 0) + ROW_NUMBER() OVER (
+                    ORDER BY unit.position, cp.position, cp.id
+                ) AS new_position,
+                ROW_NUMBER() OVER (
+                    PARTITION BY cp.unit_id ORDER BY cp.position, cp.id
+                ) AS relative_position,
+                ROW_NUMBER() OVER (
+                    PARTITION BY cp.unit_id, point.point_type_id
+                    ORDER BY cp.position, cp.id
+                ) AS type_relative_position
+            FROM {coursepoint_table} cp
+            INNER JOIN {unit_table} unit ON unit.id = cp.unit_id
+            INNER JOIN {point_table} point ON point.id = cp.point_id
+            WHERE cp.course_id = %s AND unit.position >= %s
+        ) numbered
+        WHERE {coursepoint_table}.id = numbered.id
+            AND (
+                {coursepoint_table}.position <> numbered.new_position
+                OR {coursepoint_table}.relative_position <> numbered.relative_position
+                OR {coursepoint_table}.type_relative_position
+                    <> numbered.type_relative_position
+            )
+        RETURNING {coursepoint_table}.id
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [course.pk, from_position, course.pk, from_position])
+        changed = [row[0] for row in cursor.fetchall()]
+        if changed:
+            record_changes(course.pk, [(COURSEPOINT, pk, False) for pk in changed])
+    return len(changed)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Full-text search of the points of a user's courses.
+#
+# On PostgreSQL each point stores a tsvector of its headline (weight A) and
+# contents (weight B) in Point.search_vector, kept up to date by a trigger
+# on inserts and on updates of those columns (see migration 0026), so the
+# bulk writes of the importers are covered too. A search is a single query
+# matching the GIN index of the vector, joined with the course points, units
+# and courses of the user and ranked by ts_rank.
+#
+# Other databases (e.g. SQLite during development) don't maintain the vector:
+# there, a search falls back to a case-insensitive scan of the user's points.
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, FloatField, Q, TextField, Value
+from syllabooster.models import *
+
+# Must match the configuration used by the trigger.
+SEARCH_CONFIG = "simple"
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+HIT_FIELDS = (
+    "pk",
+    "course_id",
+    "course__name",
+    "unit_id",
+    "unit__title",
+    "unit__position",
+    "position",
+    "point__headline",
+    "rank",
+    "snippet",
+)
+
+
+def search_hit(row):
+    (
+        pk,
+        course_id,
+        course_name,
+        unit_id,
+        unit_title,
+        unit_position,
+        position,
+        headline,
+        rank,
+        snippet,
+    ) = row
+    return {
+        "coursePointId": pk,
+        "courseId": course_id,
+        "courseName": course_name,
+        "unitId": unit_id,
+        "unitTitle": unit_title,
+        "unitPosition": unit_position,
+        "position": position,
+        "headline": headline,
+        "rank": rank,
+        "snippet": snippet,
+    }
+
+
+def search_course_points(user, text, course=None, limit=DEFAULT_SEARCH_LIMIT):
+    """The course points of 'user' (in 'course', if given) whose point
+    matches 'text', a web-search-style query ("quoted phrases", -excluded
+    words, or), best first, as dicts with their unit and course.
+
+    "snippet" holds the matching part of the contents, with the matches in
+    Markdown bold."""
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    coursepoints = CoursePoint.objects.filter(course__user=user)
+    if course is not None:
+        coursepoints = coursepoints.filter(course=course)
+    if connection.vendor == "postgresql":
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+        hits = (
+            coursepoints.filter(point__search_vector=query)
+            .annotate(
+                rank=SearchRank(F("point__search_vector"), query),
+                snippet=SearchHeadline(
+                    "point__contents",
+                    query,
+                    config=SEARCH_CONFIG,
+                    start_sel="**",
+                    stop_sel="**",
+                    max_fragments=1,
+                ),
+            )
+            .order_by("-rank", "course_id", "position")
+        )
+    else:
+        hits = (
+            coursepoints.filter(
+                Q(point__headline__icontains=text) | Q(point__contents__icontains=text)
+            )
+            .annotate(
+                rank=Value(None, output_field=FloatField()),
+                snippet=Value(None, output_field=TextField()),
+            )
+            .order_by("course_id", "position")
+        )
+    return [search_hit(row) for row in hits.values_list(*HIT_FIELDS)[:limit]]
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# Compact JSON snapshot of a whole course, for dashboards and other programs.
+#
+# The snapshot is columnar: each table (point types, states, tags, units and
+# course points) is an object of parallel arrays, one per column, and rows
+# refer to other tables by index in them rather than by nesting. Repeated
+# names are written once, and the arrays compress well.
+#
+# It is read with a fixed number of queries whatever the size of the course,
+# so its rows are all in memory while it is sent: a column can only be
+# written once every row has been read, and reading each column with its own
+# query could mix rows from different versions of the course. The JSON text
+# is then encoded SNAPSHOT_BATCH_SIZE values of a column at a time into the
+# stream, and gzipped as it goes, so neither the text nor the compressed
+# output is ever held whole.
+
+import json
+import zlib
+
+from syllabooster.models import *
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_CHUNK_SIZE = 64 * 1024
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def columns(rows, names):
+    """Parallel arrays of the rows, named by 'names'."""
+    values = list(zip(*rows)) if rows else [()] * len(names)
+    return {name: list(column) for name, column in zip(names, values)}
+
+
+def index_of(ids):
+    return {pk: index for index, pk in enumerate(ids)}
+
+
+def course_snapshot(course):
+    """The snapshot of 'course' as a dict of columns (5 queries)."""
+    point_types = list(PointType.objects.order_by("pk").values_list("pk", "name"))
+    point_type_index = index_of(pk for pk, _ in point_types)
+    states = [
+        (pk, point_type_index.get(point_type), position, name, display_name, terminal)
+        for pk, point_type, position, name, display_name, terminal in (
+            DeliveryState.objects.order_by("point_type", "position").values_list(
+                "pk",
+                "point_type",
+                "position",
+                "name",
+                "display_name",
+                "is_terminal",
+            )
+        )
+    ]
+    state_index = index_of(state[0] for state in states)
+    units = list(
+        Unit.objects.filter(course=course)
+        .order_by("position")
+        .values_list("pk", "position", "title")
+    )
+    unit_index = index_of(unit[0] for unit in units)
+    coursepoints = list(
+        CoursePoint.objects.filter(course=course)
+        .order_by("unit__position", "position")
+        .values_list(
+            "pk",
+            "point",
+            "unit",
+            "position",
+            "relative_position",
+            "type_relative_position",
+            "state",
+            "point__point_type",
+            "point__headline",
+            "point__contents",
+        )
+    )
+    point_tags = {}
+    tags = []
+    tag_index = {}
+    for point_id, tag_id, tag_name in (
+        Point.tags.through.objects.filter(point__coursepoint__course=course)
+        .order_by("point", "tag")
+        .values_list("point", "tag", "tag__name")
+    ):
+        if tag_id not in tag_index:
+            tag_index[tag_id] = len(tags)
+            tags.append((tag_id, tag_name))
+        point_tags.setdefault(point_id, []).append(tag_index[tag_id])
+
+    return {
+        "formatVersion": SNAPSHOT_FORMAT_VERSION,
+        "course": {
+            "id": course.pk,
+            "name": course.name,
+            "version": course.version,
+            "currentPosition": course.current_position,
+        },
+        "pointTypes": columns(point_types, ["id", "name"]),
+        "states": columns(
+            states,
+            ["id", "pointType", "position", "name", "displayName", "terminal"],
+        ),
+        "tags": columns(tags, ["id", "name"]),
+        "units": columns(units, ["id", "position", "title"]),
+        "points": columns(
+            [
+                (
+                    pk,
+                    point,
+                    unit_index.get(unit),
+                    position,
+                    relative_position,
+                    type_relative_position,
+                    state_index.get(state),
+                    point_type_index.get(point_type),
+                    headline,
+                    contents,
+                    point_tags.get(point, []),
+                )
+                for (
+                    pk,
+                    point,
+                    unit,
+                    position,
+                    relative_position,
+                    type_relative_position,
+                    state,
+                    point_type,
+                    headline,
+                    contents,
+                ) in coursepoints
+            ],
+            [
+                "id",
+                "pointId",
+                "unit",
+                "position",
+                "relativePosition",
+                "typeRelativePosition",
+                "state",
+                "pointType",
+                "headline",
+                "contents",
+                "tags",
+            ],
+        ),
+    }
+
+
+def json_array(values, batch_size=SNAPSHOT_BATCH_SIZE):
+    """Generate the JSON text of a list, 'batch_size' values at a time."""
+    yield "["
+    for start in range(0, len(values), batch_size):
+        text = json.dumps(values[start : start + batch_size], separators=(",", ":"))
+        yield ("," if start else "") + text[1:-1]
+    yield "]"
+
+
+def snapshot_json(snapshot, batch_size=SNAPSHOT_BATCH_SIZE):
+    """Generate the JSON text of a snapshot, a batch of a column at a time."""
+    yield '{"formatVersion":%d,"course":%s' % (
+        snapshot["formatVersion"],
+        json.dumps(snapshot["course"], separators=(",", ":")),
+    )
+    for table in ("pointTypes", "states", "tags", "units", "points"):
+        separator = "{"
+        yield f',"{table}":'
+        for name, column in snapshot[table].items():
+            yield f'{separator}"{name}":'
+            yield from json_array(column, batch_size)
+            separator = ","
+        yield "}" if separator == "," else "{}"
+    yield "}"
+
+
+def gzip_chunks(texts, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """Compress 'texts' into a gzip stream, in chunks of about 'chunk_size'
+    bytes."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    buffer = []
+    buffered = 0
+    for text in texts:
+        data = compressor.compress(text.encode())
+        if data:
+            buffer.append(data)
+            buffered += len(data)
+            if buffered >= chunk_size:
+                yield b"".join(buffer)
+                buffer = []
+                buffered = 0
+    buffer.append(compressor.flush())
+    yield b"".join(buffer)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# Process-local transition table of delivery states.
+#
+# DeliveryState rows almost never change, so the table is built once per
+# process from a single query and dropped by the model signals in
+# syllabooster.signals whenever a DeliveryState or PointType is saved or
+# deleted.
+#
+# The signals also bump a generation counter in the cache, which every
+# process checks at most once per STATE_TABLE_CHECK_INTERVAL seconds, so the
+# changes made by other processes are seen too (with a cache shared by the
+# workers). Changes that send no signal, such as QuerySet.update(), are seen
+# once the table is STATE_TABLE_TTL seconds old.
+
+import threading
+import time
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from syllabooster.models import *
+
+STATE_TABLE_GENERATION_KEY = "syllabooster:state-table-generation"
+STATE_TABLE_CHECK_INTERVAL = 1
+STATE_TABLE_TTL = 60
+
+
+class StateTransition(NamedTuple):
+    pk: int
+    point_type_id: int
+    position: int
+    name: str
+    display_name: str
+    css_class: str
+    next_pk: int
+    terminal: bool
+
+
+_lock = threading.Lock()
+_table = None
+_generation = None
+_built_at = 0.0
+_checked_at = 0.0
+
+
+def build_transition_table():
+    """For each point type, the tuple of its states ordered by position.
+    Each state points to the next one in the cycle, and the last one is
+    terminal."""
+    states_by_type = {}
+    for state in DeliveryState.objects.filter(point_type__isnull=False).order_by(
+        "point_type_id", "position", "id"
+    ):
+        states_by_type.setdefault(state.point_type_id, []).append(state)
+    by_type = {}
+    by_pk = {}
+    for point_type_id, states in states_by_type.items():
+        transitions = tuple(
+            StateTransition(
+                pk=state.pk,
+                point_type_id=point_type_id,
+                position=state.position,
+                name=state.name,
+                display_name=state.display_name,
+                css_class=state.css_class,
+                next_pk=states[(index + 1) % len(states)].pk,
+                terminal=index == len(states) - 1,
+            )
+            for index, state in enumerate(states)
+        )
+        by_type[point_type_id] = transitions
+        by_pk.update((transition.pk, transition) for transition in transitions)
+    return by_type, by_pk
+
+
+def _checked_table(now):
+    """The table if it was checked recently enough to be used as is."""
+    table = _table
+    if (
+        table is not None
+        and now - _checked_at < STATE_TABLE_CHECK_INTERVAL
+        and now - _built_at < STATE_TABLE_TTL
+    ):
+        return table
+    return None
+
+
+def _is_current(generation, now):
+    return (
+        _table is not None
+        and generation == _generation
+        and now - _built_at < STATE_TABLE_TTL
+    )
+
+
+def _refresh_table(generation, now):
+    """Rebuild the table unless it is current for 'generation'."""
+    global _table, _generation, _built_at, _checked_at
+    with _lock:
+        if not _is_current(generation, now):
+            _table = build_transition_table()
+            _generation = generation
+            _built_at = now
+        _checked_at = now
+        return _table
+
+
+def transition_table():
+    now = time.monotonic()
+    table = _checked_table(now)
+    if table is None:
+        table = _refresh_table(cache.get(STATE_TABLE_GENERATION_KEY, 0), now)
+    return table
+
+
+async def atransition_table():
+    global _checked_at
+    now = time.monotonic()
+    table = _checked_table(now)
+    if table is None:
+        generation = await cache.aget(STATE_TABLE_GENERATION_KEY, 0)
+        if _is_current(generation, now):
+            table = _table
+            _checked_at = now
+        else:
+            table = await sync_to_async(_refresh_table)(generation, now)
+    return table
+
+
+def invalidate_transition_table():
+    """Drop the table of this process, and make the other processes drop
+    theirs."""
+    global _table
+    with _lock:
+        _table = None
+    try:
+        cache.incr(STATE_TABLE_GENERATION_KEY)
+    except ValueError:
+        cache.set(STATE_TABLE_GENERATION_KEY, 1, timeout=None)
+
+
+def get_state(state_id):
+    """The transition for the state with pk 'state_id', or None."""
+    return transition_table()[1].get(state_id)
+
+
+async def aget_state(state_id):
+    return (await atransition_table())[1].get(state_id)
+
+
+def get_states(point_type_id):
+    """The transitions of a point type ordered by position."""
+    return transition_table()[0].get(point_type_id, ())
+
+
+def next_state(state_id):
+    """The transition following the state with pk 'state_id', or None."""
+    state = get_state(state_id)
+    if state is None:
+        return None
+    return get_state(state.next_pk)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# Synthetic courses for load tests and benchmarks.
+
+import random
+
+
+def points_per_unit(units, points, seed=None):
+    """Number of points of each unit: 'points', or, with a 'seed', a random
+    number between half and one and a half times 'points' (the same ones
+    for the same seed)."""
+    if seed is None:
+        return [points] * units
+    generator = random.Random(seed)
+    return [
+        generator.randint(max(points // 2, 1), points + points // 2)
+        for _ in range(units)
+    ]
+
+
+def synthetic_org(units, points, rich=False, seed=None):
+    """Org course with 'units' units of 'points' points each (see
+    points_per_unit for 'seed').
+
+    With 'rich', points also get tags, a property drawer, a few body lines
+    and a level 3 child, like real course files.
+    """
+    lines = ["#+title: Load test\n", "#+TODO: PENDING(p) | DELIVERED(d)\n"]
+    for unit, unit_points in enumerate(points_per_unit(units, points, seed), start=1):
+        lines.append(f"* Unit {unit}\n  :PROPERTIES:\n  :POSITION: {unit}\n  :END:\n")
+        for point in range(1, unit_points + 1):
+            if not rich:
+                lines.append(
+                    f"** PENDING Load test point {unit}.{point}\n"
+                    f"   Contents of point *{unit}.{point}*.\n"
+                )
+                continue
+            lines.append(
+                f"** PENDING Load test point {unit}.{point} :unit{unit}:tag{point % 7}:\n"
+                f"   :PROPERTIES:\n"
+                f"   :TYPE: {'exercise' if point % 3 == 0 else 'theory'}\n"
+                f"   :END:\n"
+                f"   Contents of point *{unit}.{point}*, with $x^{point}$ and a\n"
+                f"   [[https://example.com/{unit}/{point}][link]] to some reference.\n"
+                f"\n"
+                f"   - First item of a list in point {unit}.{point}.\n"
+                f"   - Second item, with ~code~ and /emphasis/.\n"
+                f"*** Notes on point {unit}.{point}\n"
+                f"    Not part of the contents of the point.\n"
+            )
+    return "".join(lines)
+
+
+def synthetic_md(units, points, rich=False):
+    """Markdown course with the same units and points as synthetic_org()."""
+    lines = []
+    for unit in range(1, units + 1):
+        lines.append(f"# Unit {unit}\n\nPOSITION: {unit}\n\n")
+        for point in range(1, points + 1):
+            if not rich:
+                lines.append(
+                    f"## Load test point {unit}.{point}\n\n"
+                    f"STATE: PENDING\n\n"
+                    f"Contents of point *{unit}.{point}*.\n\n"
+                )
+                continue
+            lines.append(
+                f"## Load test point {unit}.{point}\n\n"
+                f"STATE: PENDING\n"
+                f"TYPE: {'exercise' if point % 3 == 0 else 'theory'}\n"
+                f"TAGS: unit{unit} tag{point % 7}\n\n"
+                f"Contents of point *{unit}.{point}*, with $x^{point}$ and a\n"
+                f"[link](https://example.com/{unit}/{point}) to some reference.\n"
+                f"\n"
+                f"- First item of a list in point {unit}.{point}.\n"
+                f"- Second item, with `code` and _emphasis_.\n\n"
+                f"### Notes on point {unit}.{point}\n\n"
+                f"Part of the contents of the point.\n\n"
+            )
+    return "".join(lines)
@@ -1,16 +1,35 @@
+import functools
+import hashlib
 import json
+import os
+import uuid
 
+from asgiref.sync import sync_to_async
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib.auth.views import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.shortcuts import get_object_or_404, render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
 from django.utils.safestring import mark_safe
 from django.views.generic import ListView, DetailView
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Max, Min, OuterRef, Subquery, F, Window, Count
+from django.db.models import Max, Min, OuterRef, Q, Subquery, F, Window, Count
 from django.db.models.functions import RowNumber
+from django.db import transaction
 from django.conf import settings
 from django.urls import reverse
 
@@ -25,17 +44,32 @@ from .models import (
     CoursePoint,
     Unit,
     User,
+    StateSyncOperation,
+    ImportJob,
 )
 
-from .utils import importstr
-from .utils.exportcourse import export_course_org
+from .utils import importstr, statemachine
+from .utils.bulkimport import COURSE_PARSERS
+from .utils.changelog import (
+    COURSEPOINT,
+    DEFAULT_PAGE_SIZE,
+    changes_since,
+    decode_cursor,
+    record_changes,
+    record_course_changes,
+)
+from .utils.exportcourse import aexport_course_org, export_course_org
+from .utils.jobs import InputTooLarge, job_status, spool_input, spool_path
+from .utils.keyset import KeysetPage, decode_key
+from .utils.metrics import render_metrics
+from .utils.rendering import HTML_RENDERER_FINGERPRINT
+from .utils.search import DEFAULT_SEARCH_LIMIT, search_course_points
+from .utils.snapshot import course_snapshot, gzip_chunks, snapshot_json
 
 
 def get_course_current_unit(course):
     """Returns the unit of the current point."""
-    print(f"Course current position: {course.current_position}")
     position = course.current_position if course.current_position > 0 else 1
-    print(f"Position to look for: {position}")
     try:
         current_point = CoursePoint.objects.get(course=course, position=position)
         return current_point.unit
@@ -46,21 +80,17 @@ def get_course_current_unit(course):
 def update_course_current_position(course):
     """Update the current position for the course to the position
     following the maximum position of a done point (one whose
-    state is the last one for its point type)."""
-
-    # Subquery to get the maximum state position for each point type
-    max_state_pos = (
-        DeliveryState.objects.filter(point_type=OuterRef("point__point_type"))
-        .order_by()
-        .values("point_type")
-        .annotate(max_pos=Max("position"))
-        .values("max_pos")[:1]
-    )
+    state is the last one for its point type).
 
-    # Find max position of done course points
-    max_done_position = CoursePoint.objects.filter(
-        course=course, state__position=Subquery(max_state_pos)
-    ).aggregate(Max("position"))["position__max"]
+    This is the full recompute: it walks the (course, position) index
+    backwards until the first done point."""
+
+    max_done_position = (
+        CoursePoint.objects.filter(course=course, state__is_terminal=True)
+        .order_by("-position")
+        .values_list("position", flat=True)
+        .first()
+    )
 
     if max_done_position:
         course.current_position = max_done_position + 1
@@ -71,45 +101,151 @@ def update_course_current_position(course):
     return course.current_position
 
 
+def move_course_current_position(course, coursepoint, was_done, is_done):
+    """Adjust the current position of the course after the state of
+    'coursepoint' changed, looking only at that point and, if it was the
+    last done point, at the previous done one."""
+    position_after = coursepoint.position + 1
+    if is_done and not was_done:
+        if Course.objects.filter(
+            pk=course.pk, current_position__lt=position_after
+        ).update(current_position=position_after):
+            course.current_position = position_after
+    elif was_done and not is_done and course.current_position == position_after:
+        previous_done_position = (
+            CoursePoint.objects.filter(
+                course=course,
+                state__is_terminal=True,
+                position__lt=coursepoint.position,
+            )
+            .order_by("-position")
+            .values_list("position", flat=True)
+            .first()
+        )
+        new_position = previous_done_position + 1 if previous_done_position else 0
+        if Course.objects.filter(pk=course.pk, current_position=position_after).update(
+            current_position=new_position
+        ):
+            course.current_position = new_position
+    return course.current_position
+
+
 class CustomUserPassesTestMixin(UserPassesTestMixin):
-    unathorized_template = "unauthorised.html"
+    unathorized_template = "syllabooster/unauthorised.html"
 
     def handle_no_permission(self):
         return render(self.request, self.unathorized_template, status=403)
 
 
+def course_last_modified(course):
+    return int(course.modified.timestamp())
+
+
+def conditional_course_response(request, course, etag, get_response):
+    """Answer a conditional GET for a page of 'course' with a 304 if its
+    version hasn't changed, or with get_response() otherwise. Clients are
+    asked to revalidate the page every time."""
+    last_modified = course_last_modified(course)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = get_response()
+    return patch_course_validators(response, etag, last_modified)
+
+
+async def aconditional_course_response(request, course, etag, get_response):
+    """conditional_course_response() for a coroutine 'get_response'."""
+    last_modified = course_last_modified(course)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = await get_response()
+    return patch_course_validators(response, etag, last_modified)
+
+
+def patch_course_validators(response, etag, last_modified):
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@functools.cache
+def pages_fingerprint():
+    """Hash of the HTML renderer and of the templates of the app. It is part
+    of the ETags and cached fragments of the course pages, so a deploy that
+    changes how they are rendered doesn't serve the old ones."""
+    digest = hashlib.sha256(HTML_RENDERER_FINGERPRINT.encode())
+    templates = os.path.join(os.path.dirname(__file__), "templates")
+    for directory, subdirectories, files in os.walk(templates):
+        subdirectories.sort()
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            digest.update(os.path.relpath(path, templates).encode())
+            with open(path, "rb") as template:
+                digest.update(template.read())
+    return digest.hexdigest()[:16]
+
+
+class CourseConditionalGetMixin:
+    """Answers conditional GETs from the version of self.course, without
+    rendering the page. Pages also depend on the user and on the CSRF token
+    they embed, so both are part of the (weak) ETag, along with
+    pages_fingerprint()."""
+
+    def get(self, request, *args, **kwargs):
+        csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")
+        session = hashlib.sha256(
+            f"{request.user.pk}:{csrf_cookie}".encode()
+        ).hexdigest()[:16]
+        etag = (
+            f'W/"{self.course.pk}-{self.course.version}-{pages_fingerprint()}-'
+            f'{session}"'
+        )
+        return conditional_course_response(
+            request,
+            self.course,
+            etag,
+            lambda: super(CourseConditionalGetMixin, self).get(
+                request, *args, **kwargs
+            ),
+        )
+
+
+def set_coursepoint_state(course, coursepoint, state, next_state):
+    """Move 'coursepoint' from 'state' to 'next_state', along with the
+    current position of the course and the change log, in one transaction.
+    Returns the new current position."""
+    with transaction.atomic():
+        coursepoint.state_id = next_state.pk
+        coursepoint.save(update_fields=["state"])
+        current_position = move_course_current_position(
+            course, coursepoint, state.terminal, next_state.terminal
+        )
+        record_changes(course.pk, [(COURSEPOINT, coursepoint.pk, False)])
+    return current_position
+
+
 @login_required
 @require_POST
-def cycle_state(request):
+async def cycle_state(request):
     """Cycle through posible states of the point."""
     try:
         data = json.loads(request.body)
         coursepoint_id = data["coursepointId"]
 
-        coursepoint = CoursePoint.objects.get(id=coursepoint_id)
+        coursepoint = await CoursePoint.objects.select_related("course").aget(
+            id=coursepoint_id
+        )
         course = coursepoint.course
-        if course.user != request.user:
+        user = await request.auser()
+        if course.user_id != user.pk:
             raise Exception("Unauthorized access")
-        point_type = coursepoint.point.point_type
-        state = coursepoint.state
-        next_state = state
-        current_position = coursepoint.course.current_position
-        done = False
-        if state:
-            num_states = (
-                DeliveryState.objects.filter(point_type_id=point_type.id).aggregate(
-                    Max("position", default=0)
-                )["position__max"]
-                + 1
-            )
-            next_state_position = (state.position + 1) % num_states
-            next_state = DeliveryState.objects.get(
-                point_type_id=point_type.id, position=next_state_position
-            )
-            coursepoint.state = next_state
-            coursepoint.save()
-            current_position = update_course_current_position(coursepoint.course)
-            done = next_state_position == num_states
+        state = await statemachine.aget_state(coursepoint.state_id)
+        if state is None:
+            raise Exception("The point has no delivery state")
+        next_state = await statemachine.aget_state(state.next_pk)
+        current_position = await sync_to_async(set_coursepoint_state)(
+            course, coursepoint, state, next_state
+        )
 
         return JsonResponse(
             {
@@ -118,9 +254,9 @@ def cycle_state(request):
                 "stateId": next_state.pk,
                 "statePosition": next_state.position,
                 "stateDisplayName": next_state.display_name,
-                "cssClassesStr": next_state.css_class if next_state else "",
+                "cssClassesStr": next_state.css_class,
                 "currentPosition": current_position,
-                "done": done,
+                "done": next_state.terminal,
             }
         )
 
@@ -128,6 +264,204 @@ def cycle_state(request):
         return JsonResponse({"status": "error", "message": str(e)}, status=400)
 
 
+MAX_SYNC_OPERATIONS = 500
+# Largest value of StateSyncOperation.client_seq.
+MAX_CLIENT_SEQ = 2**63 - 1
+
+
+def state_sync_response(state):
+    return {
+        "stateId": state.pk,
+        "statePosition": state.position,
+        "stateDisplayName": state.display_name,
+        "cssClassesStr": state.css_class,
+        "done": state.terminal,
+    }
+
+
+@login_required
+@require_POST
+def sync_states(request):
+    """Apply a batch of state changes queued by a client.
+
+    The body is {"clientId": str, "operations": [{"coursePointId": int,
+    "targetStateId": int, "clientSeq": int}, ...]}. Operations are applied
+    in clientSeq order in one transaction; operations already received
+    with the same clientId and clientSeq are skipped. The response holds
+    the result of each operation, the final state of every course point
+    mentioned and the current position of the affected courses."""
+    try:
+        data = json.loads(request.body)
+        client_id = str(data["clientId"])[:64]
+        operations = sorted(
+            (
+                {
+                    "coursePointId": int(operation["coursePointId"]),
+                    "targetStateId": int(operation["targetStateId"]),
+                    "clientSeq": int(operation["clientSeq"]),
+                }
+                for operation in data["operations"]
+            ),
+            key=lambda operation: operation["clientSeq"],
+        )
+        if len(operations) > MAX_SYNC_OPERATIONS:
+            raise Exception(
+                f"Too many operations (at most {MAX_SYNC_OPERATIONS} per request)"
+            )
+        for operation in operations:
+            if not 0 <= operation["clientSeq"] <= MAX_CLIENT_SEQ:
+                raise Exception(f"Invalid clientSeq: {operation['clientSeq']}")
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
+    with transaction.atomic():
+        # Batches of the same user are applied one at a time, so that an
+        # operation sent twice at once is only applied by one of them. The
+        # unique key of the operations rolls back the other batch otherwise.
+        User.objects.select_for_update().only("pk").get(pk=request.user.pk)
+        seen = set(
+            StateSyncOperation.objects.filter(
+                user=request.user,
+                client_id=client_id,
+                client_seq__in=[operation["clientSeq"] for operation in operations],
+            ).values_list("client_seq", flat=True)
+        )
+        coursepoints = (
+            CoursePoint.objects.filter(
+                pk__in=[operation["coursePointId"] for operation in operations],
+                course__user=request.user,
+            )
+            .select_related("point")
+            .only("id", "course_id", "state_id", "point__point_type_id")
+        )
+        coursepoints = {coursepoint.pk: coursepoint for coursepoint in coursepoints}
+
+        results = []
+        received = []
+        changed = {}
+        for operation in operations:
+            client_seq = operation["clientSeq"]
+            if client_seq in seen:
+                results.append({"clientSeq": client_seq, "status": "duplicate"})
+                continue
+            seen.add(client_seq)
+            coursepoint = coursepoints.get(operation["coursePointId"])
+            state = statemachine.get_state(operation["targetStateId"])
+            accepted = (
+                coursepoint is not None
+                and state is not None
+                and state.point_type_id == coursepoint.point.point_type_id
+            )
+            if accepted:
+                coursepoint.state_id = state.pk
+                changed[coursepoint.pk] = coursepoint
+                results.append({"clientSeq": client_seq, "status": "applied"})
+            else:
+                results.append(
+                    {
+                        "clientSeq": client_seq,
+                        "status": "rejected",
+                        "message": "Unknown course point or invalid state",
+                    }
+                )
+            received.append(
+                StateSyncOperation(
+                    user=request.user,
+                    client_id=client_id,
+                    client_seq=client_seq,
+                    coursepoint_id=coursepoint.pk if coursepoint else None,
+                    state_id=state.pk if accepted else None,
+                    accepted=accepted,
+                )
+            )
+
+        CoursePoint.objects.bulk_update(changed.values(), ["state"])
+        StateSyncOperation.objects.bulk_create(received)
+        current_positions = {}
+        course_ids = {coursepoint.course_id for coursepoint in changed.values()}
+        for course in Course.objects.filter(pk__in=course_ids):
+            current_positions[course.pk] = update_course_current_position(course)
+        changes_by_course = {}
+        for coursepoint in changed.values():
+            changes_by_course.setdefault(coursepoint.course_id, []).append(
+                (COURSEPOINT, coursepoint.pk, False)
+            )
+        record_course_changes(changes_by_course)
+
+    states = {}
+    for coursepoint in coursepoints.values():
+        state = statemachine.get_state(coursepoint.state_id)
+        if state is not None:
+            states[coursepoint.pk] = {
+                "coursePointId": coursepoint.pk,
+                **state_sync_response(state),
+            }
+    return JsonResponse(
+        {
+            "status": "ok",
+            "results": results,
+            "states": list(states.values()),
+            "currentPositions": current_positions,
+        }
+    )
+
+
+@login_required
+@require_GET
+def course_changes(request, course):
+    """The changes to a course since a version, for clients keeping a copy.
+
+    The query string holds "since" (the "version" of the previous sync, 0
+    for everything) or "cursor" (the "nextCursor" of the previous page),
+    and optionally "limit". See utils/changelog.py."""
+    course = get_object_or_404(Course, pk=course, user=request.user)
+    try:
+        since = int(request.GET.get("since", 0))
+        limit = int(request.GET.get("limit", DEFAULT_PAGE_SIZE))
+        cursor = request.GET.get("cursor")
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+    delta = changes_since(course, since=since, cursor=cursor, limit=limit)
+    return JsonResponse(
+        {
+            "status": "ok",
+            "courseId": course.pk,
+            "currentPosition": course.current_position,
+            **delta,
+        }
+    )
+
+
+@login_required
+@require_GET
+def search_points(request):
+    """The course points of the user matching the "q" query string
+    parameter, best first, optionally in the course "course" and up to
+    "limit" of them. See utils/search.py."""
+    text = request.GET.get("q", "").strip()
+    if not text:
+        return JsonResponse(
+            {"status": "error", "message": "You must specify a query"}, status=400
+        )
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_SEARCH_LIMIT))
+        course = request.GET.get("course")
+        if course is not None:
+            course = get_object_or_404(Course, pk=int(course), user=request.user)
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+    return JsonResponse(
+        {
+            "status": "ok",
+            "results": search_course_points(
+                request.user, text, course=course, limit=limit
+            ),
+        }
+    )
+
+
 @login_required
 def index(request):
     return redirect(reverse("syllabooster:courselist"))
@@ -142,62 +476,130 @@ class CourseListView(LoginRequiredMixin, ListView):
         return Course.objects.filter(user=loggedin_user)
 
 
-class UnitListView(LoginRequiredMixin, CustomUserPassesTestMixin, ListView):
+class KeysetPageMixin:
+    """Shows a KeysetPage (see utils/keyset.py) of the queryset as the
+    object list: the one after the "after" key or before the "before" key
+    of the query string, or else the one around get_page_position()."""
+
+    def get(self, request, *args, **kwargs):
+        try:
+            for key in ("after", "before"):
+                if key in request.GET:
+                    decode_key(request.GET[key])
+        except ValueError:
+            return HttpResponseBadRequest("Invalid page key")
+        return super().get(request, *args, **kwargs)
+
+    def get_page_position(self):
+        return None
+
+    def get_context_data(self, **kwargs):
+        page = KeysetPage(
+            self.object_list,
+            after=self.request.GET.get("after"),
+            before=self.request.GET.get("before"),
+            position=self.get_page_position,
+            size=settings.LIST_PAGE_SIZE,
+        )
+        context = super().get_context_data(object_list=page, **kwargs)
+        context["page"] = page
+        return context
+
+
+class FragmentMixin:
+    """The rows of another page after or before a key, for "load more"."""
+
+    def get(self, request, *args, **kwargs):
+        if "after" not in request.GET and "before" not in request.GET:
+            return HttpResponseBadRequest("Missing page key")
+        return super().get(request, *args, **kwargs)
+
+
+class UnitListView(
+    LoginRequiredMixin,
+    CustomUserPassesTestMixin,
+    KeysetPageMixin,
+    CourseConditionalGetMixin,
+    ListView,
+):
     model = Unit
+    context_object_name = "unit_list"
     template_name = "syllabooster/unit_list.html"
 
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
         self.course = get_object_or_404(Course, id=self.kwargs["course"])
+        # Only evaluated when the cached unit list has to be rendered again.
+        self.current_unit = SimpleLazyObject(
+            lambda: get_course_current_unit(self.course)
+        )
 
     def test_func(self):
-        return self.course.user == self.request.user
+        return self.course.user_id == self.request.user.pk
 
     def get_queryset(self):
         return Unit.objects.filter(course=self.course)
 
+    def get_page_position(self):
+        return self.current_unit.position if self.current_unit else None
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["course"] = self.course
-        context["currentunit"] = get_course_current_unit(self.course)
+        context["currentunit"] = self.current_unit
+        context["fragment_cache_timeout"] = settings.FRAGMENT_CACHE_TIMEOUT
+        context["pages_fingerprint"] = pages_fingerprint()
         return context
 
 
-class UnitView(LoginRequiredMixin, CustomUserPassesTestMixin, ListView):
+class UnitListFragmentView(FragmentMixin, UnitListView):
+    template_name = "syllabooster/unit_list_items.html"
+
+
+class UnitView(
+    LoginRequiredMixin,
+    CustomUserPassesTestMixin,
+    KeysetPageMixin,
+    CourseConditionalGetMixin,
+    ListView,
+):
     model = CoursePoint
+    context_object_name = "coursepoint_list"
     template_name = "syllabooster/unitcoursepoint_list.html"
 
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
         self.course = get_object_or_404(Course, id=self.kwargs["course"])
-        self.unit = get_object_or_404(Unit, id=self.kwargs["unit"])
+        self.unit = get_object_or_404(Unit, id=self.kwargs["unit"], course=self.course)
 
     def test_func(self):
-        return self.course.user == self.request.user
+        return self.course.user_id == self.request.user.pk
 
     def get_queryset(self):
-        min_position = CoursePoint.objects.filter(
-            course=self.course, unit=self.unit
-        ).aggregate(Min("position"))["position__min"]
         return (
             CoursePoint.objects.filter(course=self.course, unit=self.unit)
-            .annotate(relative_position=F("position") - min_position + 1)
-            .annotate(
-                type_relative_position=Window(
-                    expression=RowNumber(),
-                    partition_by=[F("point__point_type")],
-                    order_by=F("position").asc(),
-                )
-            )
+            .select_related("point__point_type", "state")
+            .defer("point__contents", "point__html", "point__search_vector")
         )
 
+    def get_page_position(self):
+        # Deep links land on the page of the current point, if it is in
+        # this unit or a later one.
+        return self.course.current_position
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["course"] = self.course
         context["unit"] = self.unit
+        context["fragment_cache_timeout"] = settings.FRAGMENT_CACHE_TIMEOUT
+        context["pages_fingerprint"] = pages_fingerprint()
         return context
 
 
+class UnitFragmentView(FragmentMixin, UnitView):
+    template_name = "syllabooster/unitcoursepoint_list_items.html"
+
+
 def currentView(request, course):
     course_obj = get_object_or_404(Course, id=course)
     unit = get_course_current_unit(course_obj)
@@ -213,21 +615,44 @@ class CoursePointView(LoginRequiredMixin, CustomUserPassesTestMixin, DetailView)
     model = CoursePoint
     template_name = "syllabooster/coursepoint_detail.html"
 
+    def get_queryset(self):
+        # The neighbours in (position, id) order are looked up on the
+        # (course, position) index, so only the requested row is read whole.
+        siblings = CoursePoint.objects.filter(course_id=OuterRef("course_id"))
+        position, pk = OuterRef("position"), OuterRef("pk")
+        previous = siblings.filter(
+            Q(position__lt=position) | Q(position=position, pk__lt=pk)
+        ).order_by("-position", "-pk")
+        following = siblings.filter(
+            Q(position__gt=position) | Q(position=position, pk__gt=pk)
+        ).order_by("position", "pk")
+        return (
+            CoursePoint.objects.select_related(
+                "course", "unit", "point__point_type", "state"
+            )
+            .defer("point__search_vector")
+            .annotate(
+                previous_point_id=Subquery(previous.values("pk")[:1]),
+                next_point_id=Subquery(following.values("pk")[:1]),
+            )
+        )
+
+    def get_object(self, queryset=None):
+        # Cached, since test_func() needs it before get() does.
+        if getattr(self, "object", None) is None:
+            self.object = super().get_object(queryset)
+        return self.object
+
     def test_func(self):
         obj = self.get_object()
-        return obj.course.user == self.request.user
+        return obj.course.user_id == self.request.user.pk
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        obj = self.get_object()
-        context["type_relative_position"] = CoursePoint.objects.filter(
-            course=obj.course,
-            unit=obj.unit,
-            point__point_type=obj.point.point_type,
-            position__lte=obj.position,
-        ).count()
-        context["previous_point"] = obj.previous_course_point()
-        context["next_point"] = obj.next_course_point()
+        obj = self.object
+        context["type_relative_position"] = obj.type_relative_position
+        context["previous_point_id"] = obj.previous_point_id
+        context["next_point_id"] = obj.next_point_id
         context["html_content"] = mark_safe(obj.point.get_html())
         return context
 
@@ -258,45 +683,185 @@ def google_login_get_credentials():
 
 
 def unauthorised(request):
-    return render(request, reverse("syllabooster:unauthorised"))
+    return render(request, "syllabooster/unauthorised.html")
 
 
-@csrf_exempt
+@login_required
 @require_POST
-def api_import_org(request):
-    data = json.loads(request.body)
-    result = importstr.import_course(
-        data["course_name"], data["input_string"], data["username"], "org"
-    )
-    if result and result["status"] == "ok":
-        return JsonResponse(result)
+async def api_import_org(request):
+    """Queue the import of an org or Markdown course of the logged in user
+    and return the id of the job.
+
+    The course is either sent as JSON (course_name, input_string, username
+    and optionally input_format, "org" or "md"), or, for large courses, as
+    the raw file with a text/* content type (text/markdown for Markdown)
+    and course_name and username in the query string. Raw files are spooled
+    to disk without being read into memory, and refused with a 413 if
+    larger than settings.IMPORT_MAX_UPLOAD_SIZE. Anonymous requests are
+    redirected to the login page before the body is read, and only
+    superusers may import for another user.
+    """
+    token = uuid.uuid4()
+    input_string = ""
+    input_path = ""
+    raw = request.content_type.startswith("text/")
+    if raw:
+        username = request.GET.get("username")
+        course_name = request.GET.get("course_name")
+        input_format = "md" if request.content_type == "text/markdown" else "org"
+        if not username or not course_name:
+            return JsonResponse(
+                {
+                    "status": "error",
+                    "message": "You must specify a course_name and a username",
+                },
+                status=400,
+            )
     else:
-        return JsonResponse(result, status=400)
+        data = json.loads(request.body)
+        username = data["username"]
+        course_name = data["course_name"]
+        input_string = data["input_string"]
+        input_format = data.get("input_format", "org")
+    if input_format not in COURSE_PARSERS:
+        return JsonResponse(
+            {"status": "error", "message": f"Unsupported format: {input_format}"},
+            status=400,
+        )
+    user = await request.auser()
+    if username != user.username:
+        if not user.is_superuser:
+            return JsonResponse(
+                {"status": "error", "message": "Unauthorized access"}, status=403
+            )
+        try:
+            user = await User.objects.aget(username=username)
+        except User.DoesNotExist:
+            return JsonResponse(
+                {"status": "error", "message": f"User {username} does not exist"},
+                status=400,
+            )
+    if raw:
+        input_path = spool_path(token, input_format)
+        try:
+            await sync_to_async(spool_input)(request, input_path)
+        except InputTooLarge as e:
+            return JsonResponse({"status": "error", "message": str(e)}, status=413)
+    job = await ImportJob.objects.acreate(
+        token=token,
+        user=user,
+        course_name=course_name,
+        input_format=input_format,
+        input_string=input_string,
+        input_path=input_path,
+    )
+    return JsonResponse(
+        {
+            **job_status(job),
+            "statusUrl": reverse("syllabooster:importjob", args=[job.token]),
+        },
+        status=202,
+    )
 
 
 @csrf_exempt
-def api_export_org(request):
+async def api_import_job(request, token):
+    try:
+        job = await ImportJob.objects.aget(token=token)
+    except ImportJob.DoesNotExist:
+        return JsonResponse(
+            {"status": "error", "message": "Import job not found"}, status=404
+        )
+    return JsonResponse(job_status(job))
+
+
+async def aget_export_course(request):
+    """The course named by the "username" and "coursename" parameters of an
+    export request, or the error response to send instead."""
     username = request.GET.get("username")
     if not username:
-        return JsonResponse(
+        return None, JsonResponse(
             {"status": "error", "message": "You must specify a username"}, status=400
         )
     coursename = request.GET.get("coursename")
     if not coursename:
-        return JsonResponse(
+        return None, JsonResponse(
             {"status": "error", "message": "You must specify a course name"}, status=400
         )
-    user = None
-    course = None
-    try:
-        user = User.objects.get(username=username)
-    except Exception as e:
-        return JsonResponse({"status": "error", "message": str(e)}, status=400)
     try:
-        course = Course.objects.get(user=user, name=coursename)
+        user = await User.objects.aget(username=username)
+        course = await Course.objects.aget(user=user, name=coursename)
     except Exception as e:
-        return JsonResponse({"status": "error", "message": str(e)}, status=400)
-    result = export_course_org(course)
-    response = HttpResponse(result, content_type="text/org; charset=utf-8")
-    response["Content-Disposition"] = 'attachment; filename="course.org"'
-    return response
+        return None, JsonResponse({"status": "error", "message": str(e)}, status=400)
+    return course, None
+
+
+@csrf_exempt
+async def api_export_org(request):
+    course, error = await aget_export_course(request)
+    if error is not None:
+        return error
+
+    def export():
+        # Under WSGI an asynchronous iterator would be consumed whole before
+        # sending the response, so only stream asynchronously under ASGI.
+        if isinstance(request, ASGIRequest):
+            chunks = aexport_course_org(course)
+        else:
+            chunks = export_course_org(course)
+        response = StreamingHttpResponse(chunks, content_type="text/org; charset=utf-8")
+        response["Content-Disposition"] = 'attachment; filename="course.org"'
+        return response
+
+    # Unchanged courses are answered with a 304 without reading any point.
+    return conditional_course_response(
+        request, course, f'"{course.pk}-{course.version}"', export
+    )
+
+
+async def aiterate(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@csrf_exempt
+async def api_export_snapshot(request):
+    """The course as a columnar JSON snapshot (see utils/snapshot.py),
+    gzipped for clients that accept it."""
+    course, error = await aget_export_course(request)
+    if error is not None:
+        return error
+
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+    etag = f'"{course.pk}-{course.version}-snapshot' + ('-gzip"' if gzipped else '"')
+
+    async def export():
+        # All the queries are run here: the stream is only encoded.
+        snapshot = await sync_to_async(course_snapshot)(course)
+        chunks = snapshot_json(snapshot)
+        if gzipped:
+            chunks = gzip_chunks(chunks)
+        if isinstance(request, ASGIRequest):
+            chunks = aiterate(chunks)
+        response = StreamingHttpResponse(chunks, content_type="application/json")
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    return await aconditional_course_response(request, course, etag, export)
+
+
+@require_GET
+def metrics(request):
+    """Per-view metrics, in the Prometheus text format (see
+    utils/metrics.py). Only served to METRICS_ALLOWED_IPS and never through
+    a proxy."""
+    if (
+        request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS
+        or "HTTP_X_FORWARDED_FOR" in request.META
+    ):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )